@@ -0,0 +1,221 @@
+"""Times and memory-profiles the public methods of the recommenders on
+synthetic power-law ratings and writes the results as JSON.
+
+    python -m benchmarks.run --ratings 1000000 --output after.json
+    python -m benchmarks.run --ratings 1000000 --compare before.json
+
+Every (recommender, method) result holds the wall time of the whole phase,
+the fastest and the median of --repeats runs after --warmup untimed ones,
+the number of calls, the time per call and, unless --no-memory, the peak
+traced allocation of one more run of the phase under tracemalloc.
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.synthetic import generate_table, to_models
+from recommender.clustering import KMeansRecommender
+from recommender.factorization import ALSRecommender
+from recommender.recommend import ItemBasedRecommender, UserBasedRecommender
+
+
+def measure(function, calls=1, memory=True, repeats=5, warmup=1):
+    """Returns the result dict of running function, which makes calls calls.
+
+    function runs warmup times untimed, then repeats timed times. seconds
+    and per_call are taken from the fastest run, which is the least affected
+    by other load on the machine, and median_seconds from the median run.
+    """
+
+    for _ in range(warmup):
+        function()
+
+    times = []
+    for _ in range(max(repeats, 1)):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    seconds = min(times)
+    result = {"calls": calls,
+              "repeats": len(times),
+              "seconds": seconds,
+              "median_seconds": float(np.median(times)),
+              "per_call": seconds / max(calls, 1)}
+
+    if memory:
+        tracemalloc.start()
+        try:
+            function()
+            result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return result
+
+
+def _drain(results):
+    for _ in results:
+        pass
+
+
+def weighted_suite(recommender, table, users, items, user_ids, item_ids, n):
+    """Returns the (method, function, calls) phases of a weighted similarity
+    recommender, loaded from the list of Users and straight from the table.
+    """
+    similarity = recommender.get_similarity()
+
+    return [
+        ("load", lambda: recommender.load(users, items), 1),
+        ("load_table", lambda: recommender.load_table(table, items), 1),
+        ("score_matrix", lambda: similarity.score_matrix(recommender.get_item_preferences(), k=n,
+                                                         inverted=recommender.get_preferences()), 1),
+        ("similar_users", lambda: [recommender.similar_users(user_id, n) for user_id in user_ids], len(user_ids)),
+        ("similar_items", lambda: [recommender.similar_items(item_id, n) for item_id in item_ids], len(item_ids)),
+        ("recommendations", lambda: [recommender.recommendations(user_id, n) for user_id in user_ids], len(user_ids)),
+        ("similar_users_batch", lambda: _drain(recommender.similar_users_batch(user_ids, n)), len(user_ids)),
+        ("similar_items_batch", lambda: _drain(recommender.similar_items_batch(item_ids, n)), len(item_ids)),
+        ("recommendations_batch", lambda: _drain(recommender.recommendations_batch(user_ids, n)), len(user_ids)),
+    ]
+
+
+def model_suite(recommender, users, items, user_ids, item_ids, n):
+    """Returns the phases of a recommender trained on the list of Users."""
+    return [
+        ("load", lambda: recommender.load(users, items), 1),
+        ("similar_users", lambda: [recommender.similar_users(user_id, n) for user_id in user_ids], len(user_ids)),
+        ("similar_items", lambda: [recommender.similar_items(item_id, n) for item_id in item_ids], len(item_ids)),
+        ("recommendations", lambda: [recommender.recommendations(user_id, n) for user_id in user_ids], len(user_ids)),
+    ]
+
+
+def run(args):
+    table = generate_table(args.ratings, args.users, args.items, seed=args.seed)
+    users, items = to_models(table)
+
+    # Query ids are drawn among users and items with ratings, the others are
+    # unknown to the sparse matrices
+    random = np.random.default_rng(args.seed)
+    rated_users = np.unique(table.user_index)
+    rated_items = np.unique(table.item_index)
+    user_ids = [table.user_ids[i] for i in random.choice(rated_users, min(args.queries, len(rated_users)), replace=False).tolist()]
+    item_ids = [table.item_ids[i] for i in random.choice(rated_items, min(args.queries, len(rated_items)), replace=False).tolist()]
+
+    suites = [
+        ("ItemBasedRecommender[sparse]", lambda: weighted_suite(ItemBasedRecommender(storage="sparse"), table, users, items, user_ids, item_ids, args.n)),
+        ("UserBasedRecommender[sparse]", lambda: weighted_suite(UserBasedRecommender(storage="sparse"), table, users, items, user_ids, item_ids, args.n)),
+        ("KMeansRecommender", lambda: model_suite(KMeansRecommender(k=args.clusters, seed=args.seed), users, items, user_ids, item_ids, args.n)),
+        ("ALSRecommender", lambda: model_suite(ALSRecommender(factors=args.factors, seed=args.seed), users, items, user_ids, item_ids, args.n)),
+    ]
+    # Dict storage scans every row in Python per query, so it is only run
+    # at small scales
+    if args.ratings <= args.dict_limit:
+        suites += [
+            ("ItemBasedRecommender[dict]", lambda: weighted_suite(ItemBasedRecommender(storage="dict"), table, users, items, user_ids, item_ids, args.n)),
+            ("UserBasedRecommender[dict]", lambda: weighted_suite(UserBasedRecommender(storage="dict"), table, users, items, user_ids, item_ids, args.n)),
+        ]
+
+    results = []
+    for name, suite in suites:
+        if args.only and args.only not in name:
+            continue
+
+        for method, function, calls in suite():
+            timing = measure(function, calls, memory=args.memory, repeats=args.repeats, warmup=args.warmup)
+            result = dict(recommender=name, method=method, **timing)
+            results.append(result)
+            print("{:<30} {:<24} {:>10.4f}s {:>10.6f}s/call".format(name, method, result["seconds"], result["per_call"]),
+                  file=sys.stderr)
+
+    return {"meta": metadata(args, table), "results": results}
+
+
+def metadata(args, table):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {"commit": commit,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "ratings": len(table),
+            "users": len(table.user_ids),
+            "items": len(table.item_ids),
+            "queries": args.queries,
+            "n": args.n,
+            "seed": args.seed}
+
+
+def compare(base, current, tolerance):
+    """Prints the time ratio of every result also in base and returns the
+    number of results slower than base by more than tolerance. Both are
+    compared on their fastest run.
+    """
+    base_results = {(result["recommender"], result["method"]): result for result in base["results"]}
+
+    regressions = 0
+    for result in current["results"]:
+        previous = base_results.get((result["recommender"], result["method"]))
+        if previous is None or previous["per_call"] == 0:
+            continue
+
+        ratio = result["per_call"] / previous["per_call"]
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "REGRESSION"
+            regressions += 1
+
+        print("{:<30} {:<24} {:>8.2f}x {}".format(result["recommender"], result["method"], ratio, flag), file=sys.stderr)
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ratings", type=int, default=100000, help="number of synthetic ratings, e.g. 10000 to 10000000")
+    parser.add_argument("--users", type=int, default=None)
+    parser.add_argument("--items", type=int, default=None)
+    parser.add_argument("--queries", type=int, default=100, help="user and item ids queried per method")
+    parser.add_argument("--n", type=int, default=10, help="results per query")
+    parser.add_argument("--clusters", type=int, default=20, help="k of KMeansRecommender")
+    parser.add_argument("--factors", type=int, default=32, help="factors of ALSRecommender")
+    parser.add_argument("--dict-limit", type=int, default=100000, help="largest scale run with dict storage")
+    parser.add_argument("--only", default=None, help="only run recommenders whose name contains this")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=5, help="timed runs per phase, the fastest is reported")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs per phase before timing")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip the tracemalloc runs")
+    parser.add_argument("--output", default=None, help="JSON file to write, stdout by default")
+    parser.add_argument("--compare", default=None, help="JSON results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="slowdown reported as a regression")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as base_file:
+            regressions = compare(json.load(base_file), report, args.tolerance)
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""Synthetic rating data shaped like the MovieLens datasets.
+
+User activity and item popularity follow power laws (Zipf-like weights
+rank ** -exponent), so a few users rate a lot of items and a few items get
+most of the ratings. Ratings are half stars from 0.5 to 5 around a per-item
+quality shifted by a per-user bias.
+"""
+
+import numpy as np
+
+from recommender.models import User, Item
+from recommender.table import RatingTable
+
+
+def power_law_weights(size, exponent, random):
+    """Returns size probabilities proportional to rank ** -exponent, in a
+    random order so popularity is not correlated with ids.
+    """
+    weights = np.arange(1, size + 1, dtype=np.float64) ** -exponent
+    random.shuffle(weights)
+
+    return weights / weights.sum()
+
+
+def generate_table(ratings, users=None, items=None, user_exponent=0.6, item_exponent=0.8, seed=0):
+    """Returns a RatingTable of about ratings distinct ratings.
+
+    users and items default to the MovieLens proportions, about 150 ratings
+    per user and ratings ** 0.6 items, so larger scales are sparser.
+    """
+    random = np.random.default_rng(seed)
+    users = users or max(10, ratings // 150)
+    items = items or max(10, int(ratings ** 0.6))
+    ratings = min(ratings, users * items)
+
+    user_cdf = np.cumsum(power_law_weights(users, user_exponent, random))
+    item_cdf = np.cumsum(power_law_weights(items, item_exponent, random))
+
+    # Draw (user, item) pairs until there are enough distinct ones, popular
+    # pairs are drawn several times
+    pairs = np.zeros(0, dtype=np.int64)
+    while len(pairs) < ratings:
+        size = 2 * (ratings - len(pairs))
+        drawn_users = np.minimum(np.searchsorted(user_cdf, random.random(size)), users - 1)
+        drawn_items = np.minimum(np.searchsorted(item_cdf, random.random(size)), items - 1)
+        pairs = np.unique(np.concatenate((pairs, drawn_users.astype(np.int64) * items + drawn_items)))
+    pairs = random.permutation(pairs)[:ratings]
+
+    user_index = pairs // items
+    item_index = pairs % items
+
+    quality = random.normal(3.5, 0.5, size=items)
+    bias = random.normal(0, 0.4, size=users)
+    noise = random.normal(0, 0.8, size=ratings)
+    values = np.clip(np.round(2 * (quality[item_index] + bias[user_index] + noise)) / 2, 0.5, 5)
+
+    return RatingTable(user_index, item_index, values, range(1, users + 1), range(1, items + 1))
+
+
+def to_models(table):
+    """Returns the Users and Items of a RatingTable, for recommenders that
+    only load model objects.
+    """
+    users = [User(user_id, str(user_id)) for user_id in table.user_ids]
+    items = [Item(item_id, str(item_id)) for item_id in table.item_ids]
+
+    for user, item, rating in zip(table.user_index.tolist(), table.item_index.tolist(), table.ratings.tolist()):
+        users[user].add_preference(table.item_ids[item], rating)
+
+    return users, items
@@ -1,5 +1,7 @@
 from abc import ABCMeta, abstractmethod
 
+from grouplens.cache import save_snapshot, load_snapshot
+
 class GroupLens(metaclass=ABCMeta):
     """Interface for all GroupLens datasets."""
 
@@ -14,3 +16,42 @@ class GroupLens(metaclass=ABCMeta):
     @abstractmethod
     def get_recommender_users(self):
         raise NotImplementedError
+
+    @abstractmethod
+    def get_rating_table(self):
+        """Returns the ratings as a recommender.table.RatingTable."""
+        raise NotImplementedError
+
+    def save_cache(self, path, sources):
+        """Saves the parsed dataset to a binary snapshot at path, stamped with
+        the size and mtime of the source files it was parsed from.
+        """
+        try:
+            save_snapshot(path, sources, self._snapshot_arrays())
+        except Exception as e:
+            print("Could not save cache.", e)
+
+    def load_cache(self, path, sources, lazy=False):
+        """Loads the dataset from the snapshot at path. Returns False and
+        leaves the dataset untouched if there is no snapshot or if any source
+        file changed since it was saved. With lazy, metadata is restored as
+        offset indexes of the source files instead of being read.
+        """
+        arrays = load_snapshot(path, sources)
+        if arrays is None:
+            return False
+
+        self._restore_snapshot(arrays, sources, lazy)
+        return True
+
+    @abstractmethod
+    def _snapshot_arrays(self):
+        """Returns the dataset as a dict of arrays for save_cache."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def _restore_snapshot(self, arrays, sources, lazy=False):
+        """Restores the dataset from the dict of arrays of _snapshot_arrays,
+        saved from the source files sources.
+        """
+        raise NotImplementedError
@@ -3,8 +3,12 @@ from models.rating import BookRating
 from models.user import User
 
 from grouplens.GroupLens import GroupLens
+from grouplens.cache import pack_column, unpack_column, pack_table, unpack_table, pack_index, unpack_index
+from grouplens.ingest import read_rating_table, run_concurrently
+from grouplens.metadata import CsvIndex, LazyItem
 
 from recommender.models import User as RecommenderUser, Item as RecommenderItem
+from recommender.table import RatingTable
 
 import os
 import csv
@@ -14,17 +18,61 @@ class BookCrossing(GroupLens):
         self._books = {}
         self._ratings = []
         self._users = {}
+        self._rating_table = None
+
+        # Offset indexes of the books and users files when loaded lazily
+        self._book_index = None
+        self._user_index = None
 
     def load_from_dir(self,
                       dir_name,
                       books_file_name="BX-Books.csv",
                       ratings_file_name="BX-Book-Ratings.csv",
-                      users_file_name="BX-Users.csv"):
-        self.load_books(os.path.join(dir_name, books_file_name))
-        self.load_ratings(os.path.join(dir_name, ratings_file_name))
-        self.load_users(os.path.join(dir_name, users_file_name))
+                      users_file_name="BX-Users.csv",
+                      columnar=False,
+                      cache_path=None,
+                      workers=1,
+                      lazy=False):
+        """Loads books, ratings and users. With columnar, ratings are parsed
+        into a RatingTable instead of one BookRating per row. With cache_path,
+        the dataset is loaded from that binary snapshot when it is up to date
+        with the CSV files, and the snapshot is rewritten otherwise, unless a
+        file could not be loaded.
+
+        With columnar and workers other than 1, the ratings are parsed over
+        workers processes (one per CPU when None) while the books and users
+        are loaded concurrently.
+
+        With lazy, books and users are only indexed by id, and their fields
+        are read from the CSV files when get_book, get_user or the value of
+        a recommender item asks for them. This holds for a dataset restored
+        from the snapshot too.
+        """
+        books_path = os.path.join(dir_name, books_file_name)
+        ratings_path = os.path.join(dir_name, ratings_file_name)
+        users_path = os.path.join(dir_name, users_file_name)
+
+        if cache_path is not None and self.load_cache(cache_path, [books_path, ratings_path, users_path], lazy=lazy):
+            return
+
+        load_books = self.index_books if lazy else self.load_books
+        load_users = self.index_users if lazy else self.load_users
+
+        if columnar and workers != 1:
+            loaded = run_concurrently([lambda: self.load_rating_table(ratings_path, workers=workers),
+                                       lambda: load_books(books_path),
+                                       lambda: load_users(users_path)])
+        else:
+            loaded = [load_books(books_path),
+                      self.load_rating_table(ratings_path) if columnar else self.load_ratings(ratings_path),
+                      load_users(users_path)]
+
+        # A file that failed to parse would be cached as empty
+        if cache_path is not None and all(loaded):
+            self.save_cache(cache_path, [books_path, ratings_path, users_path])
 
     def load_books(self, file_path):
+        self._book_index = None
         try:
             with open(file_path, 'r', encoding="iso-8859-1") as csv_file:
                 reader = csv.reader(csv_file, delimiter=';', quotechar='"')
@@ -36,6 +84,9 @@ class BookCrossing(GroupLens):
         except Exception as e:
             self._books = {}
             print("Could not load books.", e)
+            return False
+
+        return True
 
     def load_ratings(self, file_path):
         try:
@@ -49,8 +100,41 @@ class BookCrossing(GroupLens):
         except Exception as e:
             self._ratings = []
             print("Could not load ratings.", e)
+            return False
+
+        return True
+
+    def load_rating_table(self, file_path, chunk_size=100000, workers=1):
+        """Parses the ratings into a RatingTable, chunk_size rows at a time,
+        or with workers other than 1 by byte ranges over a process pool.
+        """
+        try:
+            if workers != 1:
+                table = read_rating_table(file_path, 0, 1, 2, user_type=int, item_type=str,
+                                          delimiter=';', encoding="ISO-8859-1", workers=workers)
+            else:
+                with open(file_path, 'r', encoding="ISO-8859-1") as csv_file:
+                    reader = csv.reader(csv_file, delimiter=';')
+                    # Skip header
+                    next(reader, None)
+                    table = RatingTable.from_rows(reader,
+                                                  user_column=0,
+                                                  item_column=1,
+                                                  rating_column=2,
+                                                  user_type=int,
+                                                  item_type=str,
+                                                  chunk_size=chunk_size)
+            # A rating of 0 is an implicit rating
+            self._rating_table = table.select(table.ratings != 0)
+        except Exception as e:
+            self._rating_table = None
+            print("Could not load ratings.", e)
+            return False
+
+        return True
 
     def load_users(self, file_path):
+        self._user_index = None
         try:
             with open(file_path, 'rt', encoding="ISO-8859-1") as csv_file:
                 reader = csv.reader(csv_file, delimiter=';')
@@ -62,15 +146,160 @@ class BookCrossing(GroupLens):
         except Exception as e:
             self._users = {}
             print("Could not load users. ", e)
+            return False
+
+        return True
+
+    def index_books(self, file_path):
+        """Indexes the rows of the books file by isbn instead of loading them."""
+        self._books = {}
+        try:
+            self._book_index = CsvIndex(file_path, key_type=str, delimiter=';', encoding="iso-8859-1")
+        except Exception as e:
+            self._book_index = None
+            print("Could not index books.", e)
+            return False
+
+        return True
+
+    def index_users(self, file_path):
+        """Indexes the rows of the users file by id instead of loading them."""
+        self._users = {}
+        try:
+            self._user_index = CsvIndex(file_path, key_type=int, delimiter=';', encoding="ISO-8859-1")
+        except Exception as e:
+            self._user_index = None
+            print("Could not index users.", e)
+            return False
+
+        return True
+
+    def get_book(self, isbn):
+        if self._book_index is None:
+            return self._books[isbn]
+
+        return self._book(self._book_index.fields(isbn))
+
+    def get_user(self, user_id):
+        if self._user_index is None:
+            return self._users[user_id]
+
+        return self._user(self._user_index.fields(user_id))
+
+    def _book(self, row):
+        return Book(isbn=row[0], title=row[1], author=row[2], publish_year=row[3], publisher=row[4])
+
+    def _user(self, row):
+        return User(user_id=int(row[0]), location=row[1], age=row[2])
+
+    def _user_ids(self):
+        return list(self._users) if self._user_index is None else list(self._user_index)
+
+    def _book_value(self, isbn):
+        return repr(self.get_book(isbn))
 
     def get_recommender_items(self):
+        if self._book_index is not None:
+            return [LazyItem(isbn, self._book_value) for isbn in self._book_index]
+
         return [RecommenderItem(book.get_isbn(), repr(book)) for book in self._books.values()]
 
     def get_recommender_users(self):
-        recommender_users = {user.get_id(): RecommenderUser(user.get_id(), repr(user)) for user in self._users.values()}
+        if not self._ratings and self._rating_table is not None:
+            return self._recommender_users_from_table()
+
+        # The repr of a User is its id, so users are valued without reading
+        # their rows
+        recommender_users = {user_id: RecommenderUser(user_id, str(user_id)) for user_id in self._user_ids()}
 
         for rating in self._ratings:
-            if rating.get_rating() != "0":
+            if rating.get_rating() != 0:
                 recommender_users[rating.get_user_id()].add_preference(rating.get_book_isbn(), rating.get_rating())
 
         return list(recommender_users.values())
+
+    def get_rating_table(self):
+        """Returns the explicit ratings as a RatingTable, built from the loaded
+        BookRatings unless they were loaded with load_rating_table.
+        """
+
+        if self._rating_table is None:
+            rows = ((rating.get_user_id(), rating.get_book_isbn(), rating.get_rating())
+                    for rating in self._ratings if rating.get_rating() != 0)
+            self._rating_table = RatingTable.from_rows(rows, 0, 1, 2, user_type=int, item_type=str)
+
+        return self._rating_table
+
+    def _recommender_users_from_table(self):
+        # Views over the table columns for the users with ratings instead of
+        # one preference dict per user
+        table = self._rating_table
+        user_ids = self._user_ids()
+        recommender_users = table.users({user_id: str(user_id) for user_id in user_ids})
+
+        rated = set(table.user_ids)
+        recommender_users += [RecommenderUser(user_id, str(user_id)) for user_id in user_ids if user_id not in rated]
+
+        return recommender_users
+
+    def _snapshot_arrays(self):
+        arrays = {}
+
+        # Lazily loaded books and users are read in full for the snapshot,
+        # and their offsets are kept for lazy restores
+        if self._book_index is not None:
+            books = [self._book(row) for _, row in self._book_index.rows()]
+            pack_index(arrays, "books", self._book_index)
+        else:
+            books = list(self._books.values())
+
+        if self._user_index is not None:
+            users = [self._user(row) for _, row in self._user_index.rows()]
+            pack_index(arrays, "users", self._user_index)
+        else:
+            users = list(self._users.values())
+
+        pack_column(arrays, "books.isbn", [book.get_isbn() for book in books])
+        pack_column(arrays, "books.title", [book.get_title() for book in books])
+        pack_column(arrays, "books.author", [book.get_author() for book in books])
+        pack_column(arrays, "books.publish_year", [book.get_publish_year() for book in books])
+        pack_column(arrays, "books.publisher", [book.get_publisher() for book in books])
+        pack_column(arrays, "users.id", [user.get_id() for user in users])
+        pack_column(arrays, "users.location", [user.get_location() for user in users])
+        pack_column(arrays, "users.age", [user.get_age() for user in users])
+        pack_table(arrays, self.get_rating_table())
+
+        return arrays
+
+    def _restore_snapshot(self, arrays, sources, lazy=False):
+        books_path, _, users_path = sources
+
+        self._ratings = []
+        self._rating_table = unpack_table(arrays)
+
+        if lazy:
+            self._books = {}
+            self._users = {}
+            self._book_index = unpack_index(arrays, "books", books_path, delimiter=';', encoding="iso-8859-1")
+            self._user_index = unpack_index(arrays, "users", users_path, delimiter=';', encoding="ISO-8859-1")
+            # Snapshots of eagerly loaded metadata have no offsets
+            if self._book_index is None:
+                self.index_books(books_path)
+            if self._user_index is None:
+                self.index_users(users_path)
+            return
+
+        books = zip(unpack_column(arrays, "books.isbn"),
+                    unpack_column(arrays, "books.title"),
+                    unpack_column(arrays, "books.author"),
+                    unpack_column(arrays, "books.publish_year"),
+                    unpack_column(arrays, "books.publisher"))
+        users = zip(unpack_column(arrays, "users.id"),
+                    unpack_column(arrays, "users.location"),
+                    unpack_column(arrays, "users.age"))
+
+        self._books = {isbn: Book(isbn=isbn, title=title, author=author, publish_year=publish_year, publisher=publisher)
+                       for isbn, title, author, publish_year, publisher in books}
+        self._users = {user_id: User(user_id=user_id, location=location, age=age) for user_id, location, age in users}
+        self._book_index = None
+        self._user_index = None
@@ -1,4 +1,6 @@
 class Book(object):
+    __slots__ = ("_isbn", "_title", "_author", "_publish_year", "_publisher")
+
     def __init__(self, isbn, title, author, publish_year, publisher):
         self._isbn = isbn
         self._title = title
@@ -11,3 +13,15 @@ class Book(object):
 
     def get_isbn(self):
         return self._isbn
+
+    def get_title(self):
+        return self._title
+
+    def get_author(self):
+        return self._author
+
+    def get_publish_year(self):
+        return self._publish_year
+
+    def get_publisher(self):
+        return self._publisher
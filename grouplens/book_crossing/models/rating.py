@@ -1,4 +1,6 @@
 class BookRating(object):
+    __slots__ = ("_user_id", "_book_isbn", "_rating")
+
     def __init__(self, user_id, book_isbn, rating):
         self._user_id = user_id
         self._book_isbn = book_isbn
@@ -1,11 +1,19 @@
 class User(object):
+    __slots__ = ("_id", "_location", "_age")
+
     def __init__(self, user_id, location, age):
         self._id = user_id
         self._location = location
         self._age = age
 
     def __repr__(self):
-        return self._id
+        return str(self._id)
 
     def get_id(self):
         return self._id
+
+    def get_location(self):
+        return self._location
+
+    def get_age(self):
+        return self._age
@@ -0,0 +1,123 @@
+"""Helpers for the binary snapshots of parsed GroupLens datasets.
+
+A snapshot is an uncompressed .npz file of columns. Integer and float
+columns are stored as arrays, string columns as one UTF-8 byte blob plus an
+array of offsets, so loading is a handful of reads instead of CSV parsing.
+The snapshot is stamped with the size and mtime of every source file and is
+ignored as soon as one of them changes, so the byte offsets of lazily
+indexed metadata rows can be stored too.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from grouplens.metadata import CsvIndex
+from recommender.table import RatingTable
+
+CACHE_VERSION = 1
+
+
+def source_stamp(paths):
+    """Returns the JSON stamp of the size and mtime of the source files."""
+
+    stamp = []
+    for path in paths:
+        stat = os.stat(path)
+        stamp.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+
+    return json.dumps({"version": CACHE_VERSION, "sources": stamp})
+
+
+def pack_column(arrays, name, values):
+    """Adds the column of values under name to the dict of arrays."""
+
+    if all(isinstance(value, int) for value in values):
+        arrays[name] = np.array(values, dtype=np.int64)
+    elif all(isinstance(value, float) for value in values):
+        arrays[name] = np.array(values, dtype=np.float64)
+    else:
+        encoded = [str(value).encode("utf-8") for value in values]
+        lengths = np.fromiter((len(value) for value in encoded), dtype=np.int64, count=len(encoded))
+        arrays[name + ".data"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        arrays[name + ".offsets"] = np.concatenate(([0], np.cumsum(lengths)))
+
+
+def unpack_column(arrays, name):
+    """Returns the column stored under name by pack_column as a list."""
+
+    if name in arrays:
+        return arrays[name].tolist()
+
+    data = arrays[name + ".data"].tobytes()
+    offsets = arrays[name + ".offsets"].tolist()
+
+    return [data[start:end].decode("utf-8") for start, end in zip(offsets, offsets[1:])]
+
+
+def save_snapshot(path, sources, arrays):
+    """Saves the dict of arrays to path, stamped with the source files."""
+
+    arrays = dict(arrays, stamp=np.array(source_stamp(sources)))
+
+    # np.savez appends .npz to paths without it, so write through a file
+    with open(path, "wb") as snapshot_file:
+        np.savez(snapshot_file, **arrays)
+
+
+def load_snapshot(path, sources):
+    """Returns the dict of arrays saved at path, or None if there is no
+    snapshot or it is stale.
+    """
+
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with np.load(path, allow_pickle=False) as snapshot:
+            if str(snapshot["stamp"]) != source_stamp(sources):
+                return None
+            return {name: snapshot[name] for name in snapshot.files}
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def pack_table(arrays, table):
+    """Adds the columns of a RatingTable to the dict of arrays."""
+
+    arrays["ratings.user_index"] = table.user_index
+    arrays["ratings.item_index"] = table.item_index
+    arrays["ratings.rating"] = table.ratings
+    pack_column(arrays, "ratings.user_ids", table.user_ids)
+    pack_column(arrays, "ratings.item_ids", table.item_ids)
+
+
+def unpack_table(arrays):
+    """Returns the RatingTable stored by pack_table."""
+
+    return RatingTable(arrays["ratings.user_index"],
+                       arrays["ratings.item_index"],
+                       arrays["ratings.rating"],
+                       unpack_column(arrays, "ratings.user_ids"),
+                       unpack_column(arrays, "ratings.item_ids"))
+
+
+def pack_index(arrays, name, index):
+    """Adds the keys and byte offsets of a CsvIndex to the dict of arrays."""
+
+    offsets = index.get_offsets()
+    pack_column(arrays, name + ".index.keys", list(offsets))
+    arrays[name + ".index.offsets"] = np.fromiter(offsets.values(), dtype=np.int64, count=len(offsets))
+
+
+def unpack_index(arrays, name, path, **options):
+    """Returns the CsvIndex of the file at path stored by pack_index, built
+    with the CsvIndex options given, or None if none was stored.
+    """
+
+    if name + ".index.offsets" not in arrays:
+        return None
+
+    keys = unpack_column(arrays, name + ".index.keys")
+    return CsvIndex.from_offsets(path, zip(keys, arrays[name + ".index.offsets"].tolist()), **options)
@@ -0,0 +1,154 @@
+"""Parallel parsing of large GroupLens rating files.
+
+A rating CSV is split into byte ranges aligned to line boundaries, the
+ranges are parsed into columns in a pool of processes, and the per-range
+columns are merged into one RatingTable. Each range numbers its user and
+item ids locally; merging remaps them in range order, so the table is the
+same as the one RatingTable.from_rows builds from the whole file.
+
+Ranges are split at newlines, so the files must not have newlines inside
+quoted fields, which holds for the MovieLens and Book-Crossing ratings.
+
+The pool starts its workers from a forkserver where available, as the
+loaders parse the other files on threads meanwhile and forking a process
+with running threads can deadlock. Like with spawn, scripts using it must
+guard their entry point with if __name__ == "__main__".
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import csv
+import io
+import multiprocessing
+import os
+
+import numpy as np
+
+from recommender.table import RatingTable
+
+# Target size of the byte range parsed by one task
+CHUNK_BYTES = 1 << 24
+
+
+def byte_ranges(path, parts, skip_header=True):
+    """Splits the file at path into at most parts (start, end) byte ranges,
+    each starting at the beginning of a line and ending after a newline or
+    at the end of the file.
+    """
+
+    size = os.path.getsize(path)
+
+    with open(path, "rb") as data_file:
+        first = len(data_file.readline()) if skip_header else 0
+
+        bounds = [first]
+        for part in range(1, parts):
+            offset = first + (size - first) * part // parts
+            if offset <= bounds[-1]:
+                continue
+
+            # Move the cut to just after the next newline
+            data_file.seek(offset - 1)
+            data_file.readline()
+            offset = data_file.tell()
+            if bounds[-1] < offset < size:
+                bounds.append(offset)
+
+        bounds.append(size)
+
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+
+
+def parse_range(path, start, end, user_column, item_column, rating_column,
+                user_type=int, item_type=str, delimiter=",", encoding="utf-8"):
+    """Parses the lines in the byte range [start, end) of path into columns.
+
+    Returns (user_index, item_index, ratings, user_ids, item_ids) where the
+    indices point into the ids of this range only.
+    """
+
+    with open(path, "rb") as data_file:
+        data_file.seek(start)
+        text = data_file.read(end - start).decode(encoding)
+
+    reader = csv.reader(io.StringIO(text), delimiter=delimiter)
+
+    user_lookup = {}
+    item_lookup = {}
+    users = []
+    items = []
+    ratings = []
+    for row in reader:
+        if not row:
+            continue
+        users.append(user_lookup.setdefault(user_type(row[user_column]), len(user_lookup)))
+        items.append(item_lookup.setdefault(item_type(row[item_column]), len(item_lookup)))
+        ratings.append(float(row[rating_column]))
+
+    return (np.array(users, dtype=np.int32),
+            np.array(items, dtype=np.int32),
+            np.array(ratings, dtype=np.float32),
+            list(user_lookup),
+            list(item_lookup))
+
+
+def _parse_range_task(arguments):
+    return parse_range(*arguments)
+
+
+def merge_chunks(chunks):
+    """Merges the results of parse_range, in file order, into a RatingTable
+    numbering the ids in order of first appearance.
+    """
+
+    user_lookup = {}
+    item_lookup = {}
+    merged = []
+    for users, items, ratings, user_ids, item_ids in chunks:
+        user_map = np.array([user_lookup.setdefault(user_id, len(user_lookup)) for user_id in user_ids], dtype=np.int32)
+        item_map = np.array([item_lookup.setdefault(item_id, len(item_lookup)) for item_id in item_ids], dtype=np.int32)
+        merged.append((user_map[users], item_map[items], ratings))
+
+    return RatingTable.from_chunks(merged, list(user_lookup), list(item_lookup))
+
+
+def read_rating_table(path, user_column, item_column, rating_column, user_type=int, item_type=str,
+                      delimiter=",", encoding="utf-8", workers=None, chunk_bytes=CHUNK_BYTES):
+    """Parses the rating CSV at path, after its header line, into a
+    RatingTable over workers processes (one per CPU when None). The file is
+    split into ranges of about chunk_bytes, and at least one per worker.
+    """
+
+    workers = workers or os.cpu_count() or 1
+
+    parts = max(workers, -(-os.path.getsize(path) // chunk_bytes))
+    tasks = [(path, start, end, user_column, item_column, rating_column, user_type, item_type, delimiter, encoding)
+             for start, end in byte_ranges(path, parts)]
+
+    if workers == 1 or len(tasks) <= 1:
+        return merge_chunks([_parse_range_task(task) for task in tasks])
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context()) as executor:
+        return merge_chunks(list(executor.map(_parse_range_task, tasks)))
+
+
+def _pool_context():
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+
+    return multiprocessing.get_context()
+
+
+def run_concurrently(calls):
+    """Runs the first callable of calls on the calling thread and the others
+    on one thread each, and returns their results in order. The first one
+    is meant to parse the rating file over the process pool of
+    read_rating_table, so the pool is started from the calling thread, and
+    the others to parse the small files meanwhile.
+    """
+
+    first, others = calls[0], calls[1:]
+
+    with ThreadPoolExecutor(max_workers=max(len(others), 1)) as executor:
+        futures = [executor.submit(call) for call in others]
+        results = [first()]
+        return results + [future.result() for future in futures]
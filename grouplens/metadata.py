@@ -0,0 +1,99 @@
+"""On-demand metadata of GroupLens datasets.
+
+A CsvIndex keeps the byte offset of every row of a metadata CSV, keyed by
+its id column, and parses a row only when it is looked up. A LazyItem is a
+recommender.models.Item whose value is rendered from such an index when a
+result holding it is built, so loading keeps ids only.
+"""
+
+import csv
+
+
+class CsvIndex(object):
+    """Byte offsets of the rows of the CSV at path, keyed by the key_column
+    field converted by key_type. Like the ingest module, it assumes one
+    record per line. When a key repeats, the last row wins.
+    """
+
+    def __init__(self, path, key_column=0, key_type=str, delimiter=",", encoding="utf-8", skip_header=True):
+        self._path = path
+        self._delimiter = delimiter
+        self._encoding = encoding
+
+        self._offsets = {}
+        with open(path, "rb") as csv_file:
+            offset = len(csv_file.readline()) if skip_header else 0
+            for line in csv_file:
+                fields = self._parse(line)
+                if fields:
+                    self._offsets[key_type(fields[key_column])] = offset
+                offset += len(line)
+
+    @classmethod
+    def from_offsets(cls, path, offsets, delimiter=",", encoding="utf-8"):
+        """Returns the index of the dict of key mapping to byte offset of a
+        previous index of the unchanged file at path, without reading it.
+        """
+
+        index = cls.__new__(cls)
+        index._path = path
+        index._delimiter = delimiter
+        index._encoding = encoding
+        index._offsets = dict(offsets)
+
+        return index
+
+    def _parse(self, line):
+        return next(csv.reader([line.decode(self._encoding)], delimiter=self._delimiter), [])
+
+    def get_offsets(self):
+        """Returns the dict of key mapping to the byte offset of its row."""
+        return self._offsets
+
+    def fields(self, key):
+        """Returns the list of fields of the row of key, read from the file."""
+
+        with open(self._path, "rb") as csv_file:
+            csv_file.seek(self._offsets[key])
+            return self._parse(csv_file.readline())
+
+    def rows(self, keys=None):
+        """Yields (key, fields) for every key in keys, or for every row when
+        None, reading the file through one open handle.
+        """
+
+        keys = self._offsets if keys is None else keys
+        with open(self._path, "rb") as csv_file:
+            for key in keys:
+                csv_file.seek(self._offsets[key])
+                yield key, self._parse(csv_file.readline())
+
+    def __contains__(self, key):
+        return key in self._offsets
+
+    def __iter__(self):
+        return iter(self._offsets)
+
+    def __len__(self):
+        return len(self._offsets)
+
+
+class LazyItem(object):
+    """A recommender.models.Item whose value is render(item_id), computed
+    on every get_value call instead of stored.
+    """
+
+    __slots__ = ("_id", "_render")
+
+    def __init__(self, item_id, render):
+        self._id = item_id
+        self._render = render
+
+    def __repr__(self):
+        return self.get_value()
+
+    def get_id(self):
+        return self._id
+
+    def get_value(self):
+        return self._render(self._id)
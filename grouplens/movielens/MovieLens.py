@@ -2,8 +2,12 @@ from models.rating import MovieRating
 from models.movie import Movie
 
 from grouplens.GroupLens import GroupLens
+from grouplens.cache import pack_column, unpack_column, pack_table, unpack_table, pack_index, unpack_index
+from grouplens.ingest import read_rating_table, run_concurrently
+from grouplens.metadata import CsvIndex, LazyItem
 
 from recommender.models import User as RecommenderUser, Item as RecommenderItem
+from recommender.table import RatingTable
 
 import os
 import csv
@@ -16,15 +20,55 @@ class MovieLens(GroupLens):
     def __init__(self):
         self._movies = {}
         self._ratings = []
+        self._rating_table = None
+
+        # Offset index of the movies file when loaded lazily
+        self._movie_index = None
 
     def load_from_dir(self,
                       dir_name,
                       movies_file_name="movies.csv",
-                      ratings_file_name="ratings.csv"):
-        self.load_movies(os.path.join(dir_name, movies_file_name))
-        self.load_ratings(os.path.join(dir_name, ratings_file_name))
+                      ratings_file_name="ratings.csv",
+                      columnar=False,
+                      cache_path=None,
+                      workers=1,
+                      lazy=False):
+        """Loads movies and ratings. With columnar, ratings are parsed into a
+        RatingTable instead of one MovieRating per row. With cache_path, the
+        dataset is loaded from that binary snapshot when it is up to date
+        with the CSV files, and the snapshot is rewritten otherwise, unless a
+        file could not be loaded.
+
+        With columnar and workers other than 1, the ratings are parsed over
+        workers processes (one per CPU when None) while the movies are loaded
+        concurrently.
+
+        With lazy, movies are only indexed by id, and their titles are read
+        from the CSV file when get_movie or the value of a recommender item
+        asks for them. This holds for a dataset restored from the snapshot
+        too.
+        """
+        movies_path = os.path.join(dir_name, movies_file_name)
+        ratings_path = os.path.join(dir_name, ratings_file_name)
+
+        if cache_path is not None and self.load_cache(cache_path, [movies_path, ratings_path], lazy=lazy):
+            return
+
+        load_movies = self.index_movies if lazy else self.load_movies
+
+        if columnar and workers != 1:
+            loaded = run_concurrently([lambda: self.load_rating_table(ratings_path, workers=workers),
+                                       lambda: load_movies(movies_path)])
+        else:
+            loaded = [load_movies(movies_path),
+                      self.load_rating_table(ratings_path) if columnar else self.load_ratings(ratings_path)]
+
+        # A file that failed to parse would be cached as empty
+        if cache_path is not None and all(loaded):
+            self.save_cache(cache_path, [movies_path, ratings_path])
 
     def load_movies(self, file_path):
+        self._movie_index = None
         try:
             with open(file_path, 'r') as csv_file:
                 reader = csv.reader(csv_file, delimiter=',')
@@ -36,6 +80,33 @@ class MovieLens(GroupLens):
         except Exception as e:
             self._movies= {}
             print("Could not load movies.", e)
+            return False
+
+        return True
+
+    def index_movies(self, file_path):
+        """Indexes the rows of the movies file by id instead of loading them."""
+        self._movies = {}
+        try:
+            self._movie_index = CsvIndex(file_path, key_type=int, delimiter=',')
+        except Exception as e:
+            self._movie_index = None
+            print("Could not index movies.", e)
+            return False
+
+        return True
+
+    def get_movie(self, movie_id):
+        if self._movie_index is None:
+            return self._movies[movie_id]
+
+        return self._movie(self._movie_index.fields(movie_id))
+
+    def _movie(self, row):
+        return Movie(movie_id=int(row[0]), title=row[1])
+
+    def _movie_value(self, movie_id):
+        return repr(self.get_movie(movie_id))
 
     def load_ratings(self, file_path):
         try:
@@ -49,16 +120,53 @@ class MovieLens(GroupLens):
         except Exception as e:
             self._ratings = []
             print("Could not load ratings.", e)
+            return False
+
+        return True
+
+    def load_rating_table(self, file_path, chunk_size=100000, workers=1):
+        """Parses the ratings into a RatingTable, chunk_size rows at a time,
+        or with workers other than 1 by byte ranges over a process pool.
+        """
+        try:
+            if workers != 1:
+                self._rating_table = read_rating_table(file_path, 0, 1, 2, user_type=int, item_type=int,
+                                                       delimiter=',', workers=workers)
+            else:
+                with open(file_path, 'r') as csv_file:
+                    reader = csv.reader(csv_file, delimiter=',')
+                    # Skip header
+                    next(reader, None)
+                    self._rating_table = RatingTable.from_rows(reader,
+                                                               user_column=0,
+                                                               item_column=1,
+                                                               rating_column=2,
+                                                               user_type=int,
+                                                               item_type=int,
+                                                               chunk_size=chunk_size)
+        except Exception as e:
+            self._rating_table = None
+            print("Could not load ratings.", e)
+            return False
 
+        return True
 
     def get_recommender_items(self):
-        """Converts self._movies into recommender.models.Item objects."""
+        """Converts self._movies into recommender.models.Item objects, or into
+        LazyItems reading their titles on demand when loaded lazily.
+        """
+
+        if self._movie_index is not None:
+            return [LazyItem(movie_id, self._movie_value) for movie_id in self._movie_index]
 
         return [RecommenderItem(movie.get_id(), repr(movie)) for movie in self._movies.values()]
 
     def get_recommender_users(self):
         """Converts self._ratings into recommender.models.User objects."""
 
+        if not self._ratings and self._rating_table is not None:
+            return self._recommender_users_from_table()
+
         user_ids = set(rating.get_user_id() for rating in self._ratings)
         recommender_users = {user_id: RecommenderUser(user_id, user_id) for user_id in user_ids}
 
@@ -66,3 +174,55 @@ class MovieLens(GroupLens):
             recommender_users[rating.get_user_id()].add_preference(rating.get_movie_id(), rating.get_rating())
 
         return list(recommender_users.values())
+
+    def get_rating_table(self):
+        """Returns the ratings as a RatingTable, built from the loaded
+        MovieRatings unless they were loaded with load_rating_table.
+        """
+
+        if self._rating_table is None:
+            rows = ((rating.get_user_id(), rating.get_movie_id(), rating.get_rating()) for rating in self._ratings)
+            self._rating_table = RatingTable.from_rows(rows, 0, 1, 2, user_type=int, item_type=int)
+
+        return self._rating_table
+
+    def _recommender_users_from_table(self):
+        # Views over the table columns instead of one preference dict per user
+        return self._rating_table.users()
+
+    def _snapshot_arrays(self):
+        arrays = {}
+
+        # Lazily loaded movies are read in full for the snapshot, and their
+        # offsets are kept for lazy restores
+        if self._movie_index is not None:
+            movies = [self._movie(row) for _, row in self._movie_index.rows()]
+            pack_index(arrays, "movies", self._movie_index)
+        else:
+            movies = list(self._movies.values())
+
+        pack_column(arrays, "movies.id", [movie.get_id() for movie in movies])
+        pack_column(arrays, "movies.title", [movie.get_title() for movie in movies])
+        pack_table(arrays, self.get_rating_table())
+
+        return arrays
+
+    def _restore_snapshot(self, arrays, sources, lazy=False):
+        movies_path = sources[0]
+
+        self._ratings = []
+        self._rating_table = unpack_table(arrays)
+
+        if lazy:
+            self._movies = {}
+            self._movie_index = unpack_index(arrays, "movies", movies_path, delimiter=',')
+            # Snapshots of eagerly loaded movies have no offsets
+            if self._movie_index is None:
+                self.index_movies(movies_path)
+            return
+
+        movie_ids = unpack_column(arrays, "movies.id")
+        titles = unpack_column(arrays, "movies.title")
+
+        self._movies = {movie_id: Movie(movie_id=movie_id, title=title) for movie_id, title in zip(movie_ids, titles)}
+        self._movie_index = None
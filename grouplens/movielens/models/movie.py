@@ -1,4 +1,6 @@
 class Movie(object):
+    __slots__ = ("_id", "_title")
+
     def __init__(self, movie_id, title):
         self._id = movie_id
         self._title = title
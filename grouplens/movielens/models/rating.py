@@ -1,4 +1,6 @@
 class MovieRating(object):
+    __slots__ = ("_user_id", "_movie_id", "_rating")
+
     def __init__(self, user_id, movie_id, rating):
         self._user_id = user_id
         self._movie_id = movie_id
@@ -0,0 +1,167 @@
+from collections import Counter
+
+import numpy as np
+
+from recommender.matrix import RatingMatrix
+
+# Mersenne prime of the universal hash functions (a * x + b) mod PRIME
+PRIME = (1 << 31) - 1
+
+
+class MinHashIndex(object):
+    """Approximate nearest neighbour index over the rated columns of rows.
+
+    Each row gets a MinHash signature of bands * band_size hashes of the set
+    of columns it rated, so two rows agree on a hash with probability equal
+    to the Jaccard overlap of their columns. Signatures are split in bands
+    and rows sharing a whole band land in the same bucket; rows sharing at
+    least one bucket are candidate neighbours.
+
+    More bands raise recall and the number of candidates, a larger band_size
+    lowers both. max_candidates keeps the candidates sharing the most bands.
+    """
+
+    def __init__(self, bands=16, band_size=2, max_candidates=None, seed=None):
+        self._bands = bands
+        self._band_size = band_size
+        self._max_candidates = max_candidates
+
+        random = np.random.default_rng(seed)
+        size = bands * band_size
+        self._a = random.integers(1, PRIME, size=(size, 1), dtype=np.int64)
+        self._b = random.integers(0, PRIME, size=(size, 1), dtype=np.int64)
+
+        # Column ids mapping to the integers they are hashed as
+        self._codes = {}
+
+        self._signatures = {}
+        self._buckets = [{} for _ in range(bands)]
+
+    @classmethod
+    def from_rows(cls, rows, block_size=1024, **kwargs):
+        """Builds an index of a dict of row_id mapping to {col_id: value},
+        or of a RatingMatrix.
+        """
+
+        index = cls(**kwargs)
+        if isinstance(rows, RatingMatrix):
+            index._add_matrix(rows, block_size)
+        else:
+            for row_id, row in rows.items():
+                index.update(row_id, row)
+
+        return index
+
+    def _add_matrix(self, matrix, block_size):
+        """Signs the rows of matrix block by block, taking the minimum hash
+        over the entries of every row with one reduceat per block.
+        """
+
+        codes = np.array([self._code(col_id) for col_id in matrix.get_col_ids()], dtype=np.int64)
+        hashes = self._hash(codes)
+        row_ids = matrix.get_row_ids()
+        counts = matrix.row_counts()
+
+        for start in range(0, len(row_ids), block_size):
+            rows = np.arange(start, min(start + block_size, len(row_ids)))
+            rows = rows[counts[rows] > 0]
+            if not len(rows):
+                continue
+
+            lengths, indices, _ = matrix.gather(rows)
+            offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            signatures = np.minimum.reduceat(hashes[:, indices], offsets, axis=1)
+
+            for row, signature in zip(rows.tolist(), signatures.T):
+                self._insert(row_ids[row], signature.copy())
+
+    def _code(self, col_id):
+        return self._codes.setdefault(col_id, len(self._codes))
+
+    def _hash(self, codes):
+        return (self._a * codes[None, :] + self._b) % PRIME
+
+    def _keys(self, signature):
+        return [signature[band * self._band_size:(band + 1) * self._band_size].tobytes()
+                for band in range(self._bands)]
+
+    def _insert(self, row_id, signature):
+        self._signatures[row_id] = signature
+        for buckets, key in zip(self._buckets, self._keys(signature)):
+            buckets.setdefault(key, set()).add(row_id)
+
+    def remove(self, row_id):
+        signature = self._signatures.pop(row_id, None)
+        if signature is None:
+            return
+
+        for buckets, key in zip(self._buckets, self._keys(signature)):
+            bucket = buckets[key]
+            bucket.discard(row_id)
+            if not bucket:
+                del buckets[key]
+
+    def update(self, row_id, columns):
+        """Re-signs row_id from the iterable of the columns it rated."""
+
+        self.remove(row_id)
+
+        codes = np.array([self._code(col_id) for col_id in columns], dtype=np.int64)
+        if len(codes):
+            self._insert(row_id, self._hash(codes).min(axis=1))
+
+    def candidates(self, row_id):
+        """Returns the list of rows sharing a bucket with row_id."""
+
+        signature = self._signatures.get(row_id)
+        if signature is None:
+            return []
+
+        shared = Counter()
+        for buckets, key in zip(self._buckets, self._keys(signature)):
+            shared.update(buckets[key])
+        del shared[row_id]
+
+        if self._max_candidates is None or len(shared) <= self._max_candidates:
+            return list(shared)
+
+        return [candidate for candidate, _ in shared.most_common(self._max_candidates)]
+
+    def __len__(self):
+        return len(self._signatures)
+
+
+class AnnSearch(object):
+    """MinHash candidate search over the rows of a recommender's preferences
+    and inverted preferences, built with the MinHashIndex options given.
+    """
+
+    def __init__(self, **options):
+        self._options = options
+        self.users = None
+        self.items = None
+
+    def build(self, preferences, inverted_preferences):
+        self.users = MinHashIndex.from_rows(preferences, **self._options)
+        self.items = MinHashIndex.from_rows(inverted_preferences, **self._options)
+
+    def update(self, user_id, user_columns, item_id, item_columns):
+        """Re-signs a user and an item after their rating changed."""
+        self.users.update(user_id, user_columns)
+        self.items.update(item_id, item_columns)
+
+
+def recall_at_k(exact, approximate, ids, k=10):
+    """Returns the mean fraction of the k exact neighbours of every id that
+    the approximate search also returns. exact and approximate are functions
+    of (id, k) returning (score, neighbour_id) tuples.
+    """
+
+    recalls = []
+    for id_ in ids:
+        expected = {neighbour_id for _, neighbour_id in exact(id_, k)}
+        if expected:
+            found = {neighbour_id for _, neighbour_id in approximate(id_, k)}
+            recalls.append(len(expected & found) / len(expected))
+
+    return sum(recalls) / len(recalls) if recalls else 1.0
@@ -0,0 +1,101 @@
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache(object):
+    """A bounded cache that evicts the least recently used entry once it holds
+    max_size entries, counting hits, misses and evictions.
+    """
+
+    def __init__(self, max_size=1024):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1.")
+
+        self._max_size = max_size
+        self._entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+
+        if len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """Returns the cached value of key, calling compute() on a miss."""
+
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+
+        return value
+
+    def clear(self):
+        self._entries.clear()
+
+    def info(self):
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "max_size": self._max_size}
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SimilarityCache(object):
+    """The LRU caches of a recommender that does not memorize: one of the
+    neighbour lists of up to size rows and one of up to pair_size pairwise
+    scores. A cache sized None is disabled.
+    """
+
+    def __init__(self, size=None, pair_size=None):
+        self.rows = LRUCache(size) if size else None
+        self.pairs = LRUCache(pair_size) if pair_size else None
+
+    def similar(self, key, compute):
+        """Returns the cached neighbour list of key, calling compute() on a miss."""
+        if self.rows is None:
+            return compute()
+
+        return self.rows.get_or_compute(key, compute)
+
+    def score(self, key, compute):
+        """Returns the cached score of key, calling compute() on a miss."""
+        if self.pairs is None:
+            return compute()
+
+        return self.pairs.get_or_compute(key, compute)
+
+    def clear(self):
+        for cache in (self.rows, self.pairs):
+            if cache is not None:
+                cache.clear()
+
+    def info(self):
+        """Returns the counters of both caches, or None for a disabled cache."""
+        return {"rows": self.rows.info() if self.rows is not None else None,
+                "pairs": self.pairs.info() if self.pairs is not None else None}
@@ -1,17 +1,17 @@
-from recommender.similarity import CosineSimilarity
+from recommender.matrix import RatingMatrix
+from recommender.neighbours import top_k
 from recommender.recommend import Recommender
 
-from collections import defaultdict
 import numpy as np
-import random
 
 class Cluster(object):
     """A Cluster object used for K Means clustering."""
 
-    def __init__(self, cluster_id):
+    def __init__(self, cluster_id, centroid, members):
         self._id = cluster_id
-        self._centroid = []
-        self._members = []
+        self._centroid = centroid
+        # Dense row indices of the members
+        self._members = members
 
     def get_id(self):
         return self._id
@@ -22,166 +22,232 @@ class Cluster(object):
     def get_members(self):
         return self._members
 
-    def add_member(self, member):
-        self._members.append(member)
 
-    def recalculate_centroid(self):
-        """Recalculate centroid using average of the values of its members."""
-
-        if len(self._members > 0):
-            members_sum = defaultdict(float)
-            count = defaultdict(int)
-
-            for member in self._members:
-                for k, value  in member.items():
-                    values_sum[k] += value
-                    count[k] += 1
-
-            avgs = {k: value / count[k] for k, value in values_sum.items()}
-
-            self._centroid = avgs
-
-    def remove_all_members(self):
-        self._members = []
-
-    def random_centroid(self, size, min_val, max_val):
-        self.centroid = [random.uniform(min_val, max_val)] * size
+class KMeansRecommender(Recommender):
+    """A collaborative filtering recommender based on K Means clustering.
 
+    Users are clustered on the sparse user x item rating matrix and items on
+    its transpose, with k-means++ initialisation followed by Lloyd iterations,
+    or mini-batch updates when batch_size is set. Queries only scan the
+    cluster of the user or item.
+    """
 
-class KMeansRecommender(Recommender):
-    """A collaborative filtering recommender based on K Means clustering."""
+    def __init__(self, k=100, max_iterations=100, tolerance=1e-4, batch_size=None, seed=None):
+        self._k = k
+        self._max_iterations = max_iterations
+        self._tolerance = tolerance
+        self._batch_size = batch_size
+        self._random = np.random.default_rng(seed)
 
-    def __init__(self):
         self._users = {}
         self._items = {}
 
-        self.pref_matrix = []
-        self.inv_pref_matrix = []
-
-        self._user_clusters = []
-        self._item_clusters = []
+        self._pref_matrix = None
+        self._inv_pref_matrix = None
 
-        # The distance calculator between a centroid and a point
-        self._similarity = CosineSimilarity()
+        self._user_clusters = {}
+        self._item_clusters = {}
 
     def load(self, users, items):
         """Create item and user clusters through K Means clustering."""
 
-        self._users = users
-        self._items = items
+        self._users = {user.get_id(): user for user in users}
+        self._items = {item.get_id(): item for item in items}
 
         # Create inverted and regular preference matrices from users and items
-        self._pref_matrix = self._create_preference_matrix(users, items)
-        self._inv_pref_matrix = np.linalg.inv(self._pref_matrix)
+        self._pref_matrix = RatingMatrix.from_dict({user_id: user.get_preferences() for user_id, user in self._users.items()})
+        self._inv_pref_matrix = self._pref_matrix.transpose()
 
         # Run k means clustering and assign users to clusters
-        clusters, assigned_cluster = self.kmeans(self._pref_matrix)
-        self._user_clusters = cluster
+        clusters, assigned_cluster = self.kmeans(self._pref_matrix, self._k)
+        self._user_clusters = clusters
         self._user_assigned_cluster = assigned_cluster
 
         # Run k means clustering and assign items to clusters
-        clusters, assigned_cluster = self.kmeans(self._inv_pref_matrix)
+        clusters, assigned_cluster = self.kmeans(self._inv_pref_matrix, self._k)
         self._item_clusters = clusters
         self._item_assigned_cluster = assigned_cluster
 
-    def _create_preference_matrix(self, users, items):
-        matrix_data = [[0] * (len(items) + 1)]
-        for user in sorted(users, key=lambda user: user.get_id()):
-            row = [0] * (len(items) + 1)
-            for item_id, rating in user.get_preferences().items():
-                row[item_id] = rating
-
-            matrix_data.append(row)
-
-        return np.matrix(matrix_data)
+        # Mean rating of every item, used to rank items within a cluster
+        counts = self._inv_pref_matrix.row_counts()
+        sums = np.bincount(self._inv_pref_matrix.row_of_entries(), weights=self._inv_pref_matrix.data, minlength=len(counts))
+        self._item_means = sums / np.maximum(counts, 1)
 
     def kmeans(self, matrix, k=100):
         """Returns a tuple of clusters and assigned_cluster.
 
         clusters: dict of cluster_id mapping to a Cluster object
-        assigned_cluster: dict of row_id mapped to the Cluster object it
-                          belongs to
+        assigned_cluster: array of the cluster_id of every row of matrix
         """
 
-        vals = [val for row in matrix[1:] for val in row[1:] ]
-        min_value = min(vals)
-        max_value = max(vals)
+        size = matrix.shape[0]
+        k = min(k, size)
+        if k == 0:
+            return {}, np.zeros(0, dtype=np.int64)
 
-        # Create clusters and randomly assign centroids
-        clusters = {i : Cluster(i).random_centroid(matrix.shape[1], min_val, max_val) for i in range(k)}
+        squared_norms = np.bincount(matrix.row_of_entries(), weights=matrix.data ** 2, minlength=size)
+        centroids = self._kmeans_plus_plus(matrix, squared_norms, k)
 
-        previous_assignments = {}
-        assigned_cluster = {}
+        if self._batch_size is None:
+            centroids = self._lloyd(matrix, squared_norms, centroids)
+        else:
+            centroids = self._mini_batch(matrix, centroids)
+
+        assigned_cluster, _ = self._assign(matrix, squared_norms, centroids)
+        order = np.argsort(assigned_cluster, kind="stable")
+        bounds = np.searchsorted(assigned_cluster[order], np.arange(k + 1))
+
+        clusters = {i: Cluster(i, centroids[i], order[bounds[i]:bounds[i + 1]]) for i in range(k)}
+
+        return clusters, assigned_cluster
+
+    def _assign(self, matrix, squared_norms, centroids):
+        """Returns the closest centroid of every row and the squared distance
+        to it, computed as |x|^2 - 2 x.c + |c|^2 for all rows at once.
+        """
+
+        distances = (squared_norms[:, None]
+                     - 2 * matrix.dot(centroids.T)
+                     + (centroids ** 2).sum(axis=1)[None, :])
+        assigned = distances.argmin(axis=1)
+
+        return assigned, np.maximum(distances[np.arange(len(assigned)), assigned], 0)
+
+    def _kmeans_plus_plus(self, matrix, squared_norms, k):
+        """Picks k initial centroids among the rows, each chosen with
+        probability proportional to its squared distance to the closest
+        centroid picked so far.
+        """
 
-        while False:
-            for i in range(1, len(matrix)):
-                # Assign row to first cluster in list by default
-                max_score = self._similarity.score(matrix[i], cluster[0].get_centroid())
-                assigned_cluster[i] = cluster[0].get_id()
+        size, width = matrix.shape
+        centroids = np.zeros((k, width))
 
-                # Assign row to closest cluster
-                for cluster_id, cluster in clusters.items():
-                    score = self._similarity.score(matrix[i], cluster.get_centroid())
+        closest = None
+        for i in range(k):
+            if closest is None or closest.sum() == 0:
+                row = self._random.integers(size)
+            else:
+                row = self._random.choice(size, p=closest / closest.sum())
 
-                    if score > max_score:
-                        max_score = score
-                        assigned_cluster[i] = cluster_id
+            cols, values = matrix.row(row)
+            centroids[i, cols] = values
 
-            # If converged
-            if assigned_cluster == previous_assignments:
+            distances = np.maximum(squared_norms - 2 * matrix.dot(centroids[i, :, None])[:, 0] + squared_norms[row], 0)
+            closest = distances if closest is None else np.minimum(closest, distances)
+
+        return centroids
+
+    def _cluster_sums(self, matrix, assigned, k):
+        """Returns the sum of the rows and the number of rows of each cluster."""
+
+        width = matrix.shape[1]
+        flat = assigned[matrix.row_of_entries()] * width + matrix.indices
+        sums = np.bincount(flat, weights=matrix.data, minlength=k * width).reshape(k, width)
+
+        return sums, np.bincount(assigned, minlength=k)
+
+    def _lloyd(self, matrix, squared_norms, centroids):
+        k = len(centroids)
+        previous_inertia = None
+
+        for _ in range(self._max_iterations):
+            assigned, distances = self._assign(matrix, squared_norms, centroids)
+
+            sums, counts = self._cluster_sums(matrix, assigned, k)
+            # Empty clusters keep their previous centroid
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+
+            inertia = distances.sum()
+            if previous_inertia is not None and previous_inertia - inertia <= self._tolerance * previous_inertia:
                 break
+            previous_inertia = inertia
 
-            for cluster in clusters.values():
-                cluster.remove_all_members()
+        return centroids
 
-            # Add the rows to their assigned clusters
-            for row_id, cluster_id in assigned_cluster:
-                clusters[cluster_id].add_member(row_id)
+    def _mini_batch(self, matrix, centroids):
+        """Mini-batch k-means: each step moves the centroids towards the mean
+        of their rows in a random batch, with a per-centroid learning rate
+        decreasing with the number of rows it has seen.
+        """
 
-            # Recalculcate centroid for all clusters
-            map(lambda x: x.recalculate_centroid(), clusters.values())
+        k = len(centroids)
+        size = matrix.shape[0]
+        seen = np.zeros(k)
 
-        return clusters, assigned_cluster
+        for _ in range(self._max_iterations):
+            batch = matrix.take(np.sort(self._random.choice(size, min(self._batch_size, size), replace=False)))
+            batch_norms = np.bincount(batch.row_of_entries(), weights=batch.data ** 2, minlength=batch.shape[0])
 
+            assigned, _ = self._assign(batch, batch_norms, centroids)
+            sums, counts = self._cluster_sums(batch, assigned, k)
+
+            seen += counts
+            filled = counts > 0
+            previous = centroids[filled].copy()
+            centroids[filled] += (sums[filled] - counts[filled, None] * centroids[filled]) / seen[filled, None]
+
+            if np.abs(centroids[filled] - previous).max(initial=0) <= self._tolerance:
+                break
+
+        return centroids
+
+    def _cluster_of(self, matrix, clusters, assigned_cluster, row_id):
+        row = matrix.row_index(row_id)
+        return row, clusters[assigned_cluster[row]]
 
     def similar_items(self, item_id, n=10):
         """Gets the highest rated items in item_id's cluster."""
-        items_with_ratings = []
 
-        # Get average rating of items by summing up every rating and dividing
-        # by the # of ratings
-        for i in self._item_assigned_cluster[item_id].get_members():
-            if i != item_id:
-                rating_sum = reduce(lambda x,y: x + y, self._inv_pref_matrix[i]
-                items_with_ratings.append((rating_sum / len(self._inv_pref_matrix[i]), i, self._items[i].get_value()))
+        row, cluster = self._cluster_of(self._inv_pref_matrix, self._item_clusters, self._item_assigned_cluster, item_id)
+        members = cluster.get_members()
 
-        items_with_ratings.sort(reverse=True)
+        best = top_k(self._item_means[members], n, threshold=-np.inf, exclude=np.flatnonzero(members == row))
+        item_ids = self._inv_pref_matrix.get_row_ids()
 
-        return items_with_ratings[:n]
+        return [(self._items[item_ids[i]].get_value(), item_ids[i], float(self._item_means[i])) for i in members[best].tolist()]
 
     def similar_users(self, user_id, n=10):
-        """Gets random users in user_id's cluster."""
-        user_ids = [u_id for u_id in self._user_assigned_cluster[user_id].get_members() if u_id != user_id]
+        """Gets the users in user_id's cluster closest to user_id."""
 
-        return random.sample(user_ids, n)
+        row, cluster = self._cluster_of(self._pref_matrix, self._user_clusters, self._user_assigned_cluster, user_id)
+        members = cluster.get_members()
+
+        cols, values = self._pref_matrix.row(row)
+        query = np.zeros((self._pref_matrix.shape[1], 1))
+        query[cols, 0] = values
+
+        member_matrix = self._pref_matrix.take(members)
+        member_norms = np.bincount(member_matrix.row_of_entries(), weights=member_matrix.data ** 2, minlength=len(members))
+        distances = np.maximum(member_norms - 2 * member_matrix.dot(query)[:, 0] + (values ** 2).sum(), 0)
+        scores = 1 / (1 + np.sqrt(distances))
+
+        best = top_k(scores, n, exclude=np.flatnonzero(members == row))
+        user_ids = self._pref_matrix.get_row_ids()
+
+        return [(self._users[user_ids[members[i]]].get_value(), user_ids[members[i]], float(scores[i])) for i in best.tolist()]
 
     def recommendations(self, user_id, n=10):
         """Recommend the items most highly rated by users inside of user_id's
         cluster.
         """
-        user_pref = self._users[user_id].get_preferences()
-        rating_sum = defaultdict(float)
-        rating_count = defaultdict(int)
+        row, cluster = self._cluster_of(self._pref_matrix, self._user_clusters, self._user_assigned_cluster, user_id)
+
+        # Average rating of every item within the cluster, leaving out the
+        # user's own ratings
+        _, item_indices, ratings = self._pref_matrix.gather(cluster.get_members()[cluster.get_members() != row])
+        size = self._pref_matrix.shape[1]
+        rating_sum = np.bincount(item_indices, weights=ratings, minlength=size)
+        rating_count = np.bincount(item_indices, minlength=size)
 
-        for u_id in self._user_cluster.get_members[user_id]:
-            for item_id, rating in self._users[u_id].get_preferences().items():
+        averages = np.full(size, -np.inf)
+        rated = rating_count > 0
+        averages[rated] = rating_sum[rated] / rating_count[rated]
 
-                # Only add items that haven't been rated by the user
-                if u_id != user_id and item_id not in user_pref:
-                    rating_sum[item_id] += rating
-                    rating_count[item_id] += 1
+        # Only add items that haven't been rated by the user
+        averages[self._pref_matrix.row(row)[0]] = -np.inf
 
-        # Create list of items with their average rating within cluster
-        results = [(total / rating_count[item_id], item_id, self._items[i].get_value()) for item_id, total in rating_sum.items()]
+        best = top_k(averages, n, threshold=-np.inf)
+        item_ids = self._pref_matrix.get_col_ids()
 
-        return results[:n]
+        return [(self._items[item_ids[i]].get_value(), item_ids[i], float(averages[i])) for i in best.tolist()]
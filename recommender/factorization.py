@@ -0,0 +1,179 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from recommender.matrix import RatingMatrix
+from recommender.neighbours import top_k
+from recommender.recommend import Recommender, _blocks
+from recommender.table import RatingTable
+
+
+class ALSRecommender(Recommender):
+    """A collaborative filtering recommender based on matrix factorization.
+
+    The user x item rating matrix is factorized into user and item factors
+    of size factors by alternating least squares: each iteration solves the
+    regularised least squares problem of every user with the item factors
+    fixed, then of every item with the user factors fixed.
+
+    With implicit, ratings are confidences (Hu, Koren and Volinsky): every
+    rated item is a preference of 1 weighted by 1 + alpha * rating, and every
+    unrated item a preference of 0 weighted by 1. Otherwise ratings minus
+    their global mean are fitted with regularization scaled by the number of
+    ratings of each row.
+
+    Rows are solved in blocks of block_size rows, one batched solve per
+    block, over workers threads (NumPy releases the GIL in the solves).
+    Queries are dense dot products with the factors.
+    """
+
+    def __init__(self, factors=32, iterations=15, regularization=0.1, implicit=False, alpha=40.0,
+                 workers=1, block_size=1024, seed=None):
+        self._factors = factors
+        self._iterations = iterations
+        self._regularization = regularization
+        self._implicit = implicit
+        self._alpha = alpha
+        self._workers = workers
+        self._block_size = block_size
+        self._random = np.random.default_rng(seed)
+
+        self._users = {}
+        self._items = {}
+
+        self._pref_matrix = None
+        self._inv_pref_matrix = None
+
+        self._mean = 0.0
+        self._user_factors = None
+        self._item_factors = None
+
+    def load(self, users, items):
+        """Factorizes the ratings of users, a list of Users or a RatingTable."""
+
+        self._items = {item.get_id(): item for item in items}
+
+        if isinstance(users, RatingTable):
+            self._users = {user.get_id(): user for user in users.users()}
+            self._pref_matrix = RatingMatrix.from_table(users)
+        else:
+            self._users = {user.get_id(): user for user in users}
+            self._pref_matrix = RatingMatrix.from_dict({user_id: user.get_preferences() for user_id, user in self._users.items()})
+        self._inv_pref_matrix = self._pref_matrix.transpose()
+
+        self.fit()
+
+    def fit(self):
+        """Runs the alternating least squares iterations from random factors."""
+
+        size, width = self._pref_matrix.shape
+        scale = 1 / np.sqrt(self._factors)
+        self._user_factors = self._random.normal(0, scale, (size, self._factors))
+        self._item_factors = self._random.normal(0, scale, (width, self._factors))
+
+        self._mean = 0.0 if self._implicit or not self._pref_matrix.nnz else float(self._pref_matrix.data.mean())
+
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            for _ in range(self._iterations):
+                self._solve(executor, self._pref_matrix, self._item_factors, self._user_factors)
+                self._solve(executor, self._inv_pref_matrix, self._user_factors, self._item_factors)
+
+    def _solve(self, executor, matrix, fixed, factors):
+        """Solves the factors of every row of matrix with the factors of its
+        columns fixed, writing them into factors block by block.
+        """
+
+        # Shared by every row of the implicit problem
+        gram = fixed.T @ fixed if self._implicit else None
+
+        blocks = [(start, min(start + self._block_size, matrix.shape[0]))
+                  for start in range(0, matrix.shape[0], self._block_size)]
+        for _ in executor.map(lambda bounds: self._solve_block(matrix, fixed, factors, gram, *bounds), blocks):
+            pass
+
+    def _solve_block(self, matrix, fixed, factors, gram, start, end):
+        identity = np.eye(self._factors)
+        lhs = np.empty((end - start, self._factors, self._factors))
+        rhs = np.empty((end - start, self._factors))
+
+        for row in range(start, end):
+            cols, ratings = matrix.row(row)
+            neighbours = fixed[cols]
+
+            if self._implicit:
+                confidence = self._alpha * ratings
+                lhs[row - start] = gram + (neighbours.T * confidence) @ neighbours + self._regularization * identity
+                rhs[row - start] = neighbours.T @ (1 + confidence)
+            else:
+                lhs[row - start] = neighbours.T @ neighbours + self._regularization * max(len(cols), 1) * identity
+                rhs[row - start] = neighbours.T @ (ratings - self._mean)
+
+        factors[start:end] = np.linalg.solve(lhs, rhs[:, :, None])[:, :, 0]
+
+    def get_user_factors(self):
+        return self._user_factors
+
+    def get_item_factors(self):
+        return self._item_factors
+
+    def _predicted(self, rows):
+        """Returns the predicted ratings of the users at the indices rows for
+        every item, with the items they rated set to -inf.
+        """
+
+        predicted = self._user_factors[rows] @ self._item_factors.T + self._mean
+
+        lengths, rated, _ = self._pref_matrix.gather(rows)
+        predicted[np.repeat(np.arange(len(rows)), lengths), rated] = -np.inf
+
+        return predicted
+
+    def _ranked_items(self, predicted, n):
+        best = top_k(predicted, n, threshold=-np.inf)
+        item_ids = self._pref_matrix.get_col_ids()
+
+        return [(self._items[item_ids[i]].get_value(), item_ids[i], score)
+                for i, score in zip(best.tolist(), predicted[best].tolist())]
+
+    def _cosine(self, factors, row):
+        norms = np.linalg.norm(factors, axis=1)
+        norms[norms == 0] = 1
+
+        return (factors @ factors[row]) / (norms * norms[row])
+
+    def recommendations(self, user_id, n=10):
+        """Recommend the unrated items with the highest predicted rating."""
+
+        row = self._pref_matrix.row_index(user_id)
+        return self._ranked_items(self._predicted(np.array([row]))[0], n)
+
+    def recommendations_batch(self, user_ids, n=10, block_size=256):
+        """Yields (user_id, recommendations) for every user in user_ids,
+        predicting the ratings of block_size users with one matrix product.
+        """
+        for block in _blocks(user_ids, block_size):
+            rows = np.array([self._pref_matrix.row_index(user_id) for user_id in block], dtype=np.int64)
+            for user_id, predicted in zip(block, self._predicted(rows)):
+                yield user_id, self._ranked_items(predicted, n)
+
+    def similar_users(self, user_id, n=10):
+        """Gets the users whose factors have the highest cosine with user_id's."""
+
+        row = self._pref_matrix.row_index(user_id)
+        scores = self._cosine(self._user_factors, row)
+        best = top_k(scores, n, threshold=-np.inf, exclude=row)
+        user_ids = self._pref_matrix.get_row_ids()
+
+        return [(self._users[user_ids[i]].get_value(), user_ids[i], score)
+                for i, score in zip(best.tolist(), scores[best].tolist())]
+
+    def similar_items(self, item_id, n=10):
+        """Gets the items whose factors have the highest cosine with item_id's."""
+
+        row = self._inv_pref_matrix.row_index(item_id)
+        scores = self._cosine(self._item_factors, row)
+        best = top_k(scores, n, threshold=-np.inf, exclude=row)
+        item_ids = self._inv_pref_matrix.get_row_ids()
+
+        return [(self._items[item_ids[i]].get_value(), item_ids[i], score)
+                for i, score in zip(best.tolist(), scores[best].tolist())]
@@ -0,0 +1,91 @@
+from collections import defaultdict
+
+import numpy as np
+
+
+class PairStatistics(object):
+    """Sufficient statistics of every pair of rows sharing a column.
+
+    For rows a and b, statistics(a, b) is the list
+    [count, sum_a, sum_b, sum_of_squared_a, sum_of_squared_b, sum_of_products]
+    over their shared columns, in the order expected by score_stats of the
+    Pearson and Euclidean similarities. Changing one rating only touches the
+    pairs of its row with the other rows of its column, so the affected
+    scores can be updated in O(degree) instead of rescored from scratch.
+
+    Memory grows with the sum of the squared column degrees.
+    """
+
+    def __init__(self):
+        self._stats = defaultdict(dict)
+
+    @classmethod
+    def from_columns(cls, columns):
+        """Builds the statistics from a dict of col_id mapping to
+        {row_id: value}, e.g. the inverted preferences for pairs of users.
+        """
+
+        statistics = cls()
+        for column in columns.values():
+            entries = list(column.items())
+            for row_id, value in entries:
+                for other_id, other_value in entries:
+                    if row_id != other_id:
+                        statistics._add(row_id, other_id, value, other_value, 1)
+
+        return statistics
+
+    def statistics(self, row_id, other_id):
+        return self._stats[row_id].get(other_id, [0, 0.0, 0.0, 0.0, 0.0, 0.0])
+
+    def update(self, row_id, column, old_value, new_value):
+        """Updates the pairs of row_id after its value in a column changed
+        from old_value to new_value, where None means no rating. column is a
+        dict of row_id mapping to value for the other rows of that column.
+        Returns the ids of the other rows.
+        """
+
+        others = []
+        for other_id, other_value in column.items():
+            if other_id == row_id:
+                continue
+
+            if old_value is not None:
+                self._add(row_id, other_id, old_value, other_value, -1)
+                self._add(other_id, row_id, other_value, old_value, -1)
+            if new_value is not None:
+                self._add(row_id, other_id, new_value, other_value, 1)
+                self._add(other_id, row_id, other_value, new_value, 1)
+
+            others.append(other_id)
+
+        return others
+
+    def score(self, similarity, row_id, other_id):
+        """Returns the score of a pair from its statistics."""
+        return float(similarity.score_stats(*np.array(self.statistics(row_id, other_id), dtype=np.float64)))
+
+    def _add(self, row_id, other_id, value, other_value, sign):
+        stats = self._stats[row_id].get(other_id)
+        if stats is None:
+            stats = self._stats[row_id][other_id] = [0, 0.0, 0.0, 0.0, 0.0, 0.0]
+
+        stats[0] += sign
+        stats[1] += sign * value
+        stats[2] += sign * other_value
+        stats[3] += sign * value * value
+        stats[4] += sign * other_value * other_value
+        stats[5] += sign * value * other_value
+
+        if stats[0] == 0:
+            del self._stats[row_id][other_id]
+
+
+class RatingStatistics(object):
+    """The PairStatistics of the pairs of users and of the pairs of items of
+    a recommender, kept up to date as ratings change.
+    """
+
+    def __init__(self, preferences, inverted_preferences):
+        self.users = PairStatistics.from_columns(inverted_preferences)
+        self.items = PairStatistics.from_columns(preferences)
@@ -0,0 +1,134 @@
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+
+# Phase context used when instrumentation is off
+NO_PHASE = nullcontext()
+
+
+def picklable_state(instrumented):
+    """Returns the __dict__ of an instrumented object for __getstate__,
+    without its _stats: Stats are collected in the instrumenting process
+    only, so copies pickled for other processes are not instrumented.
+    """
+    state = instrumented.__dict__.copy()
+    state.pop("_stats", None)
+    return state
+
+
+class Stats(object):
+    """Counters and per-phase wall times collected by an instrumented
+    Recommender and its Similarity.
+
+    Counters:
+    similarity_evaluations: pairs of rows scored
+    shared_items: co-rated items over all the scored pairs
+    candidates_scored: rows considered as neighbours by _similar
+
+    Phases are "similar" (neighbour lists), "accumulate" (weighting the
+    neighbours' ratings) and "rank" (picking the top n items). callback, when
+    set, is called with (name, value) for every count and finished phase.
+    """
+
+    def __init__(self, callback=None):
+        self._callback = callback
+        self.reset()
+
+    def reset(self):
+        self.counters = defaultdict(int)
+        self.timings = defaultdict(float)
+        self.phase_calls = defaultdict(int)
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+        if self._callback is not None:
+            self._callback(name, value)
+
+    def record_scores(self, evaluations, shared_items):
+        self.count("similarity_evaluations", evaluations)
+        self.count("shared_items", shared_items)
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] += elapsed
+            self.phase_calls[name] += 1
+            if self._callback is not None:
+                self._callback(name, elapsed)
+
+    def report(self):
+        """Returns the counters, the mean number of shared items per scored
+        pair and the time and calls of every phase as a dict.
+        """
+        evaluations = self.counters["similarity_evaluations"]
+
+        return {"counters": dict(self.counters),
+                "mean_shared_items": self.counters["shared_items"] / evaluations if evaluations else 0.0,
+                "phases": {name: {"seconds": seconds, "calls": self.phase_calls[name]}
+                           for name, seconds in self.timings.items()}}
+
+
+class Profile(object):
+    """Results of a profile block: the cProfile pstats.Stats, the peak traced
+    memory in bytes and the top allocation sites still alive at the end.
+    """
+
+    def __init__(self):
+        self.stats = None
+        self.peak_bytes = None
+        self.allocations = []
+
+    def report(self, limit=20, sort="cumulative"):
+        output = io.StringIO()
+        if self.stats is not None:
+            self.stats.stream = output
+            self.stats.sort_stats(sort).print_stats(limit)
+        if self.peak_bytes is not None:
+            print("Peak traced memory: {} bytes".format(self.peak_bytes), file=output)
+            for allocation in self.allocations[:limit]:
+                print(allocation, file=output)
+
+        return output.getvalue()
+
+
+@contextmanager
+def profile(cpu=True, memory=False, top=20):
+    """Profiles the block with cProfile and, with memory, tracemalloc:
+
+        with profile(memory=True) as result:
+            recommender.recommendations(user_id)
+        print(result.report())
+    """
+
+    result = Profile()
+    profiler = cProfile.Profile() if cpu else None
+
+    # Leave tracemalloc running if it was started by someone else
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    if memory:
+        tracemalloc.reset_peak()
+
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield result
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            result.stats = pstats.Stats(profiler)
+
+        if memory:
+            result.peak_bytes = tracemalloc.get_traced_memory()[1]
+            result.allocations = tracemalloc.take_snapshot().statistics("lineno")[:top]
+            if started:
+                tracemalloc.stop()
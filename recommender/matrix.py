@@ -0,0 +1,307 @@
+from collections.abc import Mapping
+
+import numpy as np
+
+
+def _ordered_ids(ids):
+    """Sorts ids so dense indices follow id order, falling back to first-seen
+    order when the ids are not mutually comparable.
+    """
+    ids = list(dict.fromkeys(ids))
+    try:
+        return sorted(ids)
+    except TypeError:
+        return ids
+
+
+def _ordered_positions(ids):
+    """Returns the ids in _ordered_ids order and an array mapping each
+    original position to its position in that order.
+    """
+    ordered = _ordered_ids(ids)
+    position = {id_: i for i, id_ in enumerate(ordered)}
+
+    return ordered, np.array([position[id_] for id_ in ids], dtype=np.int64)
+
+
+class RatingMatrix(Mapping):
+    """A ratings matrix stored in compressed sparse row (CSR) form.
+
+    Row and column ids are mapped to dense indices and the ratings are kept in
+    three NumPy arrays: indptr, indices and data. The ratings of the row at
+    index i are data[indptr[i]:indptr[i + 1]] at the column indices
+    indices[indptr[i]:indptr[i + 1]], sorted by column index.
+
+    The matrix also behaves as a read-only dict of dicts mapping row_id to
+    {col_id: rating}, so code written against the dict preferences keeps
+    working on top of it.
+    """
+
+    def __init__(self, row_ids, col_ids, indptr, indices, data):
+        self._row_ids = list(row_ids)
+        self._col_ids = list(col_ids)
+        self._row_index = {row_id: i for i, row_id in enumerate(self._row_ids)}
+        self._col_index = {col_id: i for i, col_id in enumerate(self._col_ids)}
+
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.data = np.asarray(data)
+        if self.data.dtype.kind != "f":
+            self.data = self.data.astype(np.float64)
+
+        self._transpose = None
+
+    @classmethod
+    def from_dict(cls, prefs):
+        """Builds a matrix from a dict of row_id mapping to {col_id: rating}."""
+
+        row_ids = _ordered_ids(prefs.keys())
+        col_ids = _ordered_ids(col_id for row in prefs.values() for col_id in row)
+        col_index = {col_id: i for i, col_id in enumerate(col_ids)}
+
+        nnz = sum(len(row) for row in prefs.values())
+        rows = np.empty(nnz, dtype=np.int64)
+        cols = np.empty(nnz, dtype=np.int64)
+        values = np.empty(nnz, dtype=np.float64)
+
+        pos = 0
+        for i, row_id in enumerate(row_ids):
+            row = prefs[row_id]
+            end = pos + len(row)
+            rows[pos:end] = i
+            cols[pos:end] = [col_index[col_id] for col_id in row]
+            values[pos:end] = list(row.values())
+            pos = end
+
+        return cls.from_coo(rows, cols, values, row_ids, col_ids)
+
+    @classmethod
+    def from_table(cls, table):
+        """Builds a users by items matrix straight from the columns of a
+        RatingTable, keeping its float32 ratings.
+        """
+
+        user_ids, user_positions = _ordered_positions(table.user_ids)
+        item_ids, item_positions = _ordered_positions(table.item_ids)
+
+        return cls.from_coo(user_positions[table.user_index],
+                            item_positions[table.item_index],
+                            table.ratings,
+                            user_ids,
+                            item_ids)
+
+    @classmethod
+    def from_coo(cls, rows, cols, values, row_ids, col_ids):
+        """Builds a matrix from parallel arrays of dense row indices, dense
+        column indices and ratings.
+        """
+
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        values = np.asarray(values)
+
+        order = np.lexsort((cols, rows))
+        counts = np.bincount(rows, minlength=len(row_ids))
+        indptr = np.concatenate(([0], np.cumsum(counts)))
+
+        return cls(row_ids, col_ids, indptr, cols[order], values[order])
+
+    @property
+    def shape(self):
+        return len(self._row_ids), len(self._col_ids)
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def get_row_ids(self):
+        return self._row_ids
+
+    def get_col_ids(self):
+        return self._col_ids
+
+    def row_index(self, row_id):
+        return self._row_index[row_id]
+
+    def col_index(self, col_id):
+        return self._col_index[col_id]
+
+    def row(self, index):
+        """Returns the (column indices, ratings) arrays of the row at index."""
+
+        start, end = self.indptr[index], self.indptr[index + 1]
+        return self.indices[start:end], self.data[start:end]
+
+    def gather(self, rows):
+        """Returns the concatenated entries of several rows.
+
+        The result is a tuple of (lengths, indices, data) where lengths[k] is
+        the number of entries contributed by rows[k].
+        """
+
+        starts = self.indptr[rows]
+        lengths = self.indptr[np.asarray(rows) + 1] - starts
+        offsets = np.cumsum(lengths) - lengths
+        positions = np.arange(lengths.sum()) + np.repeat(starts - offsets, lengths)
+
+        return lengths, self.indices[positions], self.data[positions]
+
+    def take(self, rows):
+        """Returns the matrix made of the rows at the indices rows, in order,
+        with the same columns.
+        """
+
+        lengths, indices, data = self.gather(rows)
+        indptr = np.concatenate(([0], np.cumsum(lengths)))
+        row_ids = [self._row_ids[row] for row in np.asarray(rows).tolist()]
+
+        return RatingMatrix(row_ids, self._col_ids, indptr, indices, data)
+
+    def to_dense(self, cols=None, data=None):
+        """Returns the matrix as a dense (rows, columns) array, restricted to
+        the column indices cols when given. data replaces the stored ratings,
+        e.g. with ones for the pattern of rated entries.
+        """
+
+        data = self.data if data is None else data
+        rows = self.row_of_entries()
+
+        if cols is None:
+            dense = np.zeros(self.shape)
+            dense[rows, self.indices] = data
+            return dense
+
+        position = np.full(len(self._col_ids), -1, dtype=np.int64)
+        position[cols] = np.arange(len(cols))
+        kept = position[self.indices] >= 0
+
+        dense = np.zeros((len(self._row_ids), len(cols)))
+        dense[rows[kept], position[self.indices[kept]]] = data[kept]
+
+        return dense
+
+    def dot(self, dense, data=None, max_entries=1 << 22):
+        """Returns the product of this matrix with a dense 2d array of shape
+        (columns, m), as a dense (rows, m) array. data replaces the stored
+        ratings, e.g. with ones to multiply the pattern of rated entries.
+
+        Rows are processed in blocks of about max_entries products so the
+        intermediate (entries, m) array stays bounded.
+        """
+
+        data = self.data if data is None else data
+        dense = np.asarray(dense)
+        size, width = len(self._row_ids), dense.shape[1]
+        result = np.zeros((size, width), dtype=np.float64)
+
+        block_rows = max(1, max_entries // max(1, width * max(1, self.nnz // max(1, size))))
+        for start in range(0, size, block_rows):
+            end = min(start + block_rows, size)
+            begin, finish = self.indptr[start], self.indptr[end]
+            if begin == finish:
+                continue
+
+            products = data[begin:finish, None] * dense[self.indices[begin:finish]]
+
+            # reduceat sums between consecutive offsets, so empty rows are
+            # skipped and left at zero
+            counts = np.diff(self.indptr[start:end + 1])
+            filled = np.flatnonzero(counts)
+            result[start + filled] = np.add.reduceat(products, self.indptr[start:end][filled] - begin, axis=0)
+
+        return result
+
+    def row_counts(self):
+        """Returns the number of ratings in every row."""
+        return np.diff(self.indptr)
+
+    def row_of_entries(self):
+        """Returns the dense row index of every stored rating."""
+        return np.repeat(np.arange(len(self._row_ids)), self.row_counts())
+
+    def transpose(self):
+        """Returns the transposed matrix, i.e. this matrix in CSC form.
+
+        The transpose is built once and cached on both matrices.
+        """
+
+        if self._transpose is None:
+            transposed = RatingMatrix.from_coo(self.indices,
+                                               self.row_of_entries(),
+                                               self.data,
+                                               self._col_ids,
+                                               self._row_ids)
+            transposed._transpose = self
+            self._transpose = transposed
+
+        return self._transpose
+
+    def set_value(self, row_id, col_id, value):
+        """Sets one rating in place, adding the row or column if it is new,
+        and keeps the cached transpose in sync.
+
+        New ratings are inserted into the arrays, which copies them in
+        O(nnz) time for this matrix and again for its transpose, so this is
+        meant for trickles of updates rather than bulk loading. Replacing an
+        existing rating does not copy.
+        """
+        self._set_value(row_id, col_id, value)
+        if self._transpose is not None:
+            self._transpose._set_value(col_id, row_id, value)
+
+    def remove_value(self, row_id, col_id):
+        """Removes one rating in place and from the cached transpose, copying
+        the arrays of both like set_value.
+        """
+        self._remove_value(row_id, col_id)
+        if self._transpose is not None:
+            self._transpose._remove_value(col_id, row_id)
+
+    def _find(self, row, col):
+        start, end = self.indptr[row], self.indptr[row + 1]
+        position = start + int(np.searchsorted(self.indices[start:end], col))
+
+        return position, position < end and self.indices[position] == col
+
+    def _set_value(self, row_id, col_id, value):
+        if row_id not in self._row_index:
+            self._row_index[row_id] = len(self._row_ids)
+            self._row_ids.append(row_id)
+            self.indptr = np.append(self.indptr, self.indptr[-1])
+
+        if col_id not in self._col_index:
+            self._col_index[col_id] = len(self._col_ids)
+            self._col_ids.append(col_id)
+
+        row = self._row_index[row_id]
+        position, found = self._find(row, self._col_index[col_id])
+
+        if found:
+            self.data[position] = value
+        else:
+            self.indices = np.insert(self.indices, position, self._col_index[col_id])
+            self.data = np.insert(self.data, position, value)
+            self.indptr[row + 1:] += 1
+
+    def _remove_value(self, row_id, col_id):
+        row = self._row_index[row_id]
+        position, found = self._find(row, self._col_index[col_id])
+        if not found:
+            raise KeyError((row_id, col_id))
+
+        self.indices = np.delete(self.indices, position)
+        self.data = np.delete(self.data, position)
+        self.indptr[row + 1:] -= 1
+
+    def __getitem__(self, row_id):
+        indices, data = self.row(self._row_index[row_id])
+        return {self._col_ids[col]: value for col, value in zip(indices.tolist(), data.tolist())}
+
+    def __contains__(self, row_id):
+        return row_id in self._row_index
+
+    def __iter__(self):
+        return iter(self._row_ids)
+
+    def __len__(self):
+        return len(self._row_ids)
@@ -1,6 +1,8 @@
 class User:
     """Bare minimum User object for collaborative filtering."""
 
+    __slots__ = ("_id", "_value", "_preferences")
+
     def __init__(self, user_id, value):
         self._id = user_id
         self._value = value
@@ -24,6 +26,8 @@ class User:
 class Item:
     """Bare minimum Item object for collaborative filtering."""
 
+    __slots__ = ("_id", "_value")
+
     def __init__(self, item_id, value):
         self._id = item_id
         self._value = value
@@ -0,0 +1,400 @@
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+import heapq
+import json
+import struct
+
+import numpy as np
+
+# Layout of a neighbour index file: the magic bytes, the format version and
+# the length of a JSON header describing the id maps and the arrays, then
+# the arrays themselves, each aligned to ALIGNMENT bytes.
+MAGIC = b"RECNBRS\0"
+VERSION = 1
+ALIGNMENT = 64
+_PREAMBLE = struct.Struct("<8sII")
+
+# Score types a NeighbourIndex can store. int8 scores are quantized with one
+# scale per index.
+SCORE_DTYPES = ("float64", "float32", "float16", "int8")
+
+
+def top_n(pairs, n=None):
+    """Returns the n largest (score, id) pairs with a non-zero score, best
+    first, in the same order as sorting the pairs in reverse.
+
+    It keeps a heap of n pairs, so it allocates O(n) rather than a list of
+    every pair. With n None every non-zero pair is returned.
+    """
+
+    pairs = (pair for pair in pairs if pair[0] != 0)
+
+    if n is None:
+        return sorted(pairs, reverse=True)
+
+    return heapq.nlargest(n, pairs)
+
+
+def top_k(scores, k=None, threshold=None, exclude=None):
+    """Returns the indices of the k highest scores, best first.
+
+    Only scores above threshold are kept, or only non-zero scores when
+    threshold is None. Ties are broken by the higher index, which matches
+    sorting (score, id) tuples in reverse when ids are in index order. The
+    index exclude, usually the row itself, is never returned.
+    """
+
+    if threshold is None:
+        keep = scores != 0
+    else:
+        keep = scores > threshold
+
+    if exclude is not None:
+        keep[exclude] = False
+
+    candidates = np.flatnonzero(keep)
+
+    if k is not None and len(candidates) > k:
+        if k <= 0:
+            return candidates[:0]
+
+        # Every candidate scoring at least the k-th best score is kept so
+        # that ties at the cut-off are resolved by index below.
+        kth_best = np.partition(scores[candidates], len(candidates) - k)[len(candidates) - k]
+        candidates = candidates[scores[candidates] >= kth_best]
+
+    order = np.lexsort((candidates, scores[candidates]))[::-1]
+
+    return candidates[order[:k]]
+
+
+class NeighbourIndex(Mapping):
+    """Top-k neighbour lists of every row of a square similarity matrix.
+
+    Neighbours are kept in two fixed-width arrays of shape (rows, width):
+    indices holds the dense index of each neighbour, padded with -1, and
+    scores holds the similarity scores. Each row is sorted best first, so
+    the top n neighbours of a row are a prefix slice.
+
+    scores can be stored as float64, float32, float16 or int8 (see astype).
+    int8 scores are quantized as round(score / scale), with scale set so the
+    largest absolute score maps to 127. neighbours and score_values return
+    the decoded float scores.
+
+    The index also behaves as a read-only dict of dicts mapping row_id to
+    {neighbour_id: score}, like the result of Similarity.score_matrix on
+    dict preferences.
+    """
+
+    def __init__(self, row_ids, indices, scores, k=None, scale=None):
+        self._row_ids = list(row_ids)
+        self._row_index = {row_id: i for i, row_id in enumerate(self._row_ids)}
+
+        self.indices = indices
+        self.scores = scores
+
+        # Quantization step of integer scores, None for float scores
+        self.scale = scale
+
+        # Maximum number of neighbours per row, or None to widen the arrays
+        # when an update needs it
+        self._k = k
+
+    @classmethod
+    def from_rows(cls, row_ids, rows, width=None, dtype="float64"):
+        """Builds an index from a list of (indices, scores) array pairs, one
+        per row, sorted best first. A width of None fits the longest row and
+        lets updates widen the index. Scores are stored as dtype.
+        """
+
+        k = width
+        if width is None:
+            width = max((len(indices) for indices, _ in rows), default=0)
+
+        indices = np.full((len(rows), width), -1, dtype=np.int32)
+        scores = np.zeros((len(rows), width), dtype=np.float64)
+
+        for i, (row_indices, row_scores) in enumerate(rows):
+            indices[i, :len(row_indices)] = row_indices
+            scores[i, :len(row_scores)] = row_scores
+
+        return cls(row_ids, indices, scores, k=k).astype(dtype)
+
+    @classmethod
+    def from_mapping(cls, similarities, k=None, dtype="float64"):
+        """Builds an index from a dict of dicts of scores, keeping the top k
+        non-zero neighbours of each row, with scores stored as dtype.
+        """
+
+        row_ids = list(similarities.keys())
+        row_index = {row_id: i for i, row_id in enumerate(row_ids)}
+
+        rows = []
+        for row_id in row_ids:
+            neighbours = [(score, row_index[neighbour_id])
+                          for neighbour_id, score in similarities[row_id].items()
+                          if score != 0 and neighbour_id in row_index]
+            neighbours.sort(reverse=True)
+            neighbours = neighbours[:k]
+
+            rows.append((np.array([index for _, index in neighbours], dtype=np.int32),
+                         np.array([score for score, _ in neighbours], dtype=np.float64)))
+
+        return cls.from_rows(row_ids, rows, width=k, dtype=dtype)
+
+    def astype(self, dtype):
+        """Returns a copy of the index with its scores stored as dtype, one
+        of SCORE_DTYPES, or the index itself when they already are.
+
+        Rows stay sorted by the exact scores, so the neighbours returned and
+        their order do not change, only the precision of their scores.
+        """
+
+        if str(dtype) not in SCORE_DTYPES:
+            raise ValueError("Unknown score dtype {!r}, expected one of {}.".format(dtype, SCORE_DTYPES))
+        if self.scores.dtype == np.dtype(dtype):
+            return self
+
+        values = self.score_values()
+        scale = None
+        if dtype == "int8":
+            largest = float(np.abs(values).max()) if values.size else 0.0
+            scale = largest / 127 if largest > 0 else 1.0
+
+        index = NeighbourIndex(self._row_ids, self.indices.copy(), np.zeros(values.shape, dtype=dtype), k=self._k, scale=scale)
+        index.scores[:] = index._encode(values)
+
+        return index
+
+    def _encode(self, values):
+        if self.scale is None:
+            return values
+
+        # Scores beyond the range seen when quantizing are clipped to it
+        return np.clip(np.rint(np.asarray(values, dtype=np.float64) / self.scale), -127, 127)
+
+    def score_values(self, rows=slice(None)):
+        """Returns the decoded float64 scores of the rows selected by rows."""
+
+        scores = self.scores[rows].astype(np.float64)
+        if self.scale is not None:
+            scores *= self.scale
+
+        return scores
+
+    @property
+    def k(self):
+        """Maximum number of neighbours per row, None when unbounded."""
+        return self._k
+
+    @property
+    def width(self):
+        return self.indices.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.indices.nbytes + self.scores.nbytes
+
+    def get_row_ids(self):
+        return self._row_ids
+
+    def row_index(self, row_id):
+        return self._row_index[row_id]
+
+    def neighbours(self, row_id, n=None):
+        """Returns up to n (score, neighbour_id) tuples for row_id, best first."""
+
+        row = self._row_index[row_id]
+        indices = self.indices[row, :n]
+        count = int(np.count_nonzero(indices >= 0))
+
+        return [(score, self._row_ids[index])
+                for index, score in zip(indices[:count].tolist(), self.score_values((row, slice(0, count))).tolist())]
+
+    def add_row(self, row_id):
+        """Adds an empty neighbour list for a new row_id."""
+
+        self._row_index[row_id] = len(self._row_ids)
+        self._row_ids.append(row_id)
+
+        self.indices = np.vstack((self.indices, np.full((1, self.width), -1, dtype=self.indices.dtype)))
+        self.scores = np.vstack((self.scores, np.zeros((1, self.width), dtype=self.scores.dtype)))
+
+    def set_row(self, row_id, neighbours):
+        """Replaces the neighbour list of row_id with the best k of the
+        (score, neighbour_id) tuples in neighbours.
+        """
+
+        # The memory-mapped arrays of load_indexes are read-only, so they are
+        # copied before the first write
+        if not (self.indices.flags.writeable and self.scores.flags.writeable):
+            self.indices = np.array(self.indices)
+            self.scores = np.array(self.scores)
+
+        for neighbour_id in [row_id] + [neighbour_id for _, neighbour_id in neighbours]:
+            if neighbour_id not in self._row_index:
+                self.add_row(neighbour_id)
+
+        best = top_n(((score, self._row_index[neighbour_id]) for score, neighbour_id in neighbours), self._k)
+
+        if len(best) > self.width:
+            extra = len(best) - self.width
+            self.indices = np.hstack((self.indices, np.full((len(self._row_ids), extra), -1, dtype=self.indices.dtype)))
+            self.scores = np.hstack((self.scores, np.zeros((len(self._row_ids), extra), dtype=self.scores.dtype)))
+
+        row = self._row_index[row_id]
+        self.indices[row] = -1
+        self.scores[row] = 0
+        self.indices[row, :len(best)] = [index for _, index in best]
+        self.scores[row, :len(best)] = self._encode([score for score, _ in best])
+
+    def update(self, row_id, neighbour_id, score):
+        """Sets the score of neighbour_id in the neighbour list of row_id,
+        keeping the list sorted and within width.
+
+        When a neighbour drops out, the row is not refilled with the next best
+        neighbour, which the index does not keep.
+        """
+
+        current = self.neighbours(row_id) if row_id in self._row_index else []
+        neighbours = [(old_score, old_id) for old_score, old_id in current if old_id != neighbour_id]
+        self.set_row(row_id, neighbours + [(score, neighbour_id)])
+
+    def __getitem__(self, row_id):
+        return {neighbour_id: score for score, neighbour_id in self.neighbours(row_id)}
+
+    def __contains__(self, row_id):
+        return row_id in self._row_index
+
+    def __iter__(self):
+        return iter(self._row_ids)
+
+    def __len__(self):
+        return len(self._row_ids)
+
+
+# State shared with the worker processes of build_neighbour_index
+_worker_state = {}
+
+
+def _init_worker(similarity, matrix, k, threshold):
+    _worker_state.update(similarity=similarity, matrix=matrix, k=k, threshold=threshold)
+
+
+def _score_tile(bounds):
+    """Scores one tile of rows against every row and reduces each row to its
+    top-k neighbours, so only the tile is ever held in memory.
+    """
+
+    start, end = bounds
+    similarity = _worker_state["similarity"]
+    matrix = _worker_state["matrix"]
+
+    tile = similarity.score_block(np.arange(start, end), matrix)
+
+    rows = []
+    for offset, scores in enumerate(tile):
+        row = start + offset
+        indices = top_k(scores, _worker_state["k"], _worker_state["threshold"], exclude=row)
+        rows.append((indices, scores[indices]))
+
+    return rows
+
+
+def build_neighbour_index(similarity, matrix, k=None, threshold=None, workers=1, block_size=256):
+    """Computes the top-k neighbours of every row of matrix, a RatingMatrix.
+
+    The rows are split into tiles of block_size rows, each scored against all
+    rows with similarity.score_block, so peak memory is bounded by
+    block_size * rows per worker. With workers > 1 the tiles are spread over
+    a process pool.
+    """
+
+    size = matrix.shape[0]
+    tiles = [(start, min(start + block_size, size)) for start in range(0, size, block_size)]
+
+    rows = []
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_worker,
+                                 initargs=(similarity, matrix, k, threshold)) as executor:
+            for tile_rows in executor.map(_score_tile, tiles):
+                rows.extend(tile_rows)
+    else:
+        _init_worker(similarity, matrix, k, threshold)
+        try:
+            for tile in tiles:
+                rows.extend(_score_tile(tile))
+        finally:
+            _worker_state.clear()
+
+    width = None if k is None else min(k, max(size - 1, 0))
+
+    return NeighbourIndex.from_rows(matrix.get_row_ids(), rows, width=width)
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def save_indexes(path, indexes):
+    """Saves a dict of name mapping to NeighbourIndex into one binary file."""
+
+    header = {}
+    arrays = []
+    offset = 0
+    for name, index in indexes.items():
+        entry = {"ids": index.get_row_ids(), "shape": list(index.indices.shape), "scale": index.scale}
+        for field in ("indices", "scores"):
+            array = np.ascontiguousarray(getattr(index, field))
+            entry[field] = {"dtype": array.dtype.str, "offset": offset}
+            arrays.append((offset, array))
+            offset = _aligned(offset + array.nbytes)
+        header[name] = entry
+
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = _aligned(_PREAMBLE.size + len(header_bytes))
+
+    with open(path, "wb") as index_file:
+        index_file.write(_PREAMBLE.pack(MAGIC, VERSION, len(header_bytes)))
+        index_file.write(header_bytes)
+        for array_offset, array in arrays:
+            index_file.seek(data_start + array_offset)
+            index_file.write(array.tobytes())
+        index_file.truncate(data_start + offset)
+
+
+def load_indexes(path, mmap=True):
+    """Loads the dict of name mapping to NeighbourIndex saved by save_indexes.
+
+    With mmap the arrays are read-only np.memmap views of the file, so
+    processes opening the same file share one copy through the page cache.
+    """
+
+    with open(path, "rb") as index_file:
+        magic, version, header_size = _PREAMBLE.unpack(index_file.read(_PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError("{} is not a neighbour index file.".format(path))
+        if version != VERSION:
+            raise ValueError("Unsupported neighbour index version {} in {}.".format(version, path))
+        header = json.loads(index_file.read(header_size).decode("utf-8"))
+
+    data_start = _aligned(_PREAMBLE.size + header_size)
+
+    indexes = {}
+    for name, entry in header.items():
+        shape = tuple(entry["shape"])
+        arrays = {}
+        for field in ("indices", "scores"):
+            dtype = np.dtype(entry[field]["dtype"])
+            offset = data_start + entry[field]["offset"]
+            if not mmap:
+                arrays[field] = np.fromfile(path, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+            elif np.prod(shape) == 0:
+                arrays[field] = np.zeros(shape, dtype=dtype)
+            else:
+                arrays[field] = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+        indexes[name] = NeighbourIndex(entry["ids"], arrays["indices"], arrays["scores"], k=shape[1],
+                                       scale=entry.get("scale"))
+
+    return indexes
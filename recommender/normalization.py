@@ -0,0 +1,146 @@
+import numpy as np
+
+
+class MeanCentering(object):
+    """Per-row and per-column means of a RatingMatrix and the norms of its
+    mean-centred rows, computed once.
+
+    centre selects the means subtracted from every rating: "columns" for
+    adjusted cosine (e.g. each user's mean when rows are items), "rows" for
+    the Pearson-style centring on each row's own mean. Ratings are centred
+    as they are read, so no centred copy of the matrix is kept.
+
+    update follows a change of one rating of matrix, touching only the norms
+    of the rows centred on a mean that changed.
+    """
+
+    CENTRES = ("columns", "rows")
+
+    def __init__(self, matrix, centre="columns"):
+        if centre not in self.CENTRES:
+            raise ValueError("Unknown centre {!r}, expected one of {}.".format(centre, self.CENTRES))
+
+        self.matrix = matrix
+        self.centre = centre
+
+        rows = matrix.row_of_entries()
+        size, width = matrix.shape
+
+        self.row_counts = np.bincount(rows, minlength=size)
+        self.col_counts = np.bincount(matrix.indices, minlength=width)
+        self.row_sums = np.bincount(rows, weights=matrix.data, minlength=size)
+        self.col_sums = np.bincount(matrix.indices, weights=matrix.data, minlength=width)
+        self.row_means = self.row_sums / np.maximum(self.row_counts, 1)
+        self.col_means = self.col_sums / np.maximum(self.col_counts, 1)
+
+        data = self._centred(rows, matrix.indices, matrix.data)
+        self.row_squares = np.bincount(rows, weights=data * data, minlength=size)
+        self.row_norms = np.sqrt(self.row_squares)
+
+    def _centred(self, rows, cols, values):
+        """Returns the centred values of the ratings at (rows, cols)."""
+        if self.centre == "columns":
+            return values - self.col_means[cols]
+
+        return values - self.row_means[rows]
+
+    def update(self, row_id, col_id, old_value, new_value):
+        """Updates the means and norms after the rating of row_id for col_id
+        changed from old_value to new_value, either None when there is no
+        rating. matrix must already hold the new rating.
+
+        Only the norms of the column's rows (centre="columns") or of the row
+        (centre="rows") are recomputed, in time linear in their number.
+        Returns the indices of the rows whose centred values changed.
+        """
+        self._grow()
+
+        r = self.matrix.row_index(row_id)
+        c = self.matrix.col_index(col_id)
+
+        old_col_mean = self.col_means[c]
+        if old_value is not None and self.centre == "columns":
+            self.row_squares[r] -= (old_value - old_col_mean) ** 2
+
+        for value, sign in ((old_value, -1), (new_value, 1)):
+            if value is not None:
+                self.row_counts[r] += sign
+                self.col_counts[c] += sign
+                self.row_sums[r] += sign * value
+                self.col_sums[c] += sign * value
+
+        self.row_means[r] = self.row_sums[r] / max(self.row_counts[r], 1)
+        self.col_means[c] = self.col_sums[c] / max(self.col_counts[c], 1)
+
+        if self.centre == "columns":
+            # Every other rating of the column moved with its mean
+            others, values = self.matrix.transpose().row(c)
+            keep = others != r
+            others, values = others[keep], values[keep]
+            self.row_squares[others] += (values - self.col_means[c]) ** 2 - (values - old_col_mean) ** 2
+
+            if new_value is not None:
+                self.row_squares[r] += (new_value - self.col_means[c]) ** 2
+            changed = np.append(others, r)
+        else:
+            cols, values = self.matrix.row(r)
+            self.row_squares[r] = float(np.sum((values - self.row_means[r]) ** 2))
+            changed = np.array([r])
+
+        self.row_norms[changed] = np.sqrt(np.maximum(self.row_squares[changed], 0))
+
+        return changed
+
+    def _grow(self):
+        # Rows and columns added to matrix since the last update start empty
+        size, width = self.matrix.shape
+        for name, length in (("row_counts", size), ("row_sums", size), ("row_means", size),
+                             ("row_squares", size), ("row_norms", size),
+                             ("col_counts", width), ("col_sums", width), ("col_means", width)):
+            array = getattr(self, name)
+            if len(array) < length:
+                setattr(self, name, np.concatenate((array, np.zeros(length - len(array), dtype=array.dtype))))
+
+    def dot_many(self, row):
+        """Returns the centred dot products of the row at index row with every
+        row and the number of columns they share, with one sparse mat-vec.
+        """
+        cols, values = self.matrix.row(row)
+        values = self._centred(row, cols, values)
+        lengths, other_rows, values2 = self.matrix.transpose().gather(cols)
+        values2 = self._centred(other_rows, np.repeat(cols, lengths), values2)
+
+        size = self.matrix.shape[0]
+        dots = np.bincount(other_rows, weights=np.repeat(values, lengths) * values2, minlength=size)
+
+        return dots, np.bincount(other_rows, minlength=size)
+
+    def dot_candidates(self, row, candidates):
+        """Returns the centred dot products and shared column counts of the
+        row at index row with the rows at the indices candidates.
+        """
+        cols, values = self.matrix.row(row)
+        lookup = np.zeros(self.matrix.shape[1])
+        lookup[cols] = self._centred(row, cols, values)
+        rated = np.zeros(self.matrix.shape[1], dtype=bool)
+        rated[cols] = True
+
+        lengths, other_cols, values2 = self.matrix.gather(candidates)
+        owners = np.repeat(np.arange(len(candidates)), lengths)
+        values2 = self._centred(np.repeat(candidates, lengths), other_cols, values2)
+        shared = rated[other_cols]
+
+        dots = np.bincount(owners[shared], weights=lookup[other_cols[shared]] * values2[shared], minlength=len(candidates))
+
+        return dots, np.bincount(owners[shared], minlength=len(candidates))
+
+    def dot_pair(self, row1, row2):
+        """Returns the centred dot product and shared column count of two rows."""
+        cols1, values1 = self.matrix.row(row1)
+        cols2, values2 = self.matrix.row(row2)
+        _, positions1, positions2 = np.intersect1d(cols1, cols2, assume_unique=True, return_indices=True)
+
+        values1 = self._centred(row1, cols1[positions1], values1[positions1])
+        values2 = self._centred(row2, cols2[positions2], values2[positions2])
+
+        return float(values1 @ values2), len(positions1)
@@ -0,0 +1,69 @@
+from collections import Counter, defaultdict, deque
+
+from recommender.popularity import ItemPopularity
+
+
+class QueryPlanner(object):
+    """Chooses the path of recommendation queries and records the paths taken.
+
+    Users with fewer ratings than the recommender needs are answered by
+    cold_start: "popularity" ranks items by damped mean rating, "fold_in"
+    scores items from the neighbourhoods of the few items the user rated and
+    falls back to popularity, and None always runs the full path. The last
+    path_log_size queries are logged.
+    """
+
+    COLD_STARTS = (None, "popularity", "fold_in")
+
+    # Neighbours of each rated item used by the fold-in path
+    FOLD_IN_NEIGHBOURS = 50
+
+    def __init__(self, cold_start="popularity", popularity_prior=10, path_log_size=1000):
+        if cold_start not in self.COLD_STARTS:
+            raise ValueError("Unknown cold_start {!r}, expected one of {}.".format(cold_start, self.COLD_STARTS))
+
+        self.cold_start = cold_start
+        self._popularity_prior = popularity_prior
+        self._popularity = None
+        self._path_counts = Counter()
+        self._path_log = deque(maxlen=path_log_size)
+
+    def plan(self, degree, min_degree):
+        """Returns "full" for a user with degree ratings, or the cold_start
+        path when that is fewer than min_degree.
+        """
+        if self.cold_start is None or degree >= min_degree:
+            return "full"
+
+        return self.cold_start
+
+    def record(self, method, row_id, path):
+        self._path_counts[(method, path)] += 1
+        self._path_log.append((method, row_id, path))
+
+    def query_paths(self):
+        """Returns the number of queries of each method that took each path,
+        as {method: {path: count}}.
+        """
+        paths = defaultdict(dict)
+        for (method, path), count in self._path_counts.items():
+            paths[method][path] = count
+
+        return dict(paths)
+
+    def path_log(self):
+        """Returns the (method, id, path) of the last path_log_size queries."""
+        return list(self._path_log)
+
+    def popularity(self, columns):
+        """Returns the ItemPopularity of the inverted preferences columns,
+        built on first use after a reset.
+        """
+        if self._popularity is None:
+            self._popularity = ItemPopularity.from_columns(columns, self._popularity_prior)
+
+        return self._popularity
+
+    def reset(self):
+        """Drops the popularity tables after the ratings changed."""
+        self._popularity = None
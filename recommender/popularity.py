@@ -0,0 +1,62 @@
+import numpy as np
+
+from recommender.matrix import RatingMatrix
+
+
+class ItemPopularity(object):
+    """Per-item rating counts and means, and the items ranked by a damped
+    mean rating, used to answer users with too few ratings to be compared.
+
+    The damped mean (sum + prior * global mean) / (count + prior) pulls the
+    means of rarely rated items towards the global mean, so an item with a
+    single 5 star rating does not outrank well liked popular items.
+    """
+
+    def __init__(self, item_ids, counts, sums, prior=10):
+        self._item_ids = list(item_ids)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.sums = np.asarray(sums, dtype=np.float64)
+
+        total = self.counts.sum()
+        global_mean = self.sums.sum() / total if total else 0.0
+
+        self.means = self.sums / np.maximum(self.counts, 1)
+        self.scores = (self.sums + prior * global_mean) / (self.counts + prior)
+
+        # Best first, ties broken by the more rated item
+        self._order = np.lexsort((-self.counts, -self.scores))
+
+    @classmethod
+    def from_columns(cls, columns, prior=10):
+        """Builds the tables from the inverted preferences, a RatingMatrix or
+        dict of item_id mapping to {user_id: rating}.
+        """
+
+        if isinstance(columns, RatingMatrix):
+            counts = columns.row_counts()
+            sums = np.bincount(columns.row_of_entries(), weights=columns.data, minlength=len(counts))
+            return cls(columns.get_row_ids(), counts, sums, prior)
+
+        item_ids = [item_id for item_id, column in columns.items() if column]
+        return cls(item_ids,
+                   [len(columns[item_id]) for item_id in item_ids],
+                   [sum(columns[item_id].values()) for item_id in item_ids],
+                   prior)
+
+    def get_item_ids(self):
+        return self._item_ids
+
+    def top(self, n=10, exclude=()):
+        """Returns the n best (damped mean, item_id) tuples, leaving out the
+        item ids in exclude.
+        """
+
+        best = []
+        for index in self._order.tolist():
+            if len(best) == n:
+                break
+            item_id = self._item_ids[index]
+            if item_id not in exclude:
+                best.append((float(self.scores[index]), item_id))
+
+        return best
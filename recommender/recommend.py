@@ -1,12 +1,55 @@
 from abc import ABCMeta, abstractmethod
 from collections import defaultdict
-
+from itertools import islice
+import heapq
+
+import numpy as np
+
+from recommender.ann import recall_at_k
+from recommender.cache import SimilarityCache
+from recommender.matrix import RatingMatrix
+from recommender.incremental import RatingStatistics
+from recommender.instrumentation import NO_PHASE, picklable_state
+from recommender.models import User, Item
+from recommender.table import RatingTable
+from recommender.neighbours import SCORE_DTYPES, NeighbourIndex, save_indexes, load_indexes, top_k, top_n
+from recommender.planner import QueryPlanner
 from recommender.similarity import PearsonSimilarity
 
 
+def _blocks(ids, block_size):
+    """Yields lists of up to block_size ids, consuming ids lazily."""
+    ids = iter(ids)
+    while True:
+        block = list(islice(ids, block_size))
+        if not block:
+            return
+        yield block
+
+
 class Recommender(metaclass=ABCMeta):
     """Interface for all collaborative filtering recommenders."""
 
+    # Stats object of recommender.instrumentation, set by instrument
+    _stats = None
+
+    def instrument(self, stats):
+        """Collects counters and phase timings of this recommender and its
+        similarity into stats, a recommender.instrumentation.Stats, or stops
+        collecting when stats is None. Returns stats.
+        """
+        self._stats = stats
+        if hasattr(self, "_similarity"):
+            self._similarity._stats = stats
+
+        return stats
+
+    def _phase(self, name):
+        return self._stats.phase(name) if self._stats is not None else NO_PHASE
+
+    def __getstate__(self):
+        return picklable_state(self)
+
     @abstractmethod
     def load(self, users, items):
         """Processes users and items for recommendations and similarity."""
@@ -27,12 +70,66 @@ class Recommender(metaclass=ABCMeta):
         """Returns item recommendations for user."""
         raise NotImplementedError
 
+    def similar_users_batch(self, user_ids, n=10):
+        """Yields (user_id, similar users) for every user in user_ids."""
+        for user_id in user_ids:
+            yield user_id, self.similar_users(user_id, n)
+
+    def similar_items_batch(self, item_ids, n=10):
+        """Yields (item_id, similar items) for every item in item_ids."""
+        for item_id in item_ids:
+            yield item_id, self.similar_items(item_id, n)
+
+    def recommendations_batch(self, user_ids, n=10):
+        """Yields (user_id, recommendations) for every user in user_ids."""
+        for user_id in user_ids:
+            yield user_id, self.recommendations(user_id, n)
+
 
 class WeightedSimilarityRecommender(Recommender):
-    """A collaborative recommender based on weighted similarity vectors."""
+    """A collaborative recommender based on weighted similarity vectors.
+
+    storage selects how preferences are kept: "dict" keeps nested dicts and
+    "sparse" keeps them in a RatingMatrix (CSR arrays for the preferences and
+    their CSC transpose for the inverted preferences).
+
+    With memorize, the top neighbours of each row scoring above threshold are
+    precomputed over workers processes for sparse storage, and stored with
+    scores of score_dtype when set. neighbours=None keeps every score.
+
+    cache is a SimilarityCache of the queries of a recommender that does not
+    memorize, ann an AnnSearch narrowing the neighbour search to MinHash
+    candidates, and planner the QueryPlanner answering cold users. With
+    memorize and incremental, RatingStatistics update the memorized scores
+    after add_rating, update_rating and remove_rating.
+    """
+
+    STORAGES = ("dict", "sparse")
+
+    def __init__(self, memorize=False, storage="dict", neighbours=100, threshold=None, workers=1,
+                 score_dtype=None, cache=None, ann=None, planner=None, incremental=False):
+        if storage not in self.STORAGES:
+            raise ValueError("Unknown storage {!r}, expected one of {}.".format(storage, self.STORAGES))
+        if score_dtype is not None and score_dtype not in SCORE_DTYPES:
+            raise ValueError("Unknown score_dtype {!r}, expected one of {}.".format(score_dtype, SCORE_DTYPES))
 
-    def __init__(self, memorize=False):
         self._memorize = memorize
+        self._storage = storage
+
+        # Options of the blocked all-pairs engine used when memorizing
+        # sparse preferences
+        self._neighbours = neighbours
+        self._threshold = threshold
+        self._workers = workers
+        self._score_dtype = score_dtype
+
+        self._cache = cache or SimilarityCache()
+        self._ann = ann
+        self._planner = planner or QueryPlanner()
+
+        # Pair statistics kept up to date by add/update/remove_rating
+        self._incremental = incremental
+        self._statistics = None
 
         self._users = {}
         self._items = {}
@@ -46,69 +143,675 @@ class WeightedSimilarityRecommender(Recommender):
     def load(self, users, items):
         """Turn list of Users and Items into dicts of Users and Items with
         their ids as keys and create preference and inverted preference dicts.
+
+        users can also be a RatingTable, which is loaded with load_table.
         """
+        if isinstance(users, RatingTable):
+            self.load_table(users, items)
+            return
+
         self._users = {user.get_id() : user for user in users}
         self._items = {item.get_id() : item for item in items}
 
-        self._preferences = self._user_prefs(self._users)
-        self._inverted_preferences = self._inv_prefs(self._users)
+        self.clear_cache()
+        self._release_similarity()
+
+        if self._storage == "sparse":
+            self._preferences = RatingMatrix.from_dict(self._user_prefs(self._users))
+            self._inverted_preferences = self._preferences.transpose()
+        else:
+            self._preferences = self._user_prefs(self._users)
+            self._inverted_preferences = self._inv_prefs(self._preferences)
+
+        self._load_similarities()
+
+    def load_table(self, table, items, users=None):
+        """Loads ratings from the columns of a RatingTable without creating
+        per-rating objects. users is an optional list of Users giving the
+        values returned by similar_users, which default to the user ids.
+        """
+        users = {user.get_id() : user for user in users or []}
+        self._users = {user_id : users[user_id] if user_id in users else User(user_id, user_id)
+                       for user_id in table.user_ids}
+        self._items = {item.get_id() : item for item in items}
+
+        self.clear_cache()
+        self._release_similarity()
+
+        if self._storage == "sparse":
+            self._preferences = RatingMatrix.from_table(table)
+            self._inverted_preferences = self._preferences.transpose()
+        else:
+            self._preferences = table.to_dict()
+            self._inverted_preferences = self._inv_prefs(self._preferences)
+
+        self._load_similarities()
+
+    def _load_similarities(self):
+        self._prepare_similarity()
+        self._planner.reset()
+        self._planner.popularity(self._inverted_preferences)
+
+        if self._ann is not None:
+            self._ann.build(self._preferences, self._inverted_preferences)
 
         if self._memorize:
-            self._user_similarities = self._similarity.score_matrix(self._preferences)
-            self._item_similarities = self._similarity.score_matrix(self._inverted_preferences)
+            self._user_similarities = self._compact(self._score_matrix(self._preferences), self._preferences)
+            self._item_similarities = self._compact(self._score_matrix(self._inverted_preferences), self._inverted_preferences)
+
+        self._statistics = None
+        if self._memorize and self._incremental and hasattr(self._similarity, "score_stats"):
+            self._statistics = RatingStatistics(self._preferences, self._inverted_preferences)
+
+    def _prepare_similarity(self):
+        """Lets the similarity precompute what it needs from the ratings,
+        e.g. the means and norms of CosineSimilarity.
+        """
+        self._similarity.prepare(self._preferences)
+        self._similarity.prepare(self._inverted_preferences)
+
+    def _release_similarity(self):
+        # Before the preferences are replaced by a new load
+        self._similarity.release(self._preferences)
+        self._similarity.release(self._inverted_preferences)
+
+    def add_rating(self, user_id, item_id, rating):
+        """Adds a rating, or replaces it if the user already rated the item,
+        patching the preferences in place instead of reloading.
+
+        With sparse storage a new rating is inserted into the CSR arrays and
+        their CSC transpose, copying both, so it costs O(ratings) like
+        remove_rating; replacing a rating does not copy. With memorize,
+        the scores of every pair the change touched are recomputed, which
+        for a CosineSimilarity centred on columns are all pairs of the rows
+        rating the column.
+        """
+        self._change_rating(user_id, item_id, rating)
+
+    def update_rating(self, user_id, item_id, rating):
+        """Replaces an existing rating."""
+        if user_id not in self._preferences or item_id not in self._preferences[user_id]:
+            raise KeyError((user_id, item_id))
+
+        self._change_rating(user_id, item_id, rating)
+
+    def remove_rating(self, user_id, item_id):
+        """Removes an existing rating, in O(ratings) with sparse storage."""
+        if user_id not in self._preferences or item_id not in self._preferences[user_id]:
+            raise KeyError((user_id, item_id))
+
+        self._change_rating(user_id, item_id, None)
+
+    def _change_rating(self, user_id, item_id, rating):
+        old_rating = self._preferences[user_id].get(item_id) if user_id in self._preferences else None
+
+        # Unknown users and items get placeholder models valued by their ids
+        if user_id not in self._users:
+            self._users[user_id] = User(user_id, user_id)
+        if item_id not in self._items:
+            self._items[item_id] = Item(item_id, item_id)
+
+        if isinstance(self._preferences, RatingMatrix):
+            if rating is None:
+                self._preferences.remove_value(user_id, item_id)
+            else:
+                self._preferences.set_value(user_id, item_id, rating)
+        else:
+            if user_id not in self._preferences:
+                self._preferences[user_id] = {}
+
+            if rating is None:
+                del self._preferences[user_id][item_id]
+                del self._inverted_preferences[item_id][user_id]
+            else:
+                self._preferences[user_id][item_id] = rating
+                self._inverted_preferences[item_id][user_id] = rating
+
+        # Cached scores are stale from here on
+        self.clear_cache()
+
+        user_rows = self._similarity.update_prepared(self._preferences, user_id, item_id, old_rating, rating)
+        item_rows = self._similarity.update_prepared(self._inverted_preferences, item_id, user_id, old_rating, rating)
+
+        if self._memorize:
+            for similarities, statistics, matrix, row_id, column, rows in (
+                    (self._user_similarities, self._statistics and self._statistics.users, self._preferences,
+                     user_id, self._inverted_preferences[item_id], user_rows),
+                    (self._item_similarities, self._statistics and self._statistics.items, self._inverted_preferences,
+                     item_id, self._preferences[user_id], item_rows)):
+                if statistics is not None:
+                    others = statistics.update(row_id, column, old_rating, rating)
+                    pairs = {row_id: {other_id: statistics.score(self._similarity, row_id, other_id) for other_id in others}}
+                else:
+                    pairs = self._changed_pairs(matrix, row_id, column, rows)
+
+                self._update_similarities(similarities, matrix, pairs, self._ann_index(matrix), self._memorized_threshold(matrix))
+
+        self._rating_changed(user_id, item_id, item_rows)
+
+    def _changed_pairs(self, matrix, row_id, column, rows):
+        """Returns the new scores of the pairs changed by a rating of row_id
+        in column, as {row_id: {other_id: score}}: the pairs of row_id with
+        the other rows of the column, and every pair of the rows in rows,
+        whose prepared state changed with the rating.
+        """
+        pairs = {row_id: self._pair_scores(matrix, row_id, [other_id for other_id in column if other_id != row_id])}
+
+        for changed_id in rows:
+            # Rows co-rating nothing with changed_id before or after score 0
+            other_ids = (self._co_rated(matrix, changed_id) | set(column) | {row_id}) - {changed_id}
+            pairs[changed_id] = self._pair_scores(matrix, changed_id, list(other_ids))
+
+        return pairs
+
+    def _pair_scores(self, matrix, row_id, other_ids):
+        if not other_ids:
+            return {}
+
+        return dict(zip(other_ids, self._similarity.score_others(matrix, row_id, other_ids)))
+
+    def _co_rated(self, matrix, row_id):
+        """Returns the set of rows sharing a column with row_id."""
+        if isinstance(matrix, RatingMatrix):
+            cols, _ = matrix.row(matrix.row_index(row_id))
+            _, rows, _ = matrix.transpose().gather(cols)
+            row_ids = matrix.get_row_ids()
+            return {row_ids[row] for row in np.unique(rows).tolist()}
+
+        columns = self._columns(matrix)
+        return {other_id for col_id in matrix[row_id] for other_id in columns[col_id]}
+
+    def _memorized_threshold(self, matrix):
+        # The threshold only applies to the sparse engine and the ANN search
+        return self._threshold if isinstance(matrix, RatingMatrix) or self._ann is not None else None
+
+    def _update_similarities(self, similarities, matrix, pairs, ann=None, threshold=None):
+        """Sets the scores of pairs, a dict of row_id mapping to {other_id:
+        score}, on both sides in the memorized similarities of matrix.
+
+        A bounded neighbour list is patched in place unless a new score may
+        drop a kept neighbour below one it does not keep. Such lists are
+        recomputed instead, from the ann candidates when given, so the lists
+        stay the same as after a fresh load.
+        """
+        if isinstance(similarities, NeighbourIndex):
+            limit = similarities.k
+        else:
+            limit = self._neighbours if ann is not None else None
+
+        changes = defaultdict(dict)
+        for row_id, scores in pairs.items():
+            for other_id, score in scores.items():
+                if threshold is not None and score <= threshold:
+                    score = 0.0
+                changes[row_id][other_id] = score
+                changes[other_id][row_id] = score
+
+        for row_id, scores in changes.items():
+            if self._set_similarities(similarities, row_id, scores, limit):
+                continue
+
+            if ann is not None:
+                neighbours = self._ann_similar(matrix, ann, row_id, limit)
+            else:
+                neighbours = self._exact_similar(matrix, row_id, limit)
+            neighbours = [(score, other_id) for score, other_id in neighbours if threshold is None or score > threshold]
+
+            if isinstance(similarities, NeighbourIndex):
+                similarities.set_row(row_id, neighbours)
+            else:
+                similarities[row_id] = {other_id: score for score, other_id in neighbours}
+
+    def _set_similarities(self, similarities, row_id, scores, limit):
+        """Sets the scores of the other ids in scores in the neighbours of
+        row_id, or returns False when the list must be recomputed.
+        """
+        if limit is None and not isinstance(similarities, NeighbourIndex):
+            similarities.setdefault(row_id, {}).update(scores)
+            return True
+
+        neighbours = dict(similarities.get(row_id) or {})
+        if limit is not None and len(neighbours) >= limit:
+            # Rows left out of a full list score at most its lowest score
+            lowest = min(neighbours.values())
+            if any(score < lowest for other_id, score in scores.items() if other_id in neighbours):
+                return False
+            if not any(other_id in neighbours or score > lowest for other_id, score in scores.items()):
+                return True
+
+        neighbours.update(scores)
+        best = top_n(((score, other_id) for other_id, score in neighbours.items()), limit)
+
+        if isinstance(similarities, NeighbourIndex):
+            similarities.set_row(row_id, best)
+        else:
+            similarities[row_id] = {other_id: score for score, other_id in best}
+
+        return True
+
+    def _rating_changed(self, user_id, item_id, item_rows):
+        """Drops what depends on the ratings of user_id and item_id. item_rows
+        are the items whose prepared similarity state changed.
+        """
+        self._planner.reset()
+
+        if self._ann is not None:
+            self._ann.update(user_id, self._preferences[user_id], item_id, self._inverted_preferences[item_id])
+
+    def _score_matrix(self, matrix):
+        ann = self._ann_index(matrix)
+        if ann is not None:
+            return self._ann_score_matrix(matrix, ann)
+
+        if isinstance(matrix, RatingMatrix):
+            return self._similarity.score_matrix(matrix,
+                                                 k=self._neighbours,
+                                                 threshold=self._threshold,
+                                                 workers=self._workers)
+
+        return self._similarity.score_matrix(matrix, inverted=self._columns(matrix))
+
+    def _ann_score_matrix(self, matrix, ann):
+        """Memorizes the scores of every row with its ANN candidates only, so
+        storage grows with the number of candidates instead of quadratically.
+        """
+        similarities = defaultdict(dict)
+        for row_id in matrix:
+            similarities[row_id] = {row_id2: score for score, row_id2 in self._ann_similar(matrix, ann, row_id, self._neighbours)
+                                    if self._threshold is None or score > self._threshold}
+
+        if isinstance(matrix, RatingMatrix):
+            return NeighbourIndex.from_mapping(similarities, k=self._neighbours)
+
+        return similarities
+
+    def save_index(self, path):
+        """Saves the memorized user and item neighbour lists to path."""
+
+        if not self._memorize:
+            raise ValueError("Only memorized similarities can be saved.")
+
+        save_indexes(path, {"users": self._as_index(self._user_similarities, self._preferences),
+                            "items": self._as_index(self._item_similarities, self._inverted_preferences)})
+
+    def load_index(self, path, mmap=True):
+        """Loads neighbour lists saved by save_index instead of computing them
+        in load. Call it after load with memorize=False. With mmap the lists
+        are memory-mapped and shared between processes through the page cache.
+        """
+
+        indexes = load_indexes(path, mmap=mmap)
+
+        self._user_similarities = indexes["users"]
+        self._item_similarities = indexes["items"]
+        self._memorize = True
+
+    def _as_index(self, similarities, matrix):
+        if isinstance(similarities, NeighbourIndex):
+            return similarities
+
+        # Every row of matrix gets a list, empty when no pair scored
+        return NeighbourIndex.from_mapping({row_id: similarities.get(row_id, {}) for row_id in matrix},
+                                           k=self._neighbours)
+
+    def _compact(self, similarities, matrix):
+        """Stores memorized similarities with scores of type score_dtype."""
+        if self._score_dtype is None:
+            return similarities
+
+        return self._as_index(similarities, matrix).astype(self._score_dtype)
 
     def _user_prefs(self, users):
         return {user_id : user.get_preferences() for user_id, user in users.items()}
 
-    def _inv_prefs(self, users):
-        inv_pref = defaultdict(lambda: defaultdict(float))
-        for user_id, user in users.items():
-            for item_id, weight in user.get_preferences().items():
+    def _inv_prefs(self, preferences):
+        inv_pref = defaultdict(dict)
+        for user_id, prefs in preferences.items():
+            for item_id, weight in prefs.items():
                 inv_pref[item_id][user_id] = weight
 
         return inv_pref
 
-    def _similar(self, matrix, row_id):
+    def get_similarity(self):
+        return self._similarity
+
+    def get_preferences(self):
+        """Returns the ratings of each user, as a RatingMatrix with sparse
+        storage or else a dict of user_id mapping to {item_id: rating}.
+        """
+        return self._preferences
+
+    def get_item_preferences(self):
+        """Returns the ratings of each item, like get_preferences."""
+        return self._inverted_preferences
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    def cache_info(self):
+        """Returns the hit/miss counters of the neighbour list and pairwise
+        score caches, or None for a disabled cache.
+        """
+        return self._cache.info()
+
+    def _similar(self, matrix, row_id, n=None):
+        """Returns the n most similar rows to row_id as (score, row_id) tuples,
+        best first, leaving out rows scoring 0.
+        """
+        key = (matrix is self._preferences, row_id, n)
+        return self._cache.similar(key, lambda: self._compute_similar(matrix, row_id, n))
+
+    def _compute_similar(self, matrix, row_id, n):
+        ann = self._ann_index(matrix)
+        if ann is not None:
+            return self._ann_similar(matrix, ann, row_id, n)
+
+        return self._exact_similar(matrix, row_id, n)
+
+    def _exact_similar(self, matrix, row_id, n):
+        if isinstance(matrix, RatingMatrix):
+            if self._stats is not None:
+                self._stats.count("candidates_scored", len(matrix) - 1)
+            return self._similar_sparse(matrix, row_id, n)
+
+        # Only rows co-rating enough items with row_id can score non-zero
         pref1 = matrix[row_id]
-        scores = []
-        for row_id2, pref2 in matrix.items():
-            if row_id != row_id2:
-                 scores.append((self._similarity.score(pref1, pref2), row_id2))
+        candidates = self._similarity.candidates(row_id, pref1, self._columns(matrix))
+        if self._stats is not None:
+            self._stats.count("candidates_scored", len(candidates))
 
-        scores.sort(reverse=True)
-        return scores
+        if self._cache.pairs is not None:
+            return top_n(((self._cached_score(matrix, row_id, row_id2), row_id2) for row_id2 in candidates), n)
 
-    def similar_users(self, user_id, n=10):
-        if self._memorize:
-            scores = [(score, user_id) for user_id, score in self._user_similarities.items()]
-            scores.sort(reverse=True)
-        else:
-            scores = self._similar(self._preferences, user_id)
+        return top_n(((self._similarity.score_rows(matrix, row_id, row_id2), row_id2) for row_id2 in candidates), n)
+
+    def _columns(self, matrix):
+        """Returns the inverted index of the dict preferences matrix."""
+        return self._inverted_preferences if matrix is self._preferences else self._preferences
+
+    def _cached_score(self, matrix, row_id1, row_id2):
+        key = (matrix is self._preferences, frozenset((row_id1, row_id2)))
+        return self._cache.score(key, lambda: self._similarity.score_rows(matrix, row_id1, row_id2))
+
+    def _similar_sparse(self, matrix, row_id, n=None):
+        row = matrix.row_index(row_id)
+        row_ids = matrix.get_row_ids()
+
+        scores = self._similarity.score_many(row, matrix)
+        best = top_k(scores, n, exclude=row)
+
+        return [(score, row_ids[i]) for i, score in zip(best.tolist(), scores[best].tolist())]
+
+    def _ann_index(self, matrix):
+        if self._ann is None:
+            return None
+
+        return self._ann.users if matrix is self._preferences else self._ann.items
+
+    def _ann_similar(self, matrix, ann, row_id, n):
+        """Scores row_id against its ANN candidates only."""
+        candidates = ann.candidates(row_id)
+        if self._stats is not None:
+            self._stats.count("candidates_scored", len(candidates))
+
+        if isinstance(matrix, RatingMatrix):
+            rows = np.array([matrix.row_index(candidate) for candidate in candidates], dtype=np.int64)
+            scores = self._similarity.score_candidates(matrix.row_index(row_id), rows, matrix)
+            return top_n(zip(scores.tolist(), candidates), n)
+
+        return top_n(((self._similarity.score_rows(matrix, row_id, candidate), candidate) for candidate in candidates), n)
+
+    def ann_recall(self, n=10, sample=100, seed=None):
+        """Returns the recall@n of the ANN search against the exact scan for
+        sample random users and items, as {"users": recall, "items": recall}.
+        """
+        if self._ann is None:
+            raise ValueError("ann_recall needs the ann option.")
+
+        random = np.random.default_rng(seed)
+        report = {}
+        for kind, matrix, ann in (("users", self._preferences, self._ann.users),
+                                  ("items", self._inverted_preferences, self._ann.items)):
+            ids = list(matrix)
+            ids = [ids[i] for i in random.choice(len(ids), min(sample, len(ids)), replace=False).tolist()]
+
+            report[kind] = recall_at_k(lambda row_id, k: self._exact_similar(matrix, row_id, k),
+                                       lambda row_id, k: self._ann_similar(matrix, ann, row_id, k),
+                                       ids, n)
+
+        return report
+
+    def _degree(self, matrix, row_id):
+        """Returns the number of ratings of row_id, 0 for unknown rows."""
+        if isinstance(matrix, RatingMatrix):
+            if row_id not in matrix:
+                return 0
+            row = matrix.row_index(row_id)
+            return int(matrix.indptr[row + 1] - matrix.indptr[row])
+
+        return len(matrix.get(row_id, ()))
+
+    def _min_degree(self):
+        return max(self._similarity.get_min_shared(), 1)
+
+    def _record_path(self, method, row_id, path):
+        self._planner.record(method, row_id, path)
+        if self._stats is not None:
+            self._stats.count("path_" + path)
+
+    def query_paths(self):
+        """Returns the number of queries of each method that took each path,
+        as {method: {path: count}}.
+        """
+        return self._planner.query_paths()
+
+    def path_log(self):
+        """Returns the (method, id, path) of the last queries."""
+        return self._planner.path_log()
+
+    def _plan_recommendations(self, user_id):
+        """Returns the path answering the recommendations of user_id: "full",
+        or the cold_start path when the user has too few ratings to share
+        min_shared items with anyone.
+        """
+        return self._planner.plan(self._degree(self._preferences, user_id), self._min_degree())
+
+    def _cold_recommendations(self, user_id, path, n):
+        user_prefs = self._preferences[user_id] if user_id in self._preferences else {}
+
+        if path == "fold_in" and user_prefs:
+            ranked_items = self._fold_in(user_prefs, n)
+            if ranked_items:
+                self._record_path("recommendations", user_id, "fold_in")
+                return [(self._items[item_id].get_value(), item_id, score) for score, item_id in ranked_items]
+
+        self._record_path("recommendations", user_id, "popularity")
+        return [(self._items[item_id].get_value(), item_id, score)
+                for score, item_id in self._planner.popularity(self._inverted_preferences).top(n, exclude=user_prefs)]
+
+    def _fold_in(self, user_prefs, n):
+        """Scores items from the neighbourhoods of the items in user_prefs,
+        weighted by their ratings, like an item based recommendation.
+        """
+        weighted_scores = defaultdict(float)
+        total_weight = defaultdict(float)
+
+        for item_id, rating in user_prefs.items():
+            if self._memorize:
+                similarities = self._memorized(self._item_similarities, item_id, self._planner.FOLD_IN_NEIGHBOURS)
+            else:
+                similarities = self._similar(self._inverted_preferences, item_id, self._planner.FOLD_IN_NEIGHBOURS)
 
-        results = [(self._users[user_id].get_value(), user_id, score) for (score, user_id) in scores]
+            for score, item_id2 in similarities:
+                if item_id2 not in user_prefs:
+                    weighted_scores[item_id2] += rating * score
+                    total_weight[item_id2] += abs(score)
+
+        return self._rank(weighted_scores, total_weight, n)
+
+    def _planned_batch(self, user_ids, n, block_size, recommendations_block):
+        """Yields (user_id, recommendations) for every user in user_ids,
+        scoring the users on the full path block by block with
+        recommendations_block(user_ids, n, block_size) and answering the
+        cold users one by one.
+        """
+        for block in _blocks(user_ids, block_size):
+            warm = [user_id for user_id in block if self._plan_recommendations(user_id) == "full"]
+            results = dict(recommendations_block(warm, n, block_size)) if warm else {}
+
+            for user_id in block:
+                if user_id in results:
+                    self._record_path("recommendations", user_id, "full")
+                    yield user_id, results[user_id]
+                else:
+                    yield user_id, self.recommendations(user_id, n)
+
+    def _memorized(self, similarities, row_id, n):
+        if isinstance(similarities, NeighbourIndex):
+            return similarities.neighbours(row_id, n)
 
-        return results[:n]
+        return top_n(((score, row_id2) for row_id2, score in similarities[row_id].items()), n)
+
+    def similar_users(self, user_id, n=10):
+        with self._phase("similar"):
+            if self._memorize:
+                self._record_path("similar_users", user_id, "memorized")
+                scores = self._memorized(self._user_similarities, user_id, n)
+            elif self._degree(self._preferences, user_id) < self._min_degree():
+                self._record_path("similar_users", user_id, "skipped")
+                scores = []
+            else:
+                self._record_path("similar_users", user_id, "scan")
+                scores = self._similar(self._preferences, user_id, n)
+
+        return [(self._users[user_id2].get_value(), user_id2, score) for (score, user_id2) in scores]
 
     def similar_items(self, item_id, n=10):
-        if self._memorize:
-            scores = [(score, item_id) for item_id, score in self._item_similarities.items()]
-            scores.sort(reverse=True)
-        else:
-            scores = self._similar(self._inverted_preferences, item_id)
+        with self._phase("similar"):
+            if self._memorize:
+                self._record_path("similar_items", item_id, "memorized")
+                scores = self._memorized(self._item_similarities, item_id, n)
+            elif self._degree(self._inverted_preferences, item_id) < self._min_degree():
+                self._record_path("similar_items", item_id, "skipped")
+                scores = []
+            else:
+                self._record_path("similar_items", item_id, "scan")
+                scores = self._similar(self._inverted_preferences, item_id, n)
+
+        return [(self._items[item_id2].get_value(), item_id2, score) for (score, item_id2) in scores]
+
+    def similar_users_batch(self, user_ids, n=10, block_size=256):
+        """Yields (user_id, similar users) for every user in user_ids. With
+        sparse storage, blocks of block_size users are scored together.
+        """
+        if self._memorize or self._ann is not None or not isinstance(self._preferences, RatingMatrix):
+            yield from super().similar_users_batch(user_ids, n)
+            return
 
-        results = [(self._items[item_id].get_value(), item_id, score) for (score, item_id) in scores]
+        for user_id, scores in self._similar_batch(self._preferences, user_ids, n, block_size):
+            yield user_id, [(self._users[user_id2].get_value(), user_id2, score) for (score, user_id2) in scores]
 
-        return results[:n]
+    def similar_items_batch(self, item_ids, n=10, block_size=256):
+        """Yields (item_id, similar items) for every item in item_ids. With
+        sparse storage, blocks of block_size items are scored together.
+        """
+        if self._memorize or self._ann is not None or not isinstance(self._inverted_preferences, RatingMatrix):
+            yield from super().similar_items_batch(item_ids, n)
+            return
+
+        for item_id, scores in self._similar_batch(self._inverted_preferences, item_ids, n, block_size):
+            yield item_id, [(self._items[item_id2].get_value(), item_id2, score) for (score, item_id2) in scores]
+
+    def _similar_batch(self, matrix, row_ids, n, block_size):
+        all_row_ids = matrix.get_row_ids()
+
+        for block in _blocks(row_ids, block_size):
+            rows = np.array([matrix.row_index(row_id) for row_id in block], dtype=np.int64)
+            with self._phase("similar"):
+                similarities = self._similarity.score_block(rows, matrix)
+
+            for row_id, row, scores in zip(block, rows.tolist(), similarities):
+                with self._phase("rank"):
+                    best = top_k(scores, n, exclude=row)
+                    neighbours = [(score, all_row_ids[i]) for i, score in zip(best.tolist(), scores[best].tolist())]
+                yield row_id, neighbours
+
+    def _ranked_items(self, weighted_scores, total_weight, n):
+        """Returns the n best items of arrays of weighted scores and total
+        weights indexed like the preference columns, as recommendations.
+        Items with no weight, e.g. already rated ones, are left out.
+        """
+
+        scored = total_weight > 0
+        predicted = np.full(len(total_weight), -np.inf)
+        predicted[scored] = weighted_scores[scored] / total_weight[scored]
+
+        best = top_k(predicted, n, threshold=-np.inf)
+        item_ids = self._preferences.get_col_ids()
+
+        return [(self._items[item_ids[i]].get_value(), item_ids[i], score)
+                for i, score in zip(best.tolist(), predicted[best].tolist())]
+
+    def _rank(self, weighted_scores, total_weight, n):
+        """Returns the n best (weighted score / total weight, item_id) tuples."""
+
+        return heapq.nlargest(n, ((score / total_weight[item_id], item_id) for item_id, score in weighted_scores.items()))
 
     def recommendations(self, user_id):
         raise NotImplementedError
 
 
 class ItemBasedRecommender(WeightedSimilarityRecommender):
+    """Item based recommender.
+
+    With neighbourhood set, recommendations are scored from the top
+    neighbourhood similar items of each rated item instead of scanning every
+    item. The neighbourhoods are computed at load time for sparse storage and
+    lazily, once per item, for dict storage.
+    """
 
-    def __init__(self, **kwargs):
+    def __init__(self, neighbourhood=None, similarity=None, **kwargs):
         super().__init__(**kwargs)
-        self._similarity = PearsonSimilarity()
+        self._similarity = similarity or PearsonSimilarity()
+
+        self._neighbourhood = neighbourhood
+        self._item_neighbourhoods = {}
+
+    def _load_similarities(self):
+        super()._load_similarities()
+
+        self._item_neighbourhoods = {}
+        if self._neighbourhood is not None and isinstance(self._inverted_preferences, RatingMatrix):
+            self._item_neighbourhoods = self._compact(self._similarity.score_matrix(self._inverted_preferences,
+                                                                                    k=self._neighbourhood,
+                                                                                    workers=self._workers),
+                                                      self._inverted_preferences)
+
+    def _plan_recommendations(self, user_id):
+        # Item based scores only need one rated item, so only users without
+        # ratings are cold
+        return self._planner.plan(self._degree(self._preferences, user_id), 1)
+
+    def _rating_changed(self, user_id, item_id, item_rows):
+        super()._rating_changed(user_id, item_id, item_rows)
+
+        # The similarities of item_id with the other items rated by user_id
+        # changed, and every similarity of the items in item_rows
+        if isinstance(self._item_neighbourhoods, NeighbourIndex):
+            inverted = self._inverted_preferences
+            pairs = self._changed_pairs(inverted, item_id, self._preferences[user_id], item_rows)
+            self._update_similarities(self._item_neighbourhoods, inverted, pairs)
+        elif item_rows:
+            self._item_neighbourhoods = {}
+        else:
+            for item_id2 in [item_id] + list(self._preferences[user_id]):
+                self._item_neighbourhoods.pop(item_id2, None)
+
+    def _item_neighbourhood(self, item_id):
+        if item_id not in self._item_neighbourhoods:
+            self._item_neighbourhoods[item_id] = self._similar(self._inverted_preferences, item_id, self._neighbourhood)
+
+        return self._item_neighbourhoods[item_id]
 
     def recommendations(self, user_id, n=10):
         """Recommend items based on item similarities.
@@ -124,57 +827,183 @@ class ItemBasedRecommender(WeightedSimilarityRecommender):
         score of g = sum for all k(s * rating of k) / sum for all k(s)
         """
 
+        path = self._plan_recommendations(user_id)
+        if path != "full":
+            return self._cold_recommendations(user_id, path, n)
+        self._record_path("recommendations", user_id, "full")
+
+        if isinstance(self._item_neighbourhoods, NeighbourIndex):
+            return self._neighbourhood_recommendations(user_id, n)
+
         # sum for all k(s * rating of k)
         weighted_scores = defaultdict(int)
         # sum for all k(s)
         total_weight = defaultdict(int)
 
-        for item_id, rating in self._preferences[user_id].items():
-            # Get similarity scores for item_id to all other items
-            similarities = self._similar(self._inverted_preferences, item_id)
+        user_prefs = self._preferences[user_id]
+
+        # Get similarity scores for every rated item to all other items, or
+        # to its neighbourhood
+        with self._phase("similar"):
+            if self._neighbourhood is not None:
+                rated_similarities = [(rating, self._item_neighbourhood(item_id)) for item_id, rating in user_prefs.items()]
+            else:
+                rated_similarities = [(rating, self._similar(self._inverted_preferences, item_id))
+                                      for item_id, rating in user_prefs.items()]
+
+        # Add to the score of the other items
+        with self._phase("accumulate"):
+            for rating, similarities in rated_similarities:
+                for score, item_id2 in similarities:
+                    if item_id2 in user_prefs:
+                        continue
+                    weighted_scores[item_id2] += rating * score
+                    total_weight[item_id2] +=  abs(score)
+
+        # Top n items by recommendation score
+        with self._phase("rank"):
+            ranked_items = self._rank(weighted_scores, total_weight, n)
+
+        return [(self._items[item_id].get_value(), item_id, score) for score, item_id in ranked_items]
+
+    def _neighbourhood_recommendations(self, user_id, n):
+        """Scores items with one sparse accumulation of the neighbourhoods of
+        every item rated by the user, weighted by the user's ratings.
+        """
 
-            # Add to the score of the other items
-            for score, item_id2 in similarities:
-                if item_id2 in self._preferences[user_id] or score == 0:
-                    continue
-                weighted_scores[item_id2] += rating * score
-                total_weight[item_id2] +=  abs(score)
+        neighbourhoods = self._item_neighbourhoods
+        rated, ratings = self._preferences.row(self._preferences.row_index(user_id))
+
+        with self._phase("accumulate"):
+            neighbours = neighbourhoods.indices[rated]
+            scores = neighbourhoods.score_values(rated)
+            valid = neighbours >= 0
+
+            size = len(neighbourhoods)
+            weighted_scores = np.bincount(neighbours[valid], weights=(ratings[:, None] * scores)[valid], minlength=size)
+            total_weight = np.bincount(neighbours[valid], weights=np.abs(scores)[valid], minlength=size)
+
+            # Leave out the items already rated by the user
+            total_weight[rated] = 0
+
+        with self._phase("rank"):
+            return self._ranked_items(weighted_scores, total_weight, n)
+
+    def recommendations_batch(self, user_ids, n=10, block_size=256):
+        """Yields (user_id, recommendations) for every user in user_ids.
 
-        # List of items with recommendation scores
-        ranked_items = [(score / total_weight[item_id], item_id) for item_id, score in weighted_scores.items()]
-        ranked_items.sort(reverse=True)
+        With sparse storage and no neighbourhood, blocks of block_size users
+        are scored together: the similarities of the items they rated, a
+        block of items at a time, are combined with their ratings in two
+        dense matrix products.
+        """
+        if (self._neighbourhood is not None or self._memorize or self._ann is not None
+                or not isinstance(self._preferences, RatingMatrix)):
+            yield from super().recommendations_batch(user_ids, n)
+            return
+
+        yield from self._planned_batch(user_ids, n, block_size, self._recommendations_block)
+
+    def _recommendations_block(self, user_ids, n, block_size):
+        prefs = self._preferences
+        inverted = self._inverted_preferences
+
+        for block in _blocks(user_ids, block_size):
+            rows = np.array([prefs.row_index(user_id) for user_id in block], dtype=np.int64)
+            block_prefs = prefs.take(rows)
+            block_ones = np.ones(block_prefs.nnz)
+
+            weighted_scores = np.zeros((len(rows), prefs.shape[1]))
+            total_weight = np.zeros((len(rows), prefs.shape[1]))
 
-        ranked_with_values = [(self._items[item_id].get_value(), item_id, score) for score, item_id in ranked_items]
+            rated = np.unique(block_prefs.indices)
+            for start in range(0, len(rated), block_size):
+                items = rated[start:start + block_size]
+                with self._phase("similar"):
+                    similarities = self._similarity.score_block(items, inverted)
+                    similarities[np.arange(len(items)), items] = 0
 
-        results = ranked_with_values[:n]
+                with self._phase("accumulate"):
+                    weighted_scores += block_prefs.to_dense(items) @ similarities
+                    total_weight += block_prefs.to_dense(items, data=block_ones) @ np.abs(similarities)
 
-        return results
+            # Leave out the items already rated by each user
+            total_weight[block_prefs.row_of_entries(), block_prefs.indices] = 0
+
+            for user_id, weights, totals in zip(block, weighted_scores, total_weight):
+                with self._phase("rank"):
+                    ranked_items = self._ranked_items(weights, totals, n)
+                yield user_id, ranked_items
 
 
 class UserBasedRecommender(WeightedSimilarityRecommender):
 
-    def __init__(self, **kwargs):
+    def __init__(self, similarity=None, **kwargs):
         super().__init__(**kwargs)
-        self._similarity = PearsonSimilarity()
+        self._similarity = similarity or PearsonSimilarity()
 
     def recommendations(self, user_id, n=10):
         """Recommend items based on user similarities."""
 
+        path = self._plan_recommendations(user_id)
+        if path != "full":
+            return self._cold_recommendations(user_id, path, n)
+        self._record_path("recommendations", user_id, "full")
+
         weighted_scores = defaultdict(int)
         total_weight = defaultdict(int)
 
-        for score, user_id2 in self._similar(self._preferences, user_id):
-            for item_id, rating in self._preferences[user_id2].items():
-                if item_id in self._preferences[user_id] or score == 0:
-                    continue
-                weighted_scores[item_id] += rating * score
-                total_weight[item_id] +=  abs(score)
+        user_prefs = self._preferences[user_id]
+
+        with self._phase("similar"):
+            similarities = self._similar(self._preferences, user_id)
 
-        ranked_items = [(score / total_weight[item_id], item_id) for item_id, score in weighted_scores.items()]
-        ranked_items.sort(reverse=True)
+        with self._phase("accumulate"):
+            for score, user_id2 in similarities:
+                for item_id, rating in self._preferences[user_id2].items():
+                    if item_id in user_prefs:
+                        continue
+                    weighted_scores[item_id] += rating * score
+                    total_weight[item_id] +=  abs(score)
 
-        ranked_with_values = [(self._items[item_id].get_value(), item_id, score) for score, item_id in ranked_items]
+        with self._phase("rank"):
+            ranked_items = self._rank(weighted_scores, total_weight, n)
 
-        results = ranked_with_values[:n]
+        return [(self._items[item_id].get_value(), item_id, score) for score, item_id in ranked_items]
 
-        return results
+    def recommendations_batch(self, user_ids, n=10, block_size=256):
+        """Yields (user_id, recommendations) for every user in user_ids.
+
+        With sparse storage, blocks of block_size users are scored together:
+        their similarities to every user are combined with the ratings in two
+        sparse by dense matrix products.
+        """
+        if self._memorize or self._ann is not None or not isinstance(self._preferences, RatingMatrix):
+            yield from super().recommendations_batch(user_ids, n)
+            return
+
+        yield from self._planned_batch(user_ids, n, block_size, self._recommendations_block)
+
+    def _recommendations_block(self, user_ids, n, block_size):
+        prefs = self._preferences
+        inverted = self._inverted_preferences
+        ones = np.ones(inverted.nnz)
+
+        for block in _blocks(user_ids, block_size):
+            rows = np.array([prefs.row_index(user_id) for user_id in block], dtype=np.int64)
+            with self._phase("similar"):
+                similarities = self._similarity.score_block(rows, prefs)
+                similarities[np.arange(len(rows)), rows] = 0
+
+            with self._phase("accumulate"):
+                weighted_scores = inverted.dot(similarities.T).T
+                total_weight = inverted.dot(np.abs(similarities).T, data=ones).T
+
+                # Leave out the items already rated by each user
+                lengths, rated, _ = prefs.gather(rows)
+                total_weight[np.repeat(np.arange(len(rows)), lengths), rated] = 0
+
+            for user_id, weights, totals in zip(block, weighted_scores, total_weight):
+                with self._phase("rank"):
+                    ranked_items = self._ranked_items(weights, totals, n)
+                yield user_id, ranked_items
@@ -0,0 +1,108 @@
+import asyncio
+
+from recommender.serving import SharedRecommenderPool
+
+
+def _run_batch(target, method, ids, n):
+    """Answers a batch of ids with the batch methods of a recommender or the
+    workers of a SharedRecommenderPool. Returns a list of (id, results).
+    """
+    if isinstance(target, SharedRecommenderPool):
+        return list(target.map(method, ids, n))
+
+    return list(getattr(target, method + "_batch")(ids, n))
+
+
+def _run_one(target, method, id_, n):
+    return _run_batch(target, method, [id_], n)[0][1]
+
+
+class RecommendationService(object):
+    """Asyncio front end for a loaded recommender or SharedRecommenderPool.
+
+    The CPU heavy calls run in executor (the event loop's default executor
+    when None) so the event loop stays responsive. Concurrent identical
+    requests share one computation, and different requests for the same
+    method and n arriving within batch_window seconds are answered together
+    with one batch call of up to max_batch_size ids.
+    """
+
+    def __init__(self, recommender, executor=None, batch_window=0.005, max_batch_size=256):
+        self._recommender = recommender
+        self._executor = executor
+        self._batch_window = batch_window
+        self._max_batch_size = max_batch_size
+
+        # (method, id, n) mapping to the future shared by identical requests
+        self._in_flight = {}
+        # (method, n) mapping to the ids waiting for the next batch
+        self._pending = {}
+        self._timers = {}
+
+    async def recommendations(self, user_id, n=10):
+        return await self._request("recommendations", user_id, n)
+
+    async def similar_users(self, user_id, n=10):
+        return await self._request("similar_users", user_id, n)
+
+    async def similar_items(self, item_id, n=10):
+        return await self._request("similar_items", item_id, n)
+
+    async def _request(self, method, id_, n):
+        key = (method, id_, n)
+
+        future = self._in_flight.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._in_flight[key] = future
+
+            group = (method, n)
+            pending = self._pending.setdefault(group, [])
+            pending.append(id_)
+
+            if len(pending) >= self._max_batch_size:
+                self._flush(group)
+            elif group not in self._timers:
+                self._timers[group] = loop.call_later(self._batch_window, self._flush, group)
+
+        # A cancelled caller must not cancel the computation shared with others
+        return await asyncio.shield(future)
+
+    def _flush(self, group):
+        timer = self._timers.pop(group, None)
+        if timer is not None:
+            timer.cancel()
+
+        ids = self._pending.pop(group, [])
+        if ids:
+            asyncio.ensure_future(self._answer(group, ids))
+
+    async def _answer(self, group, ids):
+        method, n = group
+        loop = asyncio.get_running_loop()
+
+        try:
+            results = dict(await loop.run_in_executor(self._executor, _run_batch, self._recommender, method, ids, n))
+            for id_ in ids:
+                self._resolve((method, id_, n), result=results[id_])
+        except Exception:
+            # One failing id, e.g. an unknown user, fails the whole batch, so
+            # answer the ids one by one to only fail the faulty requests
+            for id_ in ids:
+                try:
+                    result = await loop.run_in_executor(self._executor, _run_one, self._recommender, method, id_, n)
+                except Exception as e:
+                    self._resolve((method, id_, n), exception=e)
+                else:
+                    self._resolve((method, id_, n), result=result)
+
+    def _resolve(self, key, result=None, exception=None):
+        future = self._in_flight.pop(key, None)
+        if future is None or future.done():
+            return
+
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
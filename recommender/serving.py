@@ -0,0 +1,125 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import io
+import mmap
+import os
+import pickle
+
+import numpy as np
+
+from recommender.recommend import _blocks
+
+
+def _attach(name, shape, dtype):
+    """Returns an array viewing the shared memory segment called name."""
+
+    # Workers share the resource tracker of the pool's process, so attaching
+    # does not hand the segment's lifetime over to the worker
+    segment = shared_memory.SharedMemory(name=name)
+    _worker_state.setdefault("segments", []).append(segment)
+
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+
+
+def _open_memmap(filename, dtype, offset, shape):
+    return np.memmap(filename, dtype=np.dtype(dtype), mode="r", offset=offset, shape=shape)
+
+
+class _SharedPickler(pickle.Pickler):
+    """Pickler that moves NumPy arrays of at least min_bytes into shared
+    memory segments and pickles a reference to the segment instead. Arrays
+    memory-mapped from a file are pickled as a reference to the file.
+    """
+
+    def __init__(self, file, segments, min_bytes):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._segments = segments
+        self._min_bytes = min_bytes
+
+    def reducer_override(self, obj):
+        if not isinstance(obj, np.ndarray) or obj.dtype.hasobject or obj.nbytes < self._min_bytes:
+            return NotImplemented
+
+        if isinstance(obj, np.memmap) and isinstance(obj.base, mmap.mmap) and obj.filename:
+            return _open_memmap, (obj.filename, obj.dtype.str, obj.offset, obj.shape)
+
+        segment = shared_memory.SharedMemory(create=True, size=obj.nbytes)
+        np.ndarray(obj.shape, dtype=obj.dtype, buffer=segment.buf)[...] = obj
+        self._segments.append(segment)
+
+        return _attach, (segment.name, obj.shape, obj.dtype.str)
+
+
+# State of a worker process of SharedRecommenderPool
+_worker_state = {}
+
+
+def _init_worker(payload):
+    _worker_state["recommender"] = pickle.loads(payload)
+
+
+def _run(method, ids, n):
+    batch = getattr(_worker_state["recommender"], method + "_batch")
+    return list(batch(ids, n))
+
+
+class SharedRecommenderPool(object):
+    """Serves a loaded recommender from a pool of worker processes.
+
+    The recommender's NumPy arrays (rating matrices, neighbour indexes) are
+    copied once into shared memory and every worker maps the same segments,
+    so the state is not duplicated per worker. Other attributes, such as the
+    User and Item dicts, are copied into each worker, as are the preference
+    dicts of dict storage.
+
+    Queries are split into chunks of chunk_size ids and fanned out to the
+    workers, which answer each chunk with the recommender's batch methods.
+    """
+
+    def __init__(self, recommender, workers=None, chunk_size=256, min_bytes=1 << 16):
+        self._chunk_size = chunk_size
+        self._segments = []
+
+        try:
+            payload = io.BytesIO()
+            _SharedPickler(payload, self._segments, min_bytes).dump(recommender)
+            self._executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                                 initializer=_init_worker,
+                                                 initargs=(payload.getvalue(),))
+        except Exception:
+            self._release()
+            raise
+
+    def map(self, method, ids, n=10):
+        """Yields (id, results) for every id in ids, in order, where method is
+        "recommendations", "similar_users" or "similar_items".
+        """
+        futures = [self._executor.submit(_run, method, chunk, n) for chunk in _blocks(ids, self._chunk_size)]
+        for future in futures:
+            yield from future.result()
+
+    def recommendations(self, user_ids, n=10):
+        return self.map("recommendations", user_ids, n)
+
+    def similar_users(self, user_ids, n=10):
+        return self.map("similar_users", user_ids, n)
+
+    def similar_items(self, item_ids, n=10):
+        return self.map("similar_items", item_ids, n)
+
+    def close(self):
+        """Stops the workers and frees the shared memory segments."""
+        self._executor.shutdown()
+        self._release()
+
+    def _release(self):
+        for segment in self._segments:
+            segment.close()
+            segment.unlink()
+        self._segments = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
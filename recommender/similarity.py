@@ -1,59 +1,337 @@
 from math import sqrt
-from collections import defaultdict
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from recommender.instrumentation import picklable_state
+from recommender.matrix import RatingMatrix
+from recommender.neighbours import build_neighbour_index
+from recommender.normalization import MeanCentering
 
 class Similarity(object):
 
+    # Stats object of recommender.instrumentation, set by Recommender.instrument
+    _stats = None
+
     def __init__(self, min_shared=5):
         self._min_shared = min_shared
         pass
 
+    def get_min_shared(self):
+        return self._min_shared
+
+    def __getstate__(self):
+        return picklable_state(self)
+
     def score(self, users, items, prefs=None):
         raise NotImplementedError
 
+    def score_rows(self, matrix, row_id1, row_id2):
+        """Returns the score of the rows row_id1 and row_id2 of matrix, a dict
+        of dicts, using what prepare computed from matrix.
+        """
+        return self.score(matrix[row_id1], matrix[row_id2])
+
+    def score_others(self, matrix, row_id, other_ids):
+        """Returns the list of scores of the row row_id of matrix, a dict of
+        dicts or RatingMatrix, with each row in other_ids.
+        """
+        if isinstance(matrix, RatingMatrix):
+            rows = np.array([matrix.row_index(other_id) for other_id in other_ids], dtype=np.int64)
+            return self.score_candidates(matrix.row_index(row_id), rows, matrix).tolist()
+
+        return [self.score_rows(matrix, row_id, other_id) for other_id in other_ids]
+
+    def prepare(self, matrix):
+        """Precomputes what the scores of the rows of matrix need, once per
+        load. Similarities scoring from shared_stats need nothing.
+        """
+        pass
+
+    def release(self, matrix):
+        """Forgets what prepare computed from matrix."""
+        pass
+
+    def update_prepared(self, matrix, row_id, col_id, old_value, new_value):
+        """Brings what prepare computed from matrix up to date with a change
+        of the rating of row_id for col_id, from old_value to new_value
+        (None when absent). Returns the ids of the rows whose prepared state
+        changed, so that all their scores may have, none by default.
+        """
+        return []
+
+    def candidates(self, row_id, pref, inverted):
+        """Returns the rows co-rating at least min_shared columns with pref,
+        the row row_id, leaving out row_id.
+
+        inverted is a dict of col_id mapping to {row_id: value}. Only the rows
+        of the columns rated in pref are visited and their overlaps are
+        counted on the way, so rows that would score 0 are never scored.
+        """
+        overlaps = Counter()
+        for col_id in pref:
+            column = inverted.get(col_id)
+            if column:
+                overlaps.update(column.keys())
+        overlaps.pop(row_id, None)
+
+        min_shared = max(self._min_shared, 1)
+        return [other_id for other_id, count in overlaps.items() if count >= min_shared]
+
     def shared_items(self, pref1, pref2,):
         return {item : 0 for item in pref1.keys() if item in pref2.keys()}
 
-    def score_matrix(self, matrix):
-        similarities = defaultdict(lambda: defaultdict(float))
-        count = 0
+    def score_many(self, row, matrix):
+        """Returns an array with the score of the row at index row against
+        every row of matrix, a RatingMatrix.
+
+        Subclasses that can score from shared_stats override this with a
+        vectorized version; the default falls back to pairwise score calls.
+        """
+        row_ids = matrix.get_row_ids()
+        pref1 = matrix[row_ids[row]]
+
+        return np.array([self.score(pref1, matrix[row_id]) for row_id in row_ids], dtype=np.float64)
+
+    def score_block(self, rows, matrix):
+        """Returns a (len(rows), matrix rows) array of the scores of the rows
+        at the indices rows against every row of matrix.
+        """
+        return np.vstack([self.score_many(row, matrix) for row in rows]) if len(rows) else np.zeros((0, matrix.shape[0]))
+
+    def shared_stats(self, row, matrix):
+        """Returns the statistics over the co-rated items of the row at index
+        row and every row of matrix as a tuple of arrays:
+        (count, sum1, sum2, sum_of_squared1, sum_of_squared2, sum_of_products)
+
+        They are accumulated with one pass over the columns of the row in the
+        transposed matrix, i.e. sparse matrix-vector products.
+        """
+        cols, values = matrix.row(row)
+        lengths, other_rows, values2 = matrix.transpose().gather(cols)
+        values1 = np.repeat(values, lengths)
+
+        size = matrix.shape[0]
+        count = np.bincount(other_rows, minlength=size)
+        sum1 = np.bincount(other_rows, weights=values1, minlength=size)
+        sum2 = np.bincount(other_rows, weights=values2, minlength=size)
+        sum_of_squared1 = np.bincount(other_rows, weights=values1 * values1, minlength=size)
+        sum_of_squared2 = np.bincount(other_rows, weights=values2 * values2, minlength=size)
+        sum_of_products = np.bincount(other_rows, weights=values1 * values2, minlength=size)
+
+        if self._stats is not None:
+            self._stats.record_scores(size, int(count.sum()))
+
+        return count, sum1, sum2, sum_of_squared1, sum_of_squared2, sum_of_products
+
+    def score_candidates(self, row, candidates, matrix):
+        """Returns an array with the score of the row at index row against the
+        rows at the indices candidates of matrix, a RatingMatrix.
+        """
+        if hasattr(self, "score_stats"):
+            return self.score_stats(*self.candidate_stats(row, candidates, matrix))
+
+        row_ids = matrix.get_row_ids()
+        pref1 = matrix[row_ids[row]]
+
+        return np.array([self.score(pref1, matrix[row_ids[candidate]]) for candidate in candidates], dtype=np.float64)
+
+    def candidate_stats(self, row, candidates, matrix):
+        """Returns the shared_stats of the row at index row and the rows at
+        the indices candidates only, accumulated over the candidates' entries.
+        """
+        cols, values = matrix.row(row)
+        rated = np.zeros(matrix.shape[1], dtype=bool)
+        rated[cols] = True
+        lookup = np.zeros(matrix.shape[1])
+        lookup[cols] = values
+
+        lengths, other_cols, values2 = matrix.gather(candidates)
+        owners = np.repeat(np.arange(len(candidates)), lengths)
+
+        shared = rated[other_cols]
+        owners = owners[shared]
+        values1 = lookup[other_cols[shared]]
+        values2 = values2[shared]
+
+        size = len(candidates)
+        count = np.bincount(owners, minlength=size)
+        sum1 = np.bincount(owners, weights=values1, minlength=size)
+        sum2 = np.bincount(owners, weights=values2, minlength=size)
+        sum_of_squared1 = np.bincount(owners, weights=values1 * values1, minlength=size)
+        sum_of_squared2 = np.bincount(owners, weights=values2 * values2, minlength=size)
+        sum_of_products = np.bincount(owners, weights=values1 * values2, minlength=size)
+
+        if self._stats is not None:
+            self._stats.record_scores(size, int(count.sum()))
+
+        return count, sum1, sum2, sum_of_squared1, sum_of_squared2, sum_of_products
+
+    def score_matrix(self, matrix, k=None, threshold=None, workers=1, block_size=256, inverted=None):
+        """Scores every pair of rows in matrix.
+
+        For a RatingMatrix this runs the blocked all-pairs engine and returns
+        a NeighbourIndex keeping, for each row, its top k neighbours scoring
+        above threshold (non-zero when threshold is None). The rows are
+        scored in tiles of block_size rows over a pool of workers processes.
+
+        For dict preferences it returns a dict of dicts with the score of
+        every pair found by candidates in inverted, the columns of matrix
+        (built when None). The other pairs score 0, the dicts' default.
+
+        A matrix that was not prepared is prepared on first use.
+        """
+        if isinstance(matrix, RatingMatrix):
+            return build_neighbour_index(self, matrix, k=k, threshold=threshold, workers=workers, block_size=block_size)
+
+        if inverted is None:
+            inverted = defaultdict(dict)
+            for row_id, pref in matrix.items():
+                for col_id, value in pref.items():
+                    inverted[col_id][row_id] = value
+
+        similarities = defaultdict(dict)
         for row_id1, pref1 in matrix.items():
-            for row_id2, pref2 in matrix.items():
-                if row_id1 != row_id2 and (row_id2 not in similarities[row_id1] or row_id1 not in similarities[row_id2]):
-                    score = self.score(pref1, pref2)
+            for row_id2 in self.candidates(row_id1, pref1, inverted):
+                if row_id2 not in similarities[row_id1]:
+                    score = self.score_rows(matrix, row_id1, row_id2)
                     similarities[row_id1][row_id2] = score
                     similarities[row_id2][row_id1] = score
 
         return similarities
 
 class CosineSimilarity(Similarity):
-
-    def __init__(self, *args, **kwargs):
+    """Adjusted cosine similarity.
+
+    prepare, called once per load, computes the column means (the row means
+    with centre="rows") and the norms of the centred rows of a matrix in a
+    MeanCentering, kept for that matrix object until release and updated by
+    update_prepared as ratings change. A score is then the centred dot
+    product of two rows divided by their norms: one sparse dot product per
+    pair (score_rows), or one sparse mat-vec to score a row against every
+    row. Pairs sharing fewer than min_shared columns score 0.
+    """
+
+    def __init__(self, *args, centre="columns", **kwargs):
         super().__init__(*args, **kwargs)
+        self._centre = centre
+
+        # (matrix, MeanCentering) of every prepared matrix by id(matrix). The
+        # matrix is kept so that its id cannot be reused while prepared.
+        self._prepared = {}
+
+    def __setstate__(self, state):
+        # Ids differ once unpickled
+        self.__dict__.update(state)
+        self._prepared = {id(matrix): (matrix, centring) for matrix, centring in self._prepared.values()}
+
+    def prepare(self, matrix):
+        """Computes the means and norms of matrix, a RatingMatrix or dict of
+        dicts, and returns its MeanCentering.
+        """
+        if isinstance(matrix, RatingMatrix):
+            centring = MeanCentering(matrix, self._centre)
+        else:
+            centring = MeanCentering(RatingMatrix.from_dict(matrix), self._centre)
+
+        self._prepared[id(matrix)] = (matrix, centring)
+
+        return centring
+
+    def release(self, matrix):
+        prepared, _ = self._prepared.get(id(matrix), (None, None))
+        if prepared is matrix:
+            del self._prepared[id(matrix)]
+
+    def update_prepared(self, matrix, row_id, col_id, old_value, new_value):
+        prepared, centring = self._prepared.get(id(matrix), (None, None))
+        if prepared is not matrix:
+            return []
+
+        if not isinstance(matrix, RatingMatrix):
+            # Dict rows were copied into a RatingMatrix by prepare
+            if new_value is None:
+                centring.matrix.remove_value(row_id, col_id)
+            else:
+                centring.matrix.set_value(row_id, col_id, new_value)
+
+        row_ids = centring.matrix.get_row_ids()
+        return [row_ids[row] for row in centring.update(row_id, col_id, old_value, new_value).tolist()]
+
+    def _centring(self, matrix):
+        prepared, centring = self._prepared.get(id(matrix), (None, None))
+        if prepared is matrix:
+            return centring
+
+        return self.prepare(matrix)
+
+    def _cosine(self, dots, count, norm, norms):
+        if self._stats is not None:
+            self._stats.record_scores(len(dots), int(count.sum()))
 
-    def score(self, pref1, pref2, matrix):
-        avg_val = {row_id: sum(matrix[row_id])/ len(matrix[row_id]) for row_id in range(1, len(matrix)) if len(matrix[row_id]) > 0}
+        denom = norm * norms
+        valid = (count >= self._min_shared) & (denom != 0)
 
-        numer =  0
-        diff_squared1 = 0
-        diff_squared2 = 0
+        return np.where(valid, dots / np.where(valid, denom, 1), 0.0)
 
-        for user, pref in prefs.item():
-            if item1 in  pref and item2 in pref:
-                item_diff1 = pref[item1] - avg_prefs[user][item1]
-                item_diff2 = pref[item2] - avg_prefs[user][item2]
+    def score_rows(self, matrix, row_id1, row_id2):
+        centring = self._centring(matrix)
+        row1 = centring.matrix.row_index(row_id1)
+        row2 = centring.matrix.row_index(row_id2)
+        dot, n = centring.dot_pair(row1, row2)
 
-                numer += abs(item_diff1 * item_diff2)
+        return float(self._cosine(np.array([dot]), np.array([n]), centring.row_norms[row1], centring.row_norms[row2])[0])
 
-                item_diff_squared1 += item_diff1 ** 2
-                item_diff_squared2 += item_diff2 ** 2
+    def score_others(self, matrix, row_id, other_ids):
+        # Dict rows are scored on the RatingMatrix copy made by prepare
+        centring = self._centring(matrix)
+        row = centring.matrix.row_index(row_id)
+        rows = np.array([centring.matrix.row_index(other_id) for other_id in other_ids], dtype=np.int64)
+        dots, count = centring.dot_candidates(row, rows)
 
-        denom = sqrt(item_diff_squared1 * item_diff_squared2)
+        return self._cosine(dots, count, centring.row_norms[row], centring.row_norms[rows]).tolist()
+
+    def score(self, pref1, pref2):
+        # Rows outside a matrix can only be centred on their own means, the
+        # column means need the whole matrix
+        if self._centre != "rows":
+            raise ValueError("CosineSimilarity with centre={!r} can only score rows of a matrix, "
+                             "with score_rows.".format(self._centre))
+
+        return self._unprepared_score(pref1, pref2)
+
+    def _unprepared_score(self, pref1, pref2):
+        shared_items = self.shared_items(pref1, pref2)
+        if self._stats is not None:
+            self._stats.record_scores(1, len(shared_items))
+
+        if len(shared_items) < self._min_shared:
+            return 0
+
+        mean1 = sum(pref1.values()) / len(pref1)
+        mean2 = sum(pref2.values()) / len(pref2)
+
+        numer = sum((pref1[item] - mean1) * (pref2[item] - mean2) for item in shared_items)
+        denom = (sqrt(sum((value - mean1) ** 2 for value in pref1.values())) *
+                 sqrt(sum((value - mean2) ** 2 for value in pref2.values())))
 
         if denom == 0:
             return 0
 
         return numer / denom
 
+    def score_many(self, row, matrix):
+        centring = self._centring(matrix)
+        dots, count = centring.dot_many(row)
+
+        return self._cosine(dots, count, centring.row_norms[row], centring.row_norms)
+
+    def score_candidates(self, row, candidates, matrix):
+        centring = self._centring(matrix)
+        dots, count = centring.dot_candidates(row, candidates)
+
+        return self._cosine(dots, count, centring.row_norms[row], centring.row_norms[candidates])
+
 class PearsonSimilarity(Similarity):
 
     def __init__(self, *args, **kwargs):
@@ -63,6 +341,8 @@ class PearsonSimilarity(Similarity):
         shared_items = self.shared_items(pref1, pref2)
 
         n = len(shared_items)
+        if self._stats is not None:
+            self._stats.record_scores(1, n)
         if n < self._min_shared:
             return 0
 
@@ -82,13 +362,30 @@ class PearsonSimilarity(Similarity):
 
         return numer / denom
 
+    def score_many(self, row, matrix):
+        return self.score_stats(*self.shared_stats(row, matrix))
+
+    def score_stats(self, n, sum1, sum2, sum_of_squared1, sum_of_squared2, sum_of_products):
+        """Vectorized score from arrays of shared_stats."""
+        safe_n = np.maximum(n, 1)
+
+        numer = sum_of_products - (sum1 * sum2 / safe_n)
+        denom = (np.sqrt(np.maximum(sum_of_squared1 - sum1**2 / safe_n, 0)) *
+                 np.sqrt(np.maximum(sum_of_squared2 - sum2**2 / safe_n, 0)))
+
+        valid = (n >= self._min_shared) & (denom != 0)
+
+        return np.where(valid, numer / np.where(valid, denom, 1), 0.0)
+
 class EuclideanSimilarity(Similarity):
 
-    def __init__( *args, **kwargs):
+    def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
     def score(self, pref1, pref2):
         shared_items = self.shared_items(pref1, pref2)
+        if self._stats is not None:
+            self._stats.record_scores(1, len(shared_items))
 
         if len(shared_items) < self._min_shared:
             return 0
@@ -97,4 +394,13 @@ class EuclideanSimilarity(Similarity):
 
         return 1 / (1 + sqrt(euclid_dist_sum))
 
+    def score_many(self, row, matrix):
+        return self.score_stats(*self.shared_stats(row, matrix))
+
+    def score_stats(self, n, sum1, sum2, sum_of_squared1, sum_of_squared2, sum_of_products):
+        """Vectorized score from arrays of shared_stats."""
+        euclid_dist_sum = np.maximum(sum_of_squared1 + sum_of_squared2 - 2 * sum_of_products, 0)
+
+        return np.where(n >= self._min_shared, 1 / (1 + np.sqrt(euclid_dist_sum)), 0.0)
+
 
@@ -0,0 +1,129 @@
+from itertools import islice
+
+import numpy as np
+
+
+class UserView(object):
+    """A recommender.models.User backed by the columns of a RatingTable
+    instead of its own preference dict.
+    """
+
+    __slots__ = ("_table", "_index", "_value")
+
+    def __init__(self, table, index, value):
+        self._table = table
+        self._index = index
+        self._value = value
+
+    def __repr__(self):
+        return str(self._value)
+
+    def get_id(self):
+        return self._table.user_ids[self._index]
+
+    def get_value(self):
+        return self._value
+
+    def get_preferences(self):
+        """Returns a new dict of item_id mapping to rating."""
+        items, ratings = self._table.user_ratings(self._index)
+        item_ids = self._table.item_ids
+
+        return {item_ids[item]: rating for item, rating in zip(items.tolist(), ratings.tolist())}
+
+
+class RatingTable(object):
+    """Ratings stored as parallel columns instead of one object per rating.
+
+    user_index and item_index are int32 arrays of dense indices into the
+    user_ids and item_ids lists, and ratings is a float32 array.
+    """
+
+    def __init__(self, user_index, item_index, ratings, user_ids, item_ids):
+        self.user_index = np.asarray(user_index, dtype=np.int32)
+        self.item_index = np.asarray(item_index, dtype=np.int32)
+        self.ratings = np.asarray(ratings, dtype=np.float32)
+
+        self.user_ids = list(user_ids)
+        self.item_ids = list(item_ids)
+
+        # Ratings order grouping them by user and the bounds of every user's
+        # group, built on the first user_ratings call
+        self._user_order = None
+        self._user_bounds = None
+
+    @classmethod
+    def from_rows(cls, rows, user_column, item_column, rating_column,
+                  user_type=int, item_type=str, chunk_size=100000):
+        """Parses an iterable of rows, such as a csv.reader, chunk by chunk
+        straight into columns. Only one chunk of rows is alive at a time.
+        """
+
+        user_lookup = {}
+        item_lookup = {}
+        chunks = []
+
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+
+            users = np.array([user_lookup.setdefault(user_type(row[user_column]), len(user_lookup)) for row in chunk],
+                             dtype=np.int32)
+            items = np.array([item_lookup.setdefault(item_type(row[item_column]), len(item_lookup)) for row in chunk],
+                             dtype=np.int32)
+            ratings = np.array([float(row[rating_column]) for row in chunk], dtype=np.float32)
+
+            chunks.append((users, items, ratings))
+
+        return cls.from_chunks(chunks, list(user_lookup), list(item_lookup))
+
+    @classmethod
+    def from_chunks(cls, chunks, user_ids, item_ids):
+        """Concatenates a list of (user_index, item_index, ratings) chunks."""
+
+        if not chunks:
+            return cls([], [], [], user_ids, item_ids)
+
+        return cls(np.concatenate([chunk[0] for chunk in chunks]),
+                   np.concatenate([chunk[1] for chunk in chunks]),
+                   np.concatenate([chunk[2] for chunk in chunks]),
+                   user_ids,
+                   item_ids)
+
+    def select(self, mask):
+        """Returns a table of the ratings where mask is True."""
+
+        return RatingTable(self.user_index[mask], self.item_index[mask], self.ratings[mask],
+                           self.user_ids, self.item_ids)
+
+    def user_ratings(self, index):
+        """Returns the (item indices, ratings) arrays of the user at index."""
+
+        if self._user_order is None:
+            self._user_order = np.argsort(self.user_index, kind="stable")
+            self._user_bounds = np.searchsorted(self.user_index[self._user_order], np.arange(len(self.user_ids) + 1))
+
+        rows = self._user_order[self._user_bounds[index]:self._user_bounds[index + 1]]
+        return self.item_index[rows], self.ratings[rows]
+
+    def users(self, values=None):
+        """Returns a UserView of every user, valued by the values dict of
+        user_id mapping to value or by its id.
+        """
+
+        values = values or {}
+        return [UserView(self, index, values.get(user_id, user_id)) for index, user_id in enumerate(self.user_ids)]
+
+    def to_dict(self):
+        """Returns the ratings as a dict of user_id mapping to {item_id: rating}."""
+
+        prefs = {user_id: {} for user_id in self.user_ids}
+        for user, item, rating in zip(self.user_index.tolist(), self.item_index.tolist(), self.ratings.tolist()):
+            prefs[self.user_ids[user]][self.item_ids[item]] = rating
+
+        return prefs
+
+    def __len__(self):
+        return len(self.ratings)
@@ -0,0 +1,99 @@
+import importlib
+import os
+import random
+import sys
+
+import pytest
+
+from recommender.models import User, Item
+
+
+def make_data(n_users=40, n_items=30, density=0.4, seed=1):
+    """Returns random users rating items from 1 to 5 in steps of 0.5."""
+    rnd = random.Random(seed)
+    users = []
+    for user_id in range(n_users):
+        user = User(user_id, "u%d" % user_id)
+        for item_id in range(n_items):
+            if rnd.random() < density:
+                user.add_preference(item_id, rnd.randint(2, 10) / 2)
+        users.append(user)
+
+    return users, [Item(item_id, "i%d" % item_id) for item_id in range(n_items)]
+
+
+def load(cls, users, items, **kwargs):
+    recommender = cls(**kwargs)
+    recommender.load(users, items)
+    return recommender
+
+
+def assert_same(results, expected):
+    """Asserts two lists of (value, id, score) tuples have close scores and
+    the same ids in the same order, up to the order of tied scores. Scores
+    within rounding of 0 may be left out by either side.
+    """
+    results = [result for result in results if abs(result[2]) > 1e-12]
+    expected = [result for result in expected if abs(result[2]) > 1e-12]
+
+    assert [result[2] for result in results] == pytest.approx([result[2] for result in expected])
+
+    start = 0
+    for end in range(1, len(expected) + 1):
+        if end == len(expected) or expected[end][2] != pytest.approx(expected[end - 1][2]):
+            assert {result[:2] for result in results[start:end]} == {result[:2] for result in expected[start:end]}
+            start = end
+
+
+def import_dataset(package, module):
+    """Imports the module of grouplens/package, whose models package would
+    clash with the models of the other datasets.
+    """
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "grouplens", package)
+    for name in [name for name in sys.modules if name == "models" or name.startswith("models.")]:
+        del sys.modules[name]
+
+    sys.path.insert(0, path)
+    try:
+        return importlib.import_module(module)
+    finally:
+        sys.path.remove(path)
+
+
+def write_movielens(dir_name, n_users=30, n_movies=20, density=0.3, seed=2):
+    """Writes random movies.csv and ratings.csv files to dir_name."""
+    rnd = random.Random(seed)
+    with open(os.path.join(dir_name, "movies.csv"), "w") as movies_file:
+        movies_file.write("movieId,title,genres\n")
+        for movie_id in range(1, n_movies + 1):
+            movies_file.write('%d,"Movie %d, The (1999)",Drama\n' % (movie_id, movie_id))
+
+    with open(os.path.join(dir_name, "ratings.csv"), "w") as ratings_file:
+        ratings_file.write("userId,movieId,rating,timestamp\n")
+        for user_id in range(1, n_users + 1):
+            for movie_id in range(1, n_movies + 1):
+                if rnd.random() < density:
+                    ratings_file.write("%d,%d,%.1f,1000\n" % (user_id, movie_id, rnd.randint(2, 10) / 2))
+
+
+def write_book_crossing(dir_name, n_users=30, n_books=20, density=0.3, seed=3):
+    """Writes random BX-Books.csv, BX-Users.csv and BX-Book-Ratings.csv files
+    to dir_name.
+    """
+    rnd = random.Random(seed)
+    with open(os.path.join(dir_name, "BX-Books.csv"), "w", encoding="iso-8859-1") as books_file:
+        books_file.write('"ISBN";"Book-Title";"Book-Author";"Year-Of-Publication";"Publisher"\n')
+        for book in range(n_books):
+            books_file.write('"%010d";"Book %d";"Author %d";"2001";"Publisher"\n' % (book, book, book))
+
+    with open(os.path.join(dir_name, "BX-Users.csv"), "w", encoding="iso-8859-1") as users_file:
+        users_file.write('"User-ID";"Location";"Age"\n')
+        for user_id in range(1, n_users + 1):
+            users_file.write('"%d";"city, state, usa";"%s"\n' % (user_id, "NULL" if user_id % 3 else "30"))
+
+    with open(os.path.join(dir_name, "BX-Book-Ratings.csv"), "w", encoding="iso-8859-1") as ratings_file:
+        ratings_file.write('"User-ID";"ISBN";"Book-Rating"\n')
+        for user_id in range(1, n_users + 1):
+            for book in range(n_books):
+                if rnd.random() < density:
+                    ratings_file.write('"%d";"%010d";"%d"\n' % (user_id, book, rnd.randint(0, 10)))
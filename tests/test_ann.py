@@ -0,0 +1,57 @@
+import pytest
+
+from recommender.ann import AnnSearch, MinHashIndex
+from recommender.recommend import ItemBasedRecommender, UserBasedRecommender
+
+from helpers import make_data, load
+
+RECOMMENDERS = (UserBasedRecommender, ItemBasedRecommender)
+
+
+@pytest.fixture
+def data():
+    return make_data()
+
+
+@pytest.mark.parametrize("storage", ("dict", "sparse"))
+def test_ann_recall_is_high_with_many_bands(storage, data):
+    users, items = data
+    recommender = load(ItemBasedRecommender, users, items, storage=storage,
+                       ann=AnnSearch(bands=32, band_size=1, seed=0))
+
+    recall = recommender.ann_recall(n=5, sample=20, seed=0)
+    assert set(recall) == {"users", "items"}
+    assert recall["users"] >= 0.9
+    assert recall["items"] >= 0.9
+
+
+def test_minhash_candidates_follow_updates():
+    index = MinHashIndex.from_rows({0: {1: 1, 2: 1}, 1: {1: 1, 2: 1}, 2: {7: 1}}, bands=8, band_size=1, seed=0)
+    assert 1 in index.candidates(0)
+    assert 2 not in index.candidates(0)
+
+    index.update(2, {1: 1, 2: 1})
+    assert 2 in index.candidates(0)
+
+    index.remove(2)
+    assert 2 not in index.candidates(0)
+    assert len(index) == 2
+
+
+@pytest.mark.parametrize("cls", RECOMMENDERS)
+@pytest.mark.parametrize("storage", ("dict", "sparse"))
+def test_ann_batches_match_single_queries(cls, storage, data):
+    users, items = data
+    recommender = load(cls, users, items, storage=storage, ann=AnnSearch(bands=4, band_size=2, seed=0))
+
+    user_ids = list(range(len(users)))
+    item_ids = list(range(len(items)))
+    batches = (("similar_users_batch", "similar_users", user_ids),
+               ("similar_items_batch", "similar_items", item_ids),
+               ("recommendations_batch", "recommendations", user_ids))
+
+    for batch, single, ids in batches:
+        results = dict(getattr(recommender, batch)(ids, 5, block_size=7))
+        assert list(results) == ids
+        for row_id in ids:
+            assert results[row_id] == getattr(recommender, single)(row_id, 5)
@@ -0,0 +1,40 @@
+import pytest
+
+from recommender.recommend import ItemBasedRecommender, UserBasedRecommender
+
+from helpers import make_data, load, assert_same
+
+RECOMMENDERS = (UserBasedRecommender, ItemBasedRecommender)
+
+
+@pytest.fixture
+def data():
+    return make_data()
+
+
+@pytest.mark.parametrize("cls", RECOMMENDERS)
+def test_sparse_batches_match_dict(cls, data):
+    users, items = data
+    expected = load(cls, users, items, storage="dict")
+    sparse = load(cls, users, items, storage="sparse")
+
+    user_ids = list(range(len(users)))
+    item_ids = list(range(len(items)))
+    batches = (("similar_users_batch", user_ids), ("similar_items_batch", item_ids), ("recommendations_batch", user_ids))
+
+    for method, ids in batches:
+        results = dict(getattr(sparse, method)(ids, 5, block_size=7))
+        assert list(results) == ids
+        for row_id, expected_results in getattr(expected, method)(ids, 5):
+            assert_same(results[row_id], expected_results)
+
+
+@pytest.mark.parametrize("cls", RECOMMENDERS)
+@pytest.mark.parametrize("block_size", (1, 7, 256))
+def test_sparse_batches_match_single_queries(cls, block_size, data):
+    users, items = data
+    recommender = load(cls, users, items, storage="sparse")
+
+    user_ids = list(range(len(users)))[::-1]
+    for user_id, results in recommender.recommendations_batch(user_ids, 5, block_size=block_size):
+        assert_same(results, recommender.recommendations(user_id, 5))
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from recommender.recommend import ItemBasedRecommender, UserBasedRecommender
+
+from helpers import make_data, load
+
+RECOMMENDERS = (UserBasedRecommender, ItemBasedRecommender)
+
+
+@pytest.fixture
+def data():
+    return make_data()
+
+
+@pytest.mark.parametrize("cls", RECOMMENDERS)
+@pytest.mark.parametrize("storage", ("dict", "sparse"))
+@pytest.mark.parametrize("score_dtype", ("float16", "int8"))
+@pytest.mark.parametrize("mmap", (True, False))
+def test_compact_index_round_trip(cls, storage, score_dtype, mmap, data, tmp_path):
+    users, items = data
+    path = str(tmp_path / "index.bin")
+    saved = load(cls, users, items, storage=storage, memorize=True, neighbours=10, score_dtype=score_dtype)
+    saved.save_index(path)
+
+    loaded = load(cls, users, items, storage=storage)
+    loaded.load_index(path, mmap=mmap)
+
+    for name in ("_user_similarities", "_item_similarities"):
+        expected, index = getattr(saved, name), getattr(loaded, name)
+        assert index.scores.dtype == np.dtype(score_dtype)
+        assert index.scale == expected.scale
+        assert np.array_equal(index.indices, expected.indices)
+        assert np.array_equal(index.scores, expected.scores)
+
+    for user_id in range(len(users)):
+        assert loaded.similar_users(user_id, 5) == saved.similar_users(user_id, 5)
+        assert loaded.recommendations(user_id, 5) == saved.recommendations(user_id, 5)
+    for item_id in range(len(items)):
+        assert loaded.similar_items(item_id, 5) == saved.similar_items(item_id, 5)
+
+
+@pytest.mark.parametrize("score_dtype, tolerance", (("float16", 1e-3), ("int8", 1 / 254)))
+def test_compact_scores_stay_close_to_exact(score_dtype, tolerance, data):
+    users, items = data
+    exact = load(UserBasedRecommender, users, items, storage="sparse", memorize=True, neighbours=10)
+    compact = load(UserBasedRecommender, users, items, storage="sparse", memorize=True, neighbours=10,
+                   score_dtype=score_dtype)
+
+    for user_id in range(len(users)):
+        results, expected = compact.similar_users(user_id, 10), exact.similar_users(user_id, 10)
+        # Quantizing keeps the neighbours and their order
+        assert [result[1] for result in results] == [result[1] for result in expected]
+        assert [result[2] for result in results] == pytest.approx([result[2] for result in expected], abs=tolerance)
@@ -0,0 +1,64 @@
+import csv
+
+import numpy as np
+import pytest
+
+from grouplens.ingest import byte_ranges, read_rating_table
+from recommender.table import RatingTable
+
+from helpers import import_dataset, write_movielens
+
+
+def assert_same_table(table, expected):
+    assert table.user_ids == expected.user_ids
+    assert table.item_ids == expected.item_ids
+    assert np.array_equal(table.user_index, expected.user_index)
+    assert np.array_equal(table.item_index, expected.item_index)
+    assert np.array_equal(table.ratings, expected.ratings)
+
+
+@pytest.fixture
+def ratings_path(tmp_path):
+    write_movielens(str(tmp_path), n_users=60)
+    return str(tmp_path / "ratings.csv")
+
+
+@pytest.mark.parametrize("parts", (1, 2, 7, 1000))
+def test_byte_ranges_cover_whole_lines(ratings_path, parts):
+    with open(ratings_path, "rb") as ratings_file:
+        data = ratings_file.read()
+    header = data.index(b"\n") + 1
+
+    ranges = byte_ranges(ratings_path, parts)
+    assert len(ranges) <= parts
+    assert ranges[0][0] == header
+    assert ranges[-1][1] == len(data)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+        assert data[end - 1:end] == b"\n"
+
+
+@pytest.mark.parametrize("workers, chunk_bytes", ((1, 256), (2, 256), (2, 1 << 24)))
+def test_parallel_ingest_matches_serial(ratings_path, workers, chunk_bytes):
+    with open(ratings_path) as ratings_file:
+        reader = csv.reader(ratings_file)
+        next(reader)
+        expected = RatingTable.from_rows(reader, 0, 1, 2, user_type=int, item_type=int)
+
+    table = read_rating_table(ratings_path, 0, 1, 2, user_type=int, item_type=int,
+                              workers=workers, chunk_bytes=chunk_bytes)
+    assert_same_table(table, expected)
+
+
+def test_movielens_parallel_load_matches_serial(tmp_path):
+    MovieLens = import_dataset("movielens", "MovieLens").MovieLens
+    write_movielens(str(tmp_path), n_users=60)
+
+    serial = MovieLens()
+    serial.load_from_dir(str(tmp_path), columnar=True)
+    parallel = MovieLens()
+    parallel.load_from_dir(str(tmp_path), columnar=True, workers=2)
+
+    assert_same_table(parallel.get_rating_table(), serial.get_rating_table())
+    assert ([item.get_value() for item in parallel.get_recommender_items()] ==
+            [item.get_value() for item in serial.get_recommender_items()])
@@ -0,0 +1,21 @@
+import pickle
+
+from recommender.instrumentation import Stats
+from recommender.recommend import ItemBasedRecommender
+
+from helpers import make_data, load
+
+
+def test_pickled_copies_are_not_instrumented():
+    users, items = make_data()
+    recommender = load(ItemBasedRecommender, users, items, storage="sparse")
+    stats = recommender.instrument(Stats())
+
+    restored = pickle.loads(pickle.dumps(recommender))
+    assert restored._stats is None
+    assert restored.get_similarity()._stats is None
+    assert restored.recommendations(0, 5) == recommender.recommendations(0, 5)
+
+    # Only the original counts its queries
+    assert restored.recommendations(1, 5)
+    assert stats.counters["path_full"] == 1
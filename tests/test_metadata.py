@@ -0,0 +1,91 @@
+import pytest
+
+from grouplens import metadata
+from grouplens.metadata import CsvIndex, LazyItem
+
+from helpers import import_dataset, write_book_crossing, write_movielens
+
+
+def items(dataset):
+    return [(item.get_id(), item.get_value()) for item in dataset.get_recommender_items()]
+
+
+def users(dataset):
+    return {user.get_id(): (user.get_value(), dict(user.get_preferences())) for user in dataset.get_recommender_users()}
+
+
+@pytest.fixture
+def movies_path(tmp_path):
+    write_movielens(str(tmp_path))
+    return str(tmp_path / "movies.csv")
+
+
+def test_csv_index_rows_read_through_one_handle(movies_path, monkeypatch):
+    index = CsvIndex(movies_path, key_type=int)
+    expected = {key: index.fields(key) for key in index}
+    assert expected[3] == ["3", "Movie 3, The (1999)", "Drama"]
+
+    opened = []
+    monkeypatch.setattr(metadata, "open", lambda *args: opened.append(args) or open(*args), raising=False)
+    assert dict(index.rows()) == expected
+    assert dict(index.rows([5, 2])) == {5: expected[5], 2: expected[2]}
+    assert len(opened) == 2
+
+
+def test_csv_index_from_offsets(movies_path):
+    index = CsvIndex(movies_path, key_type=int)
+    restored = CsvIndex.from_offsets(movies_path, index.get_offsets())
+
+    assert list(restored) == list(index)
+    assert dict(restored.rows()) == dict(index.rows())
+
+
+@pytest.mark.parametrize("saved_lazy", (False, True))
+def test_movielens_lazy_restore(tmp_path, monkeypatch, saved_lazy):
+    MovieLens = import_dataset("movielens", "MovieLens").MovieLens
+    write_movielens(str(tmp_path))
+    cache_path = str(tmp_path / "movielens.npz")
+
+    parsed = MovieLens()
+    parsed.load_from_dir(str(tmp_path), cache_path=cache_path, lazy=saved_lazy)
+
+    eager = MovieLens()
+    eager.load_from_dir(str(tmp_path), cache_path=cache_path)
+    assert not any(isinstance(item, LazyItem) for item in eager.get_recommender_items())
+
+    if saved_lazy:
+        # The offsets come from the snapshot instead of a scan of the file
+        monkeypatch.setattr(CsvIndex, "__init__", None)
+
+    lazy = MovieLens()
+    lazy.load_from_dir(str(tmp_path), cache_path=cache_path, lazy=True)
+    assert all(isinstance(item, LazyItem) for item in lazy.get_recommender_items())
+    assert lazy.get_movie(4).get_title() == "Movie 4, The (1999)"
+
+    assert items(lazy) == items(eager) == items(parsed)
+    assert users(lazy) == users(eager) == users(parsed)
+
+
+@pytest.mark.parametrize("saved_lazy", (False, True))
+def test_book_crossing_lazy_restore(tmp_path, monkeypatch, saved_lazy):
+    BookCrossing = import_dataset("book_crossing", "BookCrossing").BookCrossing
+    write_book_crossing(str(tmp_path))
+    cache_path = str(tmp_path / "book_crossing.npz")
+
+    parsed = BookCrossing()
+    parsed.load_from_dir(str(tmp_path), columnar=True, cache_path=cache_path, lazy=saved_lazy)
+
+    eager = BookCrossing()
+    eager.load_from_dir(str(tmp_path), cache_path=cache_path)
+
+    if saved_lazy:
+        monkeypatch.setattr(CsvIndex, "__init__", None)
+
+    lazy = BookCrossing()
+    lazy.load_from_dir(str(tmp_path), cache_path=cache_path, lazy=True)
+    assert all(isinstance(item, LazyItem) for item in lazy.get_recommender_items())
+    assert lazy.get_user(3).get_age() == "30"
+    assert lazy.get_book("0000000002").get_title() == "Book 2"
+
+    assert items(lazy) == items(eager) == items(parsed)
+    assert users(lazy) == users(eager) == users(parsed)
@@ -0,0 +1,77 @@
+import copy
+import pickle
+import random
+
+import pytest
+
+from recommender.matrix import RatingMatrix
+from recommender.models import User, Item
+from recommender.recommend import ItemBasedRecommender
+from recommender.similarity import CosineSimilarity
+
+
+def make_preferences(n_rows=30, n_cols=20, density=0.5, seed=1):
+    rnd = random.Random(seed)
+    return {row_id: {col_id: rnd.randint(2, 10) / 2 for col_id in range(n_cols) if rnd.random() < density}
+            for row_id in range(n_rows)}
+
+
+@pytest.mark.parametrize("centre", ("columns", "rows"))
+def test_cosine_scores_rows_of_copied_matrices(centre):
+    preferences = make_preferences()
+    similarity = CosineSimilarity(min_shared=2, centre=centre)
+    similarity.prepare(preferences)
+
+    # A copy is a different matrix, prepared on first use
+    copied = copy.deepcopy(preferences)
+    sparse = RatingMatrix.from_dict(preferences)
+    expected = similarity.score_many(sparse.row_index(0), sparse)
+
+    for row_id in preferences:
+        score = expected[sparse.row_index(row_id)] if row_id != 0 else None
+        if score is not None:
+            assert similarity.score_rows(preferences, 0, row_id) == pytest.approx(score)
+            assert similarity.score_rows(copied, 0, row_id) == pytest.approx(score)
+
+
+def test_cosine_needs_a_matrix_to_centre_on_columns():
+    preferences = make_preferences()
+    with pytest.raises(ValueError):
+        CosineSimilarity().score(preferences[0], preferences[1])
+
+    # Centring on row means needs the rows only
+    similarity = CosineSimilarity(min_shared=2, centre="rows")
+    for row_id in range(1, 10):
+        expected = similarity.score_rows(preferences, 0, row_id)
+        assert similarity.score(preferences[0], preferences[row_id]) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("storage", ("dict", "sparse"))
+def test_cosine_is_prepared_once_per_load(storage, monkeypatch):
+    preferences = make_preferences()
+    users = []
+    for user_id, prefs in preferences.items():
+        user = User(user_id, "u%d" % user_id)
+        for item_id, rating in prefs.items():
+            user.add_preference(item_id, rating)
+        users.append(user)
+    items = [Item(item_id, "i%d" % item_id) for item_id in range(20)]
+
+    prepared = []
+    prepare = CosineSimilarity.prepare
+    monkeypatch.setattr(CosineSimilarity, "prepare", lambda self, matrix: prepared.append(matrix) or prepare(self, matrix))
+
+    similarity = CosineSimilarity(min_shared=2)
+    recommender = ItemBasedRecommender(storage=storage, memorize=True, neighbourhood=5, similarity=similarity)
+    recommender.load(users, items)
+    recommender.load(users, items)
+    assert len(prepared) == 4
+    assert len(similarity._prepared) == 2
+
+    # Unpickled similarities find their matrices again
+    recommender = ItemBasedRecommender(storage=storage, similarity=CosineSimilarity(min_shared=2))
+    recommender.load(users, items)
+    restored = pickle.loads(pickle.dumps(recommender))
+    assert restored.recommendations(0, 5) == recommender.recommendations(0, 5)
+    assert restored.similar_users(0, 5) == recommender.similar_users(0, 5)
+    assert len(prepared) == 6
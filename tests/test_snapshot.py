@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+import pytest
+
+from grouplens.cache import load_snapshot, save_snapshot
+
+from helpers import import_dataset, write_movielens
+
+
+@pytest.fixture
+def MovieLens():
+    return import_dataset("movielens", "MovieLens").MovieLens
+
+
+def dataset_contents(dataset):
+    users = {user.get_id(): dict(user.get_preferences()) for user in dataset.get_recommender_users()}
+    items = {item.get_id(): item.get_value() for item in dataset.get_recommender_items()}
+    return users, items
+
+
+def test_snapshot_is_ignored_once_a_source_changes(tmp_path):
+    source = tmp_path / "ratings.csv"
+    source.write_text("1,2,3\n")
+    path = str(tmp_path / "snapshot.npz")
+
+    assert load_snapshot(path, [str(source)]) is None
+    save_snapshot(path, [str(source)], {"values": np.arange(3)})
+    assert load_snapshot(path, [str(source)])["values"].tolist() == [0, 1, 2]
+
+    source.write_text("1,2,3\n4,5,6\n")
+    assert load_snapshot(path, [str(source)]) is None
+
+    # A corrupt snapshot is a miss too
+    with open(path, "wb") as snapshot_file:
+        snapshot_file.write(b"not a snapshot")
+    assert load_snapshot(path, [str(source)]) is None
+
+
+@pytest.mark.parametrize("columnar", (False, True))
+def test_movielens_snapshot_round_trip(MovieLens, tmp_path, columnar):
+    write_movielens(str(tmp_path))
+    cache_path = str(tmp_path / "movielens.npz")
+
+    parsed = MovieLens()
+    parsed.load_from_dir(str(tmp_path), columnar=columnar, cache_path=cache_path)
+    assert os.path.exists(cache_path)
+
+    cached = MovieLens()
+    sources = [str(tmp_path / "movies.csv"), str(tmp_path / "ratings.csv")]
+    assert cached.load_cache(cache_path, sources)
+    assert dataset_contents(cached) == dataset_contents(parsed)
+
+
+def test_movielens_snapshot_is_rebuilt_after_a_change(MovieLens, tmp_path):
+    write_movielens(str(tmp_path))
+    cache_path = str(tmp_path / "movielens.npz")
+    MovieLens().load_from_dir(str(tmp_path), cache_path=cache_path)
+
+    with open(str(tmp_path / "ratings.csv"), "a") as ratings_file:
+        ratings_file.write("1000,1,5.0,1000\n")
+
+    dataset = MovieLens()
+    dataset.load_from_dir(str(tmp_path), cache_path=cache_path)
+    users, _ = dataset_contents(dataset)
+    assert users[1000] == {1: 5.0}
+
+    cached = MovieLens()
+    cached.load_from_dir(str(tmp_path), cache_path=cache_path)
+    assert dataset_contents(cached) == dataset_contents(dataset)
+
+
+def test_movielens_snapshot_is_not_saved_after_a_failed_load(MovieLens, tmp_path):
+    write_movielens(str(tmp_path))
+    os.remove(str(tmp_path / "movies.csv"))
+    cache_path = str(tmp_path / "movielens.npz")
+
+    MovieLens().load_from_dir(str(tmp_path), cache_path=cache_path)
+    assert not os.path.exists(cache_path)
@@ -0,0 +1,27 @@
+import pytest
+
+from recommender.recommend import ItemBasedRecommender, UserBasedRecommender
+
+from helpers import make_data, load, assert_same
+
+RECOMMENDERS = (UserBasedRecommender, ItemBasedRecommender)
+
+
+@pytest.fixture
+def data():
+    return make_data()
+
+
+@pytest.mark.parametrize("cls", RECOMMENDERS)
+def test_sparse_matches_dict(cls, data):
+    users, items = data
+    expected = load(cls, users, items, storage="dict")
+    sparse = load(cls, users, items, storage="sparse")
+
+    for user_id in range(len(users)):
+        assert_same(sparse.similar_users(user_id, 5), expected.similar_users(user_id, 5))
+        assert_same(sparse.recommendations(user_id, 5), expected.recommendations(user_id, 5))
+
+    for item_id in range(len(items)):
+        assert_same(sparse.similar_items(item_id, 5), expected.similar_items(item_id, 5))
+
@@ -0,0 +1,87 @@
+import copy
+import random
+
+import pytest
+
+from recommender.recommend import ItemBasedRecommender, UserBasedRecommender
+from recommender.similarity import CosineSimilarity, PearsonSimilarity
+
+from helpers import make_data, load, assert_same
+
+RECOMMENDERS = (UserBasedRecommender, ItemBasedRecommender)
+
+SIMILARITIES = {"pearson": lambda: PearsonSimilarity(),
+                "cosine": lambda: CosineSimilarity(),
+                "cosine-rows": lambda: CosineSimilarity(centre="rows")}
+
+
+def change_ratings(recommender, users, n_items, changes=20, seed=2):
+    """Adds, updates and removes random ratings through recommender and
+    mirrors them in users.
+    """
+    rnd = random.Random(seed)
+    for _ in range(changes):
+        user = rnd.choice(users)
+        item_id = rnd.randrange(n_items)
+        if item_id not in user.get_preferences():
+            rating = rnd.randint(2, 10) / 2
+            recommender.add_rating(user.get_id(), item_id, rating)
+            user.add_preference(item_id, rating)
+        elif rnd.random() < 0.5:
+            rating = rnd.randint(2, 10) / 2
+            recommender.update_rating(user.get_id(), item_id, rating)
+            user.add_preference(item_id, rating)
+        else:
+            recommender.remove_rating(user.get_id(), item_id)
+            del user.get_preferences()[item_id]
+
+
+def assert_reloaded(recommender, expected, users, items):
+    # Whole rankings, as ties at a cut-off may keep either row
+    n = len(users) + len(items)
+    for user_id in range(len(users)):
+        assert_same(recommender.similar_users(user_id, n), expected.similar_users(user_id, n))
+        assert_same(recommender.recommendations(user_id, n), expected.recommendations(user_id, n))
+
+    for item_id in range(len(items)):
+        assert_same(recommender.similar_items(item_id, n), expected.similar_items(item_id, n))
+
+
+@pytest.mark.parametrize("cls", RECOMMENDERS)
+@pytest.mark.parametrize("storage", ("dict", "sparse"))
+@pytest.mark.parametrize("similarity", sorted(SIMILARITIES))
+@pytest.mark.parametrize("options", ({},
+                                     {"memorize": True},
+                                     {"memorize": True, "incremental": True},
+                                     {"memorize": True, "neighbours": 5},
+                                     {"memorize": True, "neighbours": 5, "incremental": True},
+                                     {"memorize": True, "score_dtype": "float32", "neighbours": 5}))
+def test_rating_changes_match_reload(cls, storage, similarity, options):
+    users, items = make_data()
+    # Dict storage shares the preference dicts of the users it loads
+    recommender = load(cls, copy.deepcopy(users), items, storage=storage,
+                       similarity=SIMILARITIES[similarity](), **options)
+
+    change_ratings(recommender, users, len(items))
+
+    expected = load(cls, users, items, storage=storage, similarity=SIMILARITIES[similarity](), **options)
+    assert_reloaded(recommender, expected, users, items)
+
+
+@pytest.mark.parametrize("storage", ("dict", "sparse"))
+@pytest.mark.parametrize("similarity", sorted(SIMILARITIES))
+@pytest.mark.parametrize("neighbourhood", (3, 10))
+def test_rating_changes_match_reload_with_neighbourhoods(storage, similarity, neighbourhood):
+    users, items = make_data()
+    recommender = load(ItemBasedRecommender, copy.deepcopy(users), items, storage=storage,
+                       similarity=SIMILARITIES[similarity](), neighbourhood=neighbourhood)
+
+    # Dict neighbourhoods are computed on first use
+    for user_id in range(len(users)):
+        recommender.recommendations(user_id, 5)
+
+    change_ratings(recommender, users, len(items))
+
+    expected = load(ItemBasedRecommender, users, items, storage=storage,
+                    similarity=SIMILARITIES[similarity](), neighbourhood=neighbourhood)
+    assert_reloaded(recommender, expected, users, items)